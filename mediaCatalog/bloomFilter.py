@@ -0,0 +1,145 @@
+import os
+import math
+import struct
+import hashlib
+
+from .utils import hashFile
+
+
+class BloomFilter(object):
+    ''' Bloom filter over byte string keys. Membership tests have no false
+        negatives, and false positives at about the rate it was sized for.
+    '''
+    HEADER = struct.Struct('<QII')
+
+    def __init__(self, numBits, numHashes, bits=None, count=0):
+        ''' :param numBits: (int) Size of the bit array
+            :param numHashes: (int) Number of bits set per key
+        '''
+        self.numBits = max(8, numBits)
+        self.numHashes = max(1, numHashes)
+        self.bits = bits if bits is not None else bytearray((self.numBits + 7)//8)
+        self.count = count
+
+    @classmethod
+    def fromCapacity(cls, capacity, falsePositiveRate=0.001):
+        ''' Create a filter sized for capacity keys at the given false positive rate '''
+        capacity = max(1, capacity)
+        numBits = math.ceil(-capacity*math.log(falsePositiveRate)/math.log(2)**2)
+        numHashes = round(numBits/capacity*math.log(2))
+        return cls(numBits, numHashes)
+
+    def add(self, key):
+        for index in self._indices(key):
+            self.bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[index >> 3] & (1 << (index & 7)) for index in self._indices(key))
+
+    def __len__(self):
+        return self.count
+
+    def _indices(self, key):
+        # Double hashing (Kirsch-Mitzenmacher) from one 128 bit digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return ((h1 + i*h2) % self.numBits for i in range(self.numHashes))
+
+    def write(self, f):
+        f.write(self.HEADER.pack(self.numBits, self.numHashes, self.count))
+        f.write(self.bits)
+
+    @classmethod
+    def read(cls, f):
+        header = f.read(cls.HEADER.size)
+        if len(header) != cls.HEADER.size:
+            raise ValueError('Truncated Bloom filter!')
+        numBits, numHashes, count = cls.HEADER.unpack(header)
+        bits = bytearray(f.read((numBits + 7)//8))
+        if len(bits) != (numBits + 7)//8:
+            raise ValueError('Truncated Bloom filter!')
+        return cls(numBits, numHashes, bits, count)
+
+
+class ArchiveFilter(object):
+    ''' Compact, portable summary of what a catalog holds, for checking whether
+        files are archived without carrying catalog.db. It has two Bloom
+        filters: one of file sizes, so most new files are ruled out without
+        being read, and one of checksum and size pairs. A negative answer is
+        certain; a positive one may be confirmed with the catalog database.
+    '''
+    MAGIC = b'MCATBF01'
+    DEFAULT_FALSE_POSITIVE_RATE = 0.001
+
+    def __init__(self, sizeFilter, fileFilter, checksumMode='SHA256'):
+        self.sizeFilter = sizeFilter
+        self.fileFilter = fileFilter
+        self.checksumMode = checksumMode
+
+    @classmethod
+    def fromCatalog(cls, catalogDb, checksumMode='SHA256', falsePositiveRate=None):
+        ''' Build the filters from every checksum and size in a CatalogDatabase '''
+        falsePositiveRate = falsePositiveRate if falsePositiveRate else cls.DEFAULT_FALSE_POSITIVE_RATE
+        capacity = catalogDb.getFileCount()
+        archiveFilter = cls(BloomFilter.fromCapacity(capacity, falsePositiveRate),
+                            BloomFilter.fromCapacity(capacity, falsePositiveRate), checksumMode)
+        sizes = set()
+        for checksum, fileSize in catalogDb.iterChecksums():
+            if fileSize not in sizes:
+                sizes.add(fileSize)
+                archiveFilter.sizeFilter.add(cls._sizeKey(fileSize))
+            archiveFilter.fileFilter.add(cls._fileKey(checksum, fileSize))
+        return archiveFilter
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(self.checksumMode.encode('ascii').ljust(8, b'\x00'))
+            self.sizeFilter.write(f)
+            self.fileFilter.write(f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f'Not an archive filter: {path}')
+            checksumMode = f.read(8).rstrip(b'\x00').decode('ascii')
+            sizeFilter = BloomFilter.read(f)
+            fileFilter = BloomFilter.read(f)
+        return cls(sizeFilter, fileFilter, checksumMode)
+
+    def classify(self, path, catalogDb=None):
+        ''' Check whether a file is archived. Files with a size no cataloged file has 
+            are not read.
+
+            :param path: (str) File to check
+            :param catalogDb: CatalogDatabase to confirm positives with, if available
+            :returns: (str) new, archived, or probably archived without catalogDb
+        '''
+        fileSize = os.path.getsize(path)
+        if not self.mayHaveSize(fileSize):
+            return 'new'
+        checksum = hashFile(path, self.checksumMode)
+        if not self.mayHaveFile(checksum, fileSize):
+            return 'new'
+        if catalogDb is None:
+            return 'probably archived'
+        return 'archived' if catalogDb.existsChecksum(checksum) else 'new'
+
+    def mayHaveSize(self, fileSize):
+        ''' False if no cataloged file has this size '''
+        return self._sizeKey(fileSize) in self.sizeFilter
+
+    def mayHaveFile(self, checksum, fileSize):
+        ''' False if no cataloged file has this checksum and size '''
+        return self._fileKey(checksum, fileSize) in self.fileFilter
+
+    @staticmethod
+    def _sizeKey(fileSize):
+        return struct.pack('<Q', fileSize)
+
+    @staticmethod
+    def _fileKey(checksum, fileSize):
+        return bytes.fromhex(checksum) + struct.pack('<Q', fileSize)
@@ -7,8 +7,42 @@ import csv
 from .utils import getPreciseCaptureTimeFromExif
 
 class CatalogDatabase(object):
-    SCHEMA_VERSION = Version('1.0.0')
+    SCHEMA_VERSION = Version('1.5.0')
+    # Rows fetched at a time when streaming records
+    ITERATE_BATCH_SIZE = 1000
+    ORDER_BY_COLUMNS = ['file.id', 'checksum', 'directory', 'cloud_object_name', 'last_verified_local', 'last_verified_cloud']
+    VERIFY_LOCATIONS = ['local', 'cloud']
+    BATCH_KEY_TYPES = ['checksum', 'path', 'filename']
     MIN_SCHEMA_VERSION = Version('0.1.0')
+    # Columns of a file record, as returned by read() and iterRecords(), and the tables they are joined from
+    RECORD_COLUMNS = '''file.id,
+                    checksum,
+                    file_name,
+                    directory,
+                    host.id as host_id,
+                    host.name as host_name,
+                    file_size,
+                    file_modify_datetime,
+                    mime_type.type as file_mime_type,
+                    capture_device.id as capture_device_id,
+                    capture_device.make as capture_device_make,
+                    capture_device.model as capture_device_model,
+                    capture_device.serial_number as capture_device_serial_number,
+                    capture_datetime,
+                    cloud_storage.id as cloud_storage_id,
+                    cloud_storage.name as cloud_name,
+                    cloud_storage.bucket as cloud_bucket,
+                    cloud_object_name,
+                    cloud_object_checksum,
+                    last_verified_local,
+                    last_verified_cloud
+            '''
+    RECORD_JOINS = '''
+                LEFT JOIN host on file.host_id = host.id
+                LEFT JOIN mime_type on file.file_mime_type_id = mime_type.id
+                LEFT JOIN capture_device on file.capture_device_id = capture_device.id
+                LEFT JOIN cloud_storage on file.cloud_storage_id = cloud_storage.id
+            '''
 
     def __init__(self, dbPath):
         self.dbPath = os.path.abspath(dbPath)
@@ -53,8 +87,45 @@ class CatalogDatabase(object):
         if db_version > self.SCHEMA_VERSION:
             raise Exception(f'Database schema version ({db_version}) is too new! Need {self.MIN_self.SCHEMA_VERSION} to {SCHEMA_VERSION}!')
 
+        if db_version < self.SCHEMA_VERSION:
+            self._migrate_db(db_version)
+
         return True
 
+    def _migrate_db(self, db_version):
+        print(f'Migrating database schema from {db_version} to {self.SCHEMA_VERSION}...')
+        if db_version < Version('1.1.0'):
+            self._create_upload_session_table()
+        if db_version < Version('1.2.0'):
+            self._create_cloud_inventory_tables()
+        if db_version < Version('1.3.0'):
+            self._create_cloud_object_name_index()
+        if db_version < Version('1.4.0'):
+            for location in self.VERIFY_LOCATIONS:
+                self.cursor.execute(f'ALTER TABLE file ADD COLUMN last_verified_{location} DATETIME NULL')
+            self._create_last_verified_indexes()
+        if db_version < Version('1.5.0'):
+            self._create_inode_checksum_table()
+
+        self.cursor.execute(
+            '''UPDATE schema_version 
+                SET valid_to = DATETIME('now') 
+                WHERE valid_to IS NULL
+            '''
+            )
+        self._insert_schema_version()
+        self.connection.commit()
+
+    def _insert_schema_version(self):
+        self.cursor.execute(
+            '''INSERT INTO schema_version
+                (valid_from, valid_to, major, minor, patch)
+                VALUES
+                (DATETIME('now'), NULL, ?, ?, ?)
+            ''',
+            (self.SCHEMA_VERSION.major, self.SCHEMA_VERSION.minor, self.SCHEMA_VERSION.micro)
+            )
+
     def _init_db(self):
         self.cursor.execute(
             '''CREATE TABLE schema_version 
@@ -69,14 +140,7 @@ class CatalogDatabase(object):
             '''
             )
 
-        self.cursor.execute(
-            '''INSERT INTO schema_version
-                (valid_from, valid_to, major, minor, patch)
-                VALUES
-                (DATETIME('now'), NULL, ?, ?, ?)
-            ''',
-            (self.SCHEMA_VERSION.major, self.SCHEMA_VERSION.minor, self.SCHEMA_VERSION.micro)
-            )
+        self._insert_schema_version()
 
         self.cursor.execute(
             # TODO add mac address support
@@ -138,6 +202,8 @@ class CatalogDatabase(object):
                     cloud_storage_id INTEGER NULL,
                     cloud_object_name TEXT NULL,
                     cloud_object_checksum BLOB NULL,
+                    last_verified_local DATETIME NULL,
+                    last_verified_cloud DATETIME NULL,
                     FOREIGN KEY(host_id) REFERENCES host(id) ON DELETE SET NULL,
                     FOREIGN KEY(file_mime_type_id) REFERENCES mime_type(id) ON DELETE SET NULL,
                     FOREIGN KEY(capture_device_id) REFERENCES capture_device(id) ON DELETE SET NULL,
@@ -147,8 +213,93 @@ class CatalogDatabase(object):
             '''
             )        
 
+        self._create_upload_session_table()
+        self._create_cloud_inventory_tables()
+        self._create_cloud_object_name_index()
+        self._create_last_verified_indexes()
+        self._create_inode_checksum_table()
+
         self.connection.commit()
 
+    def _create_upload_session_table(self):
+        # Resumable upload sessions, so interrupted uploads of large files can be continued
+        self.cursor.execute(
+            '''CREATE TABLE upload_session
+                (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cloud_storage_id INTEGER NOT NULL,
+                    object_name TEXT NOT NULL,
+                    source_path TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    session_uri TEXT NOT NULL,
+                    bytes_uploaded INTEGER NOT NULL,
+                    created_datetime DATETIME NOT NULL,
+                    updated_datetime DATETIME NOT NULL,
+                    FOREIGN KEY(cloud_storage_id) REFERENCES cloud_storage(id) ON DELETE CASCADE,
+                    UNIQUE(cloud_storage_id, object_name)
+                )
+            '''
+            )
+
+    def _create_cloud_inventory_tables(self):
+        # Local copy of the cloud bucket listing, so cloud verification doesn't need to list the bucket
+        self.cursor.execute(
+            '''CREATE TABLE cloud_object
+                (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cloud_storage_id INTEGER NOT NULL,
+                    object_name TEXT NOT NULL,
+                    object_size INTEGER NOT NULL,
+                    object_checksum BLOB NULL,
+                    generation INTEGER NULL,
+                    updated_datetime DATETIME NOT NULL,
+                    FOREIGN KEY(cloud_storage_id) REFERENCES cloud_storage(id) ON DELETE CASCADE,
+                    UNIQUE(cloud_storage_id, object_name)
+                )
+            '''
+            )
+
+        self.cursor.execute(
+            '''CREATE TABLE cloud_inventory
+                (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cloud_storage_id INTEGER NOT NULL,
+                    prefix TEXT NOT NULL,
+                    refreshed_datetime DATETIME NOT NULL,
+                    FOREIGN KEY(cloud_storage_id) REFERENCES cloud_storage(id) ON DELETE CASCADE,
+                    UNIQUE(cloud_storage_id, prefix)
+                )
+            '''
+            )
+
+    def _create_cloud_object_name_index(self):
+        # Lets verification stream the catalog in cloud object name order without sorting it
+        self.cursor.execute('CREATE INDEX file_cloud_object_name ON file(cloud_object_name)')
+
+    def _create_last_verified_indexes(self):
+        # Rolling verification reads the files that were verified longest ago first
+        for location in self.VERIFY_LOCATIONS:
+            self.cursor.execute(f'CREATE INDEX file_last_verified_{location} ON file(last_verified_{location})')
+
+    def _create_inode_checksum_table(self):
+        # Checksums of hardlinked files by inode, so every link is hashed with one read
+        self.cursor.execute(
+            '''CREATE TABLE inode_checksum
+                (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    host_id INTEGER NOT NULL,
+                    device INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    modify_time_ns INTEGER NOT NULL,
+                    checksum BLOB NOT NULL,
+                    updated_datetime DATETIME NOT NULL,
+                    FOREIGN KEY(host_id) REFERENCES host(id) ON DELETE CASCADE,
+                    UNIQUE(host_id, device, inode)
+                )
+            '''
+            )
+
     def write(self, metadata, updateMode=False):
         hostId = self.getHostId(metadata['HostName'], insert=True)
         mimeTypeId = self.getMimeTypeId(metadata['File:MIMEType'], insert=True)
@@ -217,36 +368,126 @@ class CatalogDatabase(object):
             :param all: Return all records in the database - ignores all other query filters
             :returns list: List of records matching the query
         '''
+        command, values = self._readQuery(checksum, filename, directory, hostname, all)
+        self.cursor.execute(command, values)
+
+        records = self.cursor.fetchall()
+        if len(records) == 0 and not all:
+            errorMessage = 'File not found in database with '
+            tokens = []
+            if checksum is not None:
+                tokens.append(f'checksum: {checksum}')
+            if filename is not None:
+                tokens.append(f'filename: {filename}')
+            if directory is not None:
+                tokens.append(f'directory: {directory}')
+            if hostname is not None:
+                tokens.append(f'hostname: {hostname}')
+            errorMessage += ', '.join(tokens) + ' !'
+            raise KeyError(errorMessage)
+
+        return records
+
+    def iterRecords(self, checksum=None, filename=None, directory=None, hostname=None, all=False, orderBy='file.id'):
+        '''Yields the records matching the query without loading them all into memory.
+            Takes the same query filters as read(), but doesn't raise if nothing matches.
+            The records are read with their own cursor, so other queries can run while iterating.
+
+            :param orderBy: Column, or list of columns, to order the records by - from ORDER_BY_COLUMNS
+        '''
+        orderBy = [orderBy] if isinstance(orderBy, str) else orderBy
+        for column in orderBy:
+            if column not in self.ORDER_BY_COLUMNS:
+                raise ValueError(f'Invalid orderBy ({column})! Valid columns are: {self.ORDER_BY_COLUMNS}')
+        command, values = self._readQuery(checksum, filename, directory, hostname, all)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(command + f' ORDER BY {", ".join(orderBy)}', values)
+            while True:
+                records = cursor.fetchmany(self.ITERATE_BATCH_SIZE)
+                if not records:
+                    break
+                yield from records
+        finally:
+            cursor.close()
+
+    def iterRecordsBatch(self, keys, keyType='checksum', hostname=None):
+        ''' Yields the records of many checksums, paths or filenames at once. The keys are
+            loaded into a temporary table and joined with the file table, so the lookups
+            take a few statements instead of one query per key. Wildcards aren't supported,
+            and only one batch may be iterated at a time per connection.
+
+            :param keys: Iterable of checksums, paths or filenames - may be a generator
+            :param keyType: (str) checksum, path or filename - from BATCH_KEY_TYPES
+            :param hostname: (str) Only match files on this host
+            :returns: Generator of (key, record) in the order of the keys - one per matching
+                      record, or (key, None) if no record matches. The records have the
+                      columns of iterRecords() and query_key.
+        '''
+        if keyType not in self.BATCH_KEY_TYPES:
+            raise ValueError(f'Invalid keyType ({keyType})! Valid key types are: {self.BATCH_KEY_TYPES}')
+
+        def rows():
+            for key in keys:
+                if keyType == 'path':
+                    directory, filename = os.path.split(key)
+                    yield key, filename, self._normalizeDirectory(directory)
+                elif keyType == 'filename':
+                    yield key, key, None
+                else:
+                    yield key, None, None
+
+        if keyType == 'checksum':
+            condition = 'file.checksum = batch_key.key'
+        elif keyType == 'path':
+            condition = 'file.file_name = batch_key.key_file_name AND file.directory = batch_key.key_directory'
+        else:
+            condition = 'file.file_name = batch_key.key_file_name'
+        values = []
+        if hostname is not None:
+            condition += ' AND file.host_id = (SELECT id FROM host WHERE name = ?)'
+            values.append(hostname)
+
+        # Only the temporary table is written - end the transaction that starts unless the caller has one open
+        inTransaction = self.connection.in_transaction
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('DROP TABLE IF EXISTS temp.batch_key')
+            cursor.execute('''CREATE TEMP TABLE batch_key
+                                (
+                                    position INTEGER PRIMARY KEY,
+                                    key TEXT NOT NULL,
+                                    key_file_name TEXT NULL,
+                                    key_directory TEXT NULL
+                                )
+                            ''')
+            cursor.executemany('INSERT INTO batch_key (key, key_file_name, key_directory) VALUES (?, ?, ?)', rows())
+            cursor.execute(f'''SELECT batch_key.key as query_key, {self.RECORD_COLUMNS}
+                                FROM batch_key
+                                LEFT JOIN file ON {condition}
+                                {self.RECORD_JOINS}
+                                ORDER BY batch_key.position, file.id
+                            ''', values)
+            while True:
+                records = cursor.fetchmany(self.ITERATE_BATCH_SIZE)
+                if not records:
+                    break
+                for record in records:
+                    yield record['query_key'], record if record['id'] is not None else None
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS temp.batch_key')
+            cursor.close()
+            if not inTransaction:
+                self.connection.commit()
+
+    def _readQuery(self, checksum=None, filename=None, directory=None, hostname=None, all=False):
+        ''' Build the SELECT command and values for read() and iterRecords() '''
         if not all and checksum is None and filename is None and directory is None and hostname is None:
             raise Exception('Must supply at least one of checksum, filename, directory, or hostname!')
 
         directory = self._normalizeDirectory(directory)
 
-        command = '''SELECT file.id,
-                        checksum,
-                        file_name,
-                        directory,
-                        host.id as host_id,
-                        host.name as host_name,
-                        file_size,
-                        file_modify_datetime,
-                        mime_type.type as file_mime_type,
-                        capture_device.id as capture_device_id,
-                        capture_device.make as capture_device_make,
-                        capture_device.model as capture_device_model,
-                        capture_device.serial_number as capture_device_serial_number,
-                        capture_datetime,
-                        cloud_storage.id as cloud_storage_id,
-                        cloud_storage.name as cloud_name,
-                        cloud_storage.bucket as cloud_bucket,
-                        cloud_object_name,
-                        cloud_object_checksum
-                    FROM file
-                    LEFT JOIN host on file.host_id = host.id
-                    LEFT JOIN mime_type on file.file_mime_type_id = mime_type.id
-                    LEFT JOIN capture_device on file.capture_device_id = capture_device.id
-                    LEFT JOIN cloud_storage on file.cloud_storage_id = cloud_storage.id
-                '''
+        command = f'SELECT {self.RECORD_COLUMNS} FROM file {self.RECORD_JOINS}'
         tokens = []
         values = []
         if checksum is not None:
@@ -277,24 +518,7 @@ class CatalogDatabase(object):
             command += 'WHERE ' + ' AND '.join(tokens)
         else:
             values = []
-        self.cursor.execute(command, values)
-
-        records = self.cursor.fetchall()
-        if len(records) == 0 and not all:
-            errorMessage = 'File not found in database with '
-            tokens = []
-            if checksum is not None:
-                tokens.append(f'checksum: {checksum}')
-            if filename is not None:
-                tokens.append(f'filename: {filename}')
-            if directory is not None:
-                tokens.append(f'directory: {directory}')
-            if hostname is not None:
-                tokens.append(f'hostname: {hostname}')
-            errorMessage += ', '.join(tokens) + ' !'
-            raise KeyError(errorMessage)
-
-        return records
+        return command, values
 
     def update(self, record, fields):
         ''' Update a record in the database'''
@@ -334,6 +558,19 @@ class CatalogDatabase(object):
         records = self.cursor.fetchall()
         return records[0][0] == 1
 
+    def iterChecksums(self):
+        ''' Yields the distinct (checksum, file size) pairs in the catalog '''
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('SELECT DISTINCT checksum, file_size FROM file')
+            while True:
+                records = cursor.fetchmany(self.ITERATE_BATCH_SIZE)
+                if not records:
+                    break
+                yield from (tuple(record) for record in records)
+        finally:
+            cursor.close()
+
     def existsPath(self, filename, directory=None, hostname=None):
         directory = self._normalizeDirectory(directory)
 
@@ -344,7 +581,7 @@ class CatalogDatabase(object):
             tokens.append('directory = ?')
             values.append(directory)
         if hostname is not None:
-            tokens.append('host_name = ?')
+            tokens.append('host_id = (SELECT id FROM host WHERE name = ?)')
             values.append(hostname)
         command += 'WHERE ' + ' AND '.join(tokens)
         command += ')'
@@ -364,9 +601,291 @@ class CatalogDatabase(object):
             (cloudStorageId, objectName, objectChecksum, checksum)
         )
 
+    def setLastVerified(self, fileIds, location, verifiedDatetime):
+        ''' Record when files were last verified
+
+            :param fileIds: Iterable of file ids
+            :param location: (str) local or cloud
+            :param verifiedDatetime: (str) UTC time of the verification as YYYY-MM-DD HH:MM:SS
+        '''
+        if location not in self.VERIFY_LOCATIONS:
+            raise ValueError(f'Invalid location ({location})! Valid locations are: {self.VERIFY_LOCATIONS}')
+        self.cursor.executemany(
+            f'UPDATE file SET last_verified_{location} = ? WHERE id = ?',
+            ((verifiedDatetime, fileId) for fileId in fileIds)
+        )
+
+    def getUnverifiedFileCount(self, location, days, directory=None):
+        ''' Number of files that haven't been verified in the last days
+
+            :param location: (str) local or cloud
+            :param days: (float) Age in days
+            :param directory: Only count files in this directory - accepts wildcards (*, ?)
+        '''
+        if location not in self.VERIFY_LOCATIONS:
+            raise ValueError(f'Invalid location ({location})! Valid locations are: {self.VERIFY_LOCATIONS}')
+        command = f'''SELECT COUNT(id) FROM file
+                        WHERE (last_verified_{location} IS NULL 
+                            OR JULIANDAY(last_verified_{location}) < JULIANDAY('now') - ?)'''
+        values = [days]
+        if location == 'cloud':
+            command += ' AND cloud_object_name IS NOT NULL'
+        if directory:
+            directory = self._normalizeDirectory(directory)
+            if '*' in directory or '?' in directory:
+                command += ' AND directory LIKE ?'
+                values.append(directory.replace('*', '%').replace('?', '_'))
+            else:
+                command += ' AND directory = ?'
+                values.append(directory)
+        self.cursor.execute(command, values)
+        return self.cursor.fetchone()[0]
+
+    def getInodeChecksum(self, hostName, device, inode, fileSize, modifyTimeNs):
+        ''' Get the stored checksum of an inode. Inode numbers are reused, so the 
+            checksum is only returned if the size and modification time still match.
+
+            :returns: The checksum or None
+        '''
+        self.cursor.execute(
+            '''SELECT checksum
+                FROM inode_checksum
+                JOIN host ON inode_checksum.host_id = host.id
+                WHERE host.name = ? AND device = ? AND inode = ? AND file_size = ? AND modify_time_ns = ?
+            ''',
+            (hostName, device, inode, fileSize, modifyTimeNs)
+        )
+        record = self.cursor.fetchone()
+        return record[0] if record else None
+
+    def setInodeChecksum(self, hostName, device, inode, fileSize, modifyTimeNs, checksum):
+        ''' Create or update the stored checksum of an inode
+
+            :param hostName: (str) Host the device is on
+            :param device: (int) st_dev of the file
+            :param inode: (int) st_ino of the file
+            :param fileSize: (int) Size of the file when it was hashed
+            :param modifyTimeNs: (int) st_mtime_ns of the file when it was hashed
+            :param checksum: (str) Checksum of the file
+        '''
+        hostId = self.getHostId(hostName, insert=True)
+        self.cursor.execute(
+            '''INSERT INTO inode_checksum
+                (host_id, device, inode, file_size, modify_time_ns, checksum, updated_datetime)
+                VALUES
+                (?, ?, ?, ?, ?, ?, DATETIME('now'))
+                ON CONFLICT(host_id, device, inode) DO UPDATE
+                SET file_size = excluded.file_size,
+                    modify_time_ns = excluded.modify_time_ns,
+                    checksum = excluded.checksum,
+                    updated_datetime = excluded.updated_datetime
+            ''',
+            (hostId, device, inode, fileSize, modifyTimeNs, checksum)
+        )
+
+    def getUploadSession(self, projectId, bucketName, objectName):
+        ''' Get the stored resumable upload session for a cloud object
+
+            :param projectId: (str) Cloud project
+            :param bucketName: (str) Cloud bucket
+            :param objectName: (str) Name of the object being uploaded
+            :returns: The upload session record or None if there is none
+        '''
+        self.cursor.execute(
+            '''SELECT upload_session.id,
+                    object_name,
+                    source_path,
+                    file_size,
+                    session_uri,
+                    bytes_uploaded,
+                    created_datetime,
+                    updated_datetime
+                FROM upload_session
+                JOIN cloud_storage ON upload_session.cloud_storage_id = cloud_storage.id
+                WHERE cloud_storage.name = ? AND cloud_storage.bucket = ? AND object_name = ?
+            ''',
+            (projectId, bucketName, objectName)
+        )
+        return self.cursor.fetchone()
+
+    def setUploadSession(self, projectId, bucketName, objectName, sourcePath, fileSize, sessionUri, bytesUploaded):
+        ''' Create or update the resumable upload session for a cloud object
+
+            :param projectId: (str) Cloud project
+            :param bucketName: (str) Cloud bucket
+            :param objectName: (str) Name of the object being uploaded
+            :param sourcePath: (str) Local file being uploaded
+            :param fileSize: (int) Size of the local file in bytes
+            :param sessionUri: (str) URI of the resumable upload session
+            :param bytesUploaded: (int) Number of bytes persisted by the cloud
+        '''
+        cloudStorageId = self.getCloudStorageId(projectId, bucketName, insert=True)
+        self.cursor.execute(
+            '''INSERT INTO upload_session
+                (cloud_storage_id, object_name, source_path, file_size, session_uri, bytes_uploaded, created_datetime, updated_datetime)
+                VALUES
+                (?, ?, ?, ?, ?, ?, DATETIME('now'), DATETIME('now'))
+                ON CONFLICT(cloud_storage_id, object_name) DO UPDATE
+                SET created_datetime = CASE WHEN session_uri = excluded.session_uri THEN created_datetime ELSE excluded.created_datetime END,
+                    source_path = excluded.source_path,
+                    file_size = excluded.file_size,
+                    session_uri = excluded.session_uri,
+                    bytes_uploaded = excluded.bytes_uploaded,
+                    updated_datetime = excluded.updated_datetime
+            ''',
+            (cloudStorageId, objectName, sourcePath, fileSize, sessionUri, bytesUploaded)
+        )
+
+    def deleteUploadSession(self, projectId, bucketName, objectName):
+        self.cursor.execute(
+            '''DELETE FROM upload_session
+                WHERE object_name = ? AND cloud_storage_id IN 
+                    (SELECT id FROM cloud_storage WHERE name = ? AND bucket = ?)
+            ''',
+            (objectName, projectId, bucketName)
+        )
+
+    def getCloudObject(self, projectId, bucketName, objectName):
+        ''' Get an object from the cloud inventory
+
+            :returns: The cloud object record or None if it is not in the inventory
+        '''
+        self.cursor.execute(
+            '''SELECT object_name,
+                    object_size,
+                    object_checksum,
+                    generation,
+                    updated_datetime
+                FROM cloud_object
+                JOIN cloud_storage ON cloud_object.cloud_storage_id = cloud_storage.id
+                WHERE cloud_storage.name = ? AND cloud_storage.bucket = ? AND object_name = ?
+            ''',
+            (projectId, bucketName, objectName)
+        )
+        return self.cursor.fetchone()
+
+    def iterCloudObjects(self, projectId, bucketName, prefix):
+        ''' Yields the inventory records of the objects under a prefix in object name order.
+            Uses its own cursor, so other queries can run while iterating.
+        '''
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(
+                '''SELECT object_name,
+                        object_size,
+                        object_checksum,
+                        generation,
+                        updated_datetime
+                    FROM cloud_object
+                    JOIN cloud_storage ON cloud_object.cloud_storage_id = cloud_storage.id
+                    WHERE cloud_storage.name = ? AND cloud_storage.bucket = ? AND SUBSTR(object_name, 1, ?) = ?
+                    ORDER BY object_name
+                ''',
+                (projectId, bucketName, len(prefix), prefix)
+            )
+            while True:
+                records = cursor.fetchmany(self.ITERATE_BATCH_SIZE)
+                if not records:
+                    break
+                yield from records
+        finally:
+            cursor.close()
+
+    def setCloudObject(self, projectId, bucketName, objectName, objectSize, objectChecksum, generation):
+        ''' Create or update an object in the cloud inventory
+
+            :param projectId: (str) Cloud project
+            :param bucketName: (str) Cloud bucket
+            :param objectName: (str) Name of the object
+            :param objectSize: (int) Size of the object in bytes
+            :param objectChecksum: (int) CRC32C of the object
+            :param generation: (int) Generation of the object
+        '''
+        cloudStorageId = self.getCloudStorageId(projectId, bucketName, insert=True)
+        self._setCloudObjects(cloudStorageId, [(objectName, objectSize, objectChecksum, generation)])
+
+    def deleteCloudObject(self, projectId, bucketName, objectName):
+        self.cursor.execute(
+            '''DELETE FROM cloud_object
+                WHERE object_name = ? AND cloud_storage_id IN 
+                    (SELECT id FROM cloud_storage WHERE name = ? AND bucket = ?)
+            ''',
+            (objectName, projectId, bucketName)
+        )
+
+    def replaceCloudInventory(self, projectId, bucketName, prefix, objects):
+        ''' Replace the inventory of objects under a prefix with a full listing
+
+            :param projectId: (str) Cloud project
+            :param bucketName: (str) Cloud bucket
+            :param prefix: (str) Prefix the listing is of
+            :param objects: Iterable of (objectName, objectSize, objectChecksum, generation) tuples
+            :returns: (int) Number of objects in the inventory
+        '''
+        cloudStorageId = self.getCloudStorageId(projectId, bucketName, insert=True)
+        self.cursor.execute(
+            '''DELETE FROM cloud_object
+                WHERE cloud_storage_id = ? AND SUBSTR(object_name, 1, ?) = ?
+            ''',
+            (cloudStorageId, len(prefix), prefix)
+        )
+        numObjects = self._setCloudObjects(cloudStorageId, objects)
+        self.cursor.execute(
+            '''INSERT INTO cloud_inventory
+                (cloud_storage_id, prefix, refreshed_datetime)
+                VALUES
+                (?, ?, DATETIME('now'))
+                ON CONFLICT(cloud_storage_id, prefix) DO UPDATE
+                SET refreshed_datetime = excluded.refreshed_datetime
+            ''',
+            (cloudStorageId, prefix)
+        )
+        return numObjects
+
+    def getCloudInventoryAge(self, projectId, bucketName, prefix):
+        ''' Time since the inventory of objects under a prefix was last fully refreshed
+
+            :returns: (float) Age in seconds, or None if it has never been refreshed
+        '''
+        self.cursor.execute(
+            '''SELECT (JULIANDAY('now') - JULIANDAY(refreshed_datetime))*86400
+                FROM cloud_inventory
+                JOIN cloud_storage ON cloud_inventory.cloud_storage_id = cloud_storage.id
+                WHERE cloud_storage.name = ? AND cloud_storage.bucket = ? AND prefix = ?
+            ''',
+            (projectId, bucketName, prefix)
+        )
+        record = self.cursor.fetchone()
+        return record[0] if record else None
+
+    def _setCloudObjects(self, cloudStorageId, objects):
+        numObjects = 0
+        def rows():
+            nonlocal numObjects
+            for objectName, objectSize, objectChecksum, generation in objects:
+                numObjects += 1
+                yield (cloudStorageId, objectName, objectSize, objectChecksum, generation)
+        self.cursor.executemany(
+            '''INSERT INTO cloud_object
+                (cloud_storage_id, object_name, object_size, object_checksum, generation, updated_datetime)
+                VALUES
+                (?, ?, ?, ?, ?, DATETIME('now'))
+                ON CONFLICT(cloud_storage_id, object_name) DO UPDATE
+                SET object_size = excluded.object_size,
+                    object_checksum = excluded.object_checksum,
+                    generation = excluded.generation,
+                    updated_datetime = excluded.updated_datetime
+            ''',
+            rows()
+        )
+        return numObjects
+
     def commit(self):
         self.connection.commit()
 
+    def rollback(self):
+        self.connection.rollback()
+
     def close(self):
         self.connection.close()
 
@@ -468,7 +987,7 @@ class CatalogDatabase(object):
 
         return records[0][0]
 
-    def getFileCount(self, mode='all', deviceId=None, mimeTypeId=None):
+    def getFileCount(self, mode='all', deviceId=None, mimeTypeId=None, directory=None):
         validModes = ['all', 'cloud', 'unique']
         if mode not in validModes:
             raise ValueError(f'Invalid mode ({mode})! Valid modes are: {validModes}')
@@ -489,6 +1008,14 @@ class CatalogDatabase(object):
         if mimeTypeId:
             tokens.append('file_mime_type_id = ?')
             values.append(mimeTypeId)
+        if directory:
+            directory = self._normalizeDirectory(directory)
+            if '*' in directory or '?' in directory:
+                tokens.append('directory LIKE ?')
+                values.append(directory.replace('*', '%').replace('?', '_'))
+            else:
+                tokens.append('directory = ?')
+                values.append(directory)
         if tokens:
             command += ' WHERE ' + ' AND '.join(tokens)
         
@@ -560,18 +1087,9 @@ class CatalogDatabase(object):
         '''
         command = 'SELECT checksum, COUNT(*) c FROM file'
         commandTail = ' GROUP BY checksum HAVING c > 1'
-        tokens = []
-        values = []
-        if directory is not None:
-            if '*' in directory or '?' in directory:
-                tokens.append('directory LIKE ?')
-                values.append(directory.replace('*', '%').replace('?', '_'))
-            else:
-                tokens.append('directory = ?')
-                values.append(directory)
-
-        if tokens:
-            command += ' WHERE ' + ' AND '.join(tokens)
+        condition, values = self._directoryCondition(directory)
+        if condition:
+            command += ' WHERE ' + condition
 
         command += commandTail
 
@@ -580,6 +1098,87 @@ class CatalogDatabase(object):
             return [record['checksum'] for record in records]
         return records
 
+    def iterDuplicates(self, directory=None):
+        ''' Yields the groups of duplicate files, read with one query. The groups are
+            ordered by their first path, and the files of a group by path.
+
+            :param directory: (str) Only groups with more than one file in this directory -
+                                    accepts wildcards (*, ?). The groups still have all their files.
+            :returns: Generator of (checksum, records) - records have id, checksum, file_name,
+                      directory, host_name and file_size
+        '''
+        condition, values = self._directoryCondition(directory)
+        command = f'''SELECT id, checksum, file_name, directory, host_name, file_size FROM
+                        (
+                            SELECT file.id, checksum, file_name, directory, host.name as host_name, file_size,
+                                COUNT(*) OVER checksum_group as num_files,
+                                SUM({condition if condition else 1}) OVER checksum_group as num_matching,
+                                MIN(directory || file_name) OVER checksum_group as group_path
+                            FROM file
+                            LEFT JOIN host on file.host_id = host.id
+                            WINDOW checksum_group AS (PARTITION BY checksum)
+                        )
+                        WHERE num_files > 1 AND num_matching > 1
+                        ORDER BY group_path, checksum, directory, file_name, host_name
+                    '''
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(command, values)
+            group = []
+            while True:
+                records = cursor.fetchmany(self.ITERATE_BATCH_SIZE)
+                if not records:
+                    break
+                for record in records:
+                    if group and record['checksum'] != group[0]['checksum']:
+                        yield group[0]['checksum'], group
+                        group = []
+                    group.append(record)
+            if group:
+                yield group[0]['checksum'], group
+        finally:
+            cursor.close()
+
+    def getDuplicateDirectoryPairs(self, directory=None):
+        ''' Sum the space taken by duplicates for each pair of directories holding copies
+            of the same files - removing the copies from either directory of a pair frees
+            its bytes. Copies within one directory are reported as a pair of that directory
+            with itself, counting the copies after the first.
+
+            :param directory: (str) Only files with more than one copy in this directory, as
+                                    iterDuplicates()
+            :returns: (list) Tuples of (host name, directory, host name, directory, number of
+                             files, bytes), with the most bytes first
+        '''
+        # Summed from the groups, which are read in one pass, rather than by joining the file table with itself
+        pairs = {}
+        for checksum, records in self.iterDuplicates(directory):
+            copies = {}
+            for record in records:
+                location = (record['host_name'] or '', record['directory'])
+                copies[location] = copies.get(location, 0) + 1
+            fileSize = records[0]['file_size']
+            locations = sorted(copies)
+            for i, locationA in enumerate(locations):
+                if copies[locationA] > 1:
+                    pairs.setdefault(locationA + locationA, [0, 0])
+                    pairs[locationA + locationA][0] += copies[locationA] - 1
+                    pairs[locationA + locationA][1] += (copies[locationA] - 1)*fileSize
+                for locationB in locations[i+1:]:
+                    pairs.setdefault(locationA + locationB, [0, 0])
+                    pairs[locationA + locationB][0] += 1
+                    pairs[locationA + locationB][1] += fileSize
+        return sorted((pair + tuple(totals) for pair, totals in pairs.items()), key=lambda pair: (-pair[5], pair[1], pair[3]))
+
+    @staticmethod
+    def _directoryCondition(directory):
+        ''' SQL condition and values matching a directory, with wildcards (*, ?) '''
+        if directory is None:
+            return None, []
+        if '*' in directory or '?' in directory:
+            return 'directory LIKE ?', [directory.replace('*', '%').replace('?', '_')]
+        return 'directory = ?', [directory]
+
     def printFileRecord(self, checksum):
         record = self.read(checksum)[0]
         print('')
@@ -0,0 +1,86 @@
+import os
+import json
+
+
+class CatalogJournal(object):
+    ''' Append-only journal of catalog runs, kept in the catalog directory so
+        an interrupted run can be resumed.
+
+        A run writes a start entry for its root path, a batch entry with the
+        files of a directory before their metadata and database records are
+        written, a directory entry once the directory is committed, and an
+        end entry when the run completes. A run of the same root that starts
+        before the end entry resumes: completed directories are skipped, and
+        the files of in-flight batches may already have metadata without a
+        committed database record, which has to be overwritten.
+    '''
+    def __init__(self, path):
+        ''' :param path: (str) Path of the journal file '''
+        self.path = path
+        self.root = None
+        self.completed = set()
+        self.inFlight = {}
+
+    def start(self, root):
+        ''' Start or resume a run
+
+            :param root: (str) Directory being cataloged
+            :returns: (bool) True if an interrupted run of root is resumed
+        '''
+        self.root = os.path.abspath(root)
+        runs = self._readRuns()
+        resumed = self.root in runs
+        self.completed, self.inFlight = runs.get(self.root, (set(), {}))
+        self._append({'event': 'start', 'root': self.root})
+        return resumed
+
+    def beginBatch(self, directory, filePaths):
+        ''' Record the files of a directory that are about to be written '''
+        self.inFlight[directory] = set(filePaths)
+        self._append({'event': 'batch', 'root': self.root, 'directory': directory, 'files': list(filePaths)})
+
+    def completeDirectory(self, directory):
+        ''' Record that a directory is committed to the database '''
+        self.completed.add(directory)
+        self.inFlight.pop(directory, None)
+        self._append({'event': 'directory', 'root': self.root, 'directory': directory})
+
+    def finish(self):
+        ''' Record the end of the run - the journal is removed once no run is unfinished '''
+        self._append({'event': 'end', 'root': self.root})
+        if not self._readRuns():
+            os.remove(self.path)
+        self.completed = set()
+        self.inFlight = {}
+
+    def _readRuns(self):
+        ''' :returns: (dict) Completed directories and in-flight batches of each unfinished root '''
+        runs = {}
+        try:
+            f = open(self.path, 'r')
+        except FileNotFoundError:
+            return runs
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write at the end of an interrupted run
+                    continue
+                root = entry['root']
+                if entry['event'] == 'end':
+                    runs.pop(root, None)
+                    continue
+                completed, inFlight = runs.setdefault(root, (set(), {}))
+                if entry['event'] == 'batch':
+                    inFlight[entry['directory']] = set(entry['files'])
+                elif entry['event'] == 'directory':
+                    completed.add(entry['directory'])
+                    inFlight.pop(entry['directory'], None)
+        return runs
+
+    def _append(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,306 @@
+import os
+import json
+import queue
+import socket
+import threading
+import contextlib
+import socketserver
+import concurrent.futures
+
+from .mediaCatalog import MediaCatalog
+from .utils import exifToolSession
+
+
+class CatalogServerError(Exception):
+    ''' Error returned by the catalog server for a request '''
+    def __init__(self, type, message):
+        super().__init__(f'{type}: {message}')
+        self.type = type
+        self.message = message
+
+
+class CatalogServer(object):
+    ''' Serves catalog requests over a Unix socket, so scripts and UIs that
+        query the catalog often don't start Python, open the database and
+        load the config for every query.
+
+        Requests and responses are JSON objects, one per line:
+            {"id": 1, "method": "query", "params": {"checksum": "..."}}
+            {"id": 1, "result": ...} or {"id": 1, "error": {"type": ..., "message": ...}}
+
+        Methods:
+            query   - records (and metadata with "metadata": true) by checksum,
+                      path, filename, directory or hostname
+            exists  - whether a checksum or path is in the catalog
+            stats   - file counts and sizes
+            catalog - catalog files and directories
+            ping    - check the server is up
+
+        query, exists and stats are answered by a pool of reader threads,
+        each with its own MediaCatalog and database connection. catalog
+        requests are run one at a time by a single writer thread, which keeps
+        an exiftool process running.
+    '''
+    READ_METHODS = ['ping', 'query', 'exists', 'stats']
+    WRITE_METHODS = ['catalog']
+    DEFAULT_READERS = 4
+
+    def __init__(self, catalogPath, socketPath=None, readers=None, update=False):
+        ''' :param catalogPath: (str) Path of the catalog
+            :param socketPath: (str) Unix socket to listen on - defaults to <catalog path>/catalog.sock
+            :param readers: (int) Number of reader threads
+            :param update: (bool) Update files that are already cataloged, as mcat catalog -u
+        '''
+        self.catalogPath = catalogPath
+        self.socketPath = socketPath if socketPath else os.path.join(catalogPath, MediaCatalog.SOCKET_FILENAME)
+        self.numReaders = readers if readers else self.DEFAULT_READERS
+        self.update = update
+        self.readQueue = queue.Queue()
+        self.writeQueue = queue.Queue()
+        self.threads = []
+        self.server = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        ''' Open the catalogs and start listening '''
+        if os.path.exists(self.socketPath):
+            # Left by a server that wasn't shut down cleanly - refuse to take over a live one
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                try:
+                    s.connect(self.socketPath)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove(self.socketPath)
+                else:
+                    raise RuntimeError(f'A catalog server is already listening on {self.socketPath}!')
+
+        try:
+            started = []
+            for i in range(self.numReaders):
+                started.append(self._startWorker(self.readQueue, f'catalogReader{i}', writer=False))
+            started.append(self._startWorker(self.writeQueue, 'catalogWriter', writer=True))
+            for future in started:
+                future.result()
+            self.server = _UnixServer(self.socketPath, _RequestHandler)
+        except BaseException:
+            self.close()
+            raise
+        self.server.catalogServer = self
+        print(f'Serving catalog {self.catalogPath} on {self.socketPath}')
+
+    def serveForever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        ''' Stop serveForever() - call from another thread '''
+        self.server.shutdown()
+
+    def close(self):
+        if self.server:
+            self.server.server_close()
+            self.server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socketPath)
+        for i in range(self.numReaders):
+            self.readQueue.put(None)
+        self.writeQueue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def handle(self, request):
+        ''' Run a request on a reader or the writer
+
+            :param request: (dict) Decoded request
+            :returns: (dict) Response
+        '''
+        requestId = request.get('id') if isinstance(request, dict) else None
+        try:
+            method = request.get('method')
+            params = request.get('params') or {}
+            if method in self.READ_METHODS:
+                workQueue = self.readQueue
+            elif method in self.WRITE_METHODS:
+                workQueue = self.writeQueue
+            else:
+                raise ValueError(f'Invalid method ({method})! Valid methods are: {self.READ_METHODS + self.WRITE_METHODS}')
+            future = concurrent.futures.Future()
+            workQueue.put((getattr(self, '_' + method), params, future))
+            return {'id': requestId, 'result': future.result()}
+        except Exception as e:
+            return {'id': requestId, 'error': {'type': type(e).__name__, 'message': str(e)}}
+
+    def _startWorker(self, workQueue, name, writer):
+        started = concurrent.futures.Future()
+        thread = threading.Thread(target=self._work, args=(workQueue, writer, started), name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return started
+
+    def _work(self, workQueue, writer, started):
+        ''' Run requests from workQueue with this thread's own catalog until a None is queued '''
+        with contextlib.ExitStack() as stack:
+            try:
+                catalog = stack.enter_context(MediaCatalog(self.catalogPath, update=writer and self.update))
+                if writer:
+                    stack.enter_context(exifToolSession())
+            except BaseException as e:
+                started.set_exception(e)
+                return
+            started.set_result(None)
+            while True:
+                work = workQueue.get()
+                if work is None:
+                    break
+                function, params, future = work
+                try:
+                    future.set_result(function(catalog, **params))
+                except Exception as e:
+                    catalog.catalogDb.rollback()
+                    future.set_exception(e)
+
+    @staticmethod
+    def _ping(catalog):
+        return 'pong'
+
+    @staticmethod
+    def _query(catalog, checksum=None, path=None, filename=None, directory=None, hostname=None, metadata=False):
+        if path:
+            directory, filename = os.path.split(os.path.abspath(path))
+        try:
+            dbRecords, metadataAndPaths = catalog.query(checksum=checksum, filename=filename, directory=directory, hostname=hostname)
+        except KeyError:
+            dbRecords, metadataAndPaths = [], []
+        result = {'records': [dict(record) for record in dbRecords]}
+        if metadata:
+            result['metadata'] = [{'path': metadataPath, 'metadata': md} for md, metadataPath in metadataAndPaths]
+        return result
+
+    @staticmethod
+    def _exists(catalog, checksum=None, path=None, hostname=None):
+        if checksum:
+            return catalog.catalogDb.existsChecksum(checksum)
+        if path:
+            directory, filename = os.path.split(os.path.abspath(path))
+            return catalog.catalogDb.existsPath(filename, directory, hostname)
+        raise ValueError('Must supply checksum or path!')
+
+    @staticmethod
+    def _stats(catalog):
+        return {mode: {'files': catalog.catalogDb.getFileCount(mode=mode), 'bytes': catalog.catalogDb.getTotalFileSize(mode=mode)}
+                for mode in ['all', 'unique', 'cloud']}
+
+    @staticmethod
+    def _catalog(catalog, paths):
+        ''' Catalog directories with MediaCatalog.catalog() and files with catalogFiles() '''
+        results = ([], [], [], [])
+        filePaths = []
+        for path in paths:
+            if os.path.isdir(path):
+                for result, pathResult in zip(results, catalog.catalog(path)):
+                    result.extend(pathResult)
+            else:
+                filePaths.append(path)
+        if filePaths:
+            for result, pathResult in zip(results, catalog.catalogFiles(filePaths)):
+                result.extend(pathResult)
+        newFiles, updatedFiles, skippedFiles, failedFiles = results
+        return {'new': [path for path, checksum in newFiles],
+                'updated': [path for path, checksum in updatedFiles],
+                'skipped': len(skippedFiles),
+                'failed': [path for path, checksum in failedFiles]}
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    ''' Answers the requests of one client connection in order '''
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'id': None, 'error': {'type': 'ValueError', 'message': f'Invalid request: {e}'}}
+            else:
+                response = self.server.catalogServer.handle(request)
+            self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class CatalogClient(object):
+    ''' Client for a CatalogServer. One connection is kept open, and its
+        requests are answered in order - use one client per thread.
+    '''
+    def __init__(self, socketPath, timeout=None):
+        ''' :param socketPath: (str) Socket of the server, or the catalog path to use its default socket
+            :param timeout: (float) Seconds to wait for a response, or None to wait forever
+        '''
+        if os.path.isdir(socketPath):
+            socketPath = os.path.join(socketPath, MediaCatalog.SOCKET_FILENAME)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socketPath)
+        self.file = self.socket.makefile('rwb')
+        self.requestId = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def request(self, method, **params):
+        ''' Send a request and wait for its result
+
+            :raises CatalogServerError: If the server couldn't answer it
+        '''
+        self.requestId += 1
+        request = {'id': self.requestId, 'method': method, 'params': params}
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Catalog server closed the connection!')
+        response = json.loads(line)
+        if 'error' in response:
+            raise CatalogServerError(response['error']['type'], response['error']['message'])
+        return response['result']
+
+    def ping(self):
+        return self.request('ping')
+
+    def query(self, checksum=None, path=None, filename=None, directory=None, hostname=None, metadata=False):
+        ''' :returns: (dict) records - list of database records as dicts, and
+                             metadata - list of dicts with path and metadata if metadata is True
+        '''
+        params = {'checksum': checksum, 'path': path, 'filename': filename, 'directory': directory, 'hostname': hostname}
+        params = {key: value for key, value in params.items() if value is not None}
+        return self.request('query', metadata=metadata, **params)
+
+    def exists(self, checksum=None, path=None, hostname=None):
+        params = {'checksum': checksum, 'path': path, 'hostname': hostname}
+        return self.request('exists', **{key: value for key, value in params.items() if value is not None})
+
+    def stats(self):
+        ''' :returns: (dict) files and bytes for all, unique and cloud files '''
+        return self.request('stats')
+
+    def catalog(self, paths):
+        ''' Catalog files and directories - paths must be readable by the server
+
+            :returns: (dict) new, updated and failed paths, and the number of files skipped
+        '''
+        return self.request('catalog', paths=[os.path.abspath(path) for path in paths])
@@ -0,0 +1,166 @@
+import io
+import os
+import mmap
+import struct
+import collections
+
+
+MAGIC = b'MCATSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQ')
+RECORD = struct.Struct('<32sQQIQIQIQI')
+PATH_ENTRY = struct.Struct('<QII')
+CHECKSUM_SIZE = 32
+
+SnapshotRecord = collections.namedtuple('SnapshotRecord', ['checksum', 'path', 'hostName', 'fileSize', 'cloudBucket', 'cloudObjectName'])
+
+
+def writeSnapshot(path, records):
+    ''' Write a snapshot of catalog records
+
+        :param path: (str) Snapshot file to write - replaced atomically
+        :param records: Iterable of database records ordered by checksum, e.g.
+                        CatalogDatabase.iterRecords(all=True, orderBy='checksum')
+        :returns: (int) Number of records written
+    '''
+    strings = io.BytesIO()
+    internedStrings = {}
+
+    def addString(value, intern=False):
+        if value is None:
+            return 0, 0
+        data = value.encode('utf-8')
+        if intern and data in internedStrings:
+            return internedStrings[data]
+        reference = (strings.tell(), len(data))
+        strings.write(data)
+        if intern:
+            internedStrings[data] = reference
+        return reference
+
+    pathEntries = []
+    tmpPath = path + '.tmp'
+    try:
+        with open(tmpPath, 'wb') as f:
+            f.write(bytes(HEADER.size))
+            recordsOffset = f.tell()
+            numRecords = 0
+            lastChecksum = b''
+            for record in records:
+                checksum = bytes.fromhex(record['checksum'])
+                if checksum < lastChecksum:
+                    raise ValueError('Snapshot records must be ordered by checksum!')
+                lastChecksum = checksum
+                filePath = os.path.join(os.path.normpath(record['directory']), record['file_name'])
+                pathReference = addString(filePath)
+                f.write(RECORD.pack(checksum, record['file_size'], *pathReference,
+                                    *addString(record['host_name'], intern=True),
+                                    *addString(record['cloud_bucket'], intern=True),
+                                    *addString(record['cloud_object_name'])))
+                pathEntries.append((filePath.encode('utf-8'), pathReference, numRecords))
+                numRecords += 1
+
+            pathsOffset = f.tell()
+            pathEntries.sort(key=lambda entry: entry[0])
+            for pathBytes, (offset, length), recordIndex in pathEntries:
+                f.write(PATH_ENTRY.pack(offset, length, recordIndex))
+
+            stringsOffset = f.tell()
+            f.write(strings.getbuffer())
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, CHECKSUM_SIZE, numRecords, recordsOffset, pathsOffset, stringsOffset))
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+    os.replace(tmpPath, path)
+    return numRecords
+
+
+class CatalogSnapshot(object):
+    ''' Compact read-only snapshot of a catalog for hosts that only look up
+        files by checksum or path, e.g. to find their cloud object. It is one
+        file that is mmapped and binary searched, so opening it doesn't need
+        SQLite, the catalog config or the metadata store.
+
+        Layout, little endian:
+            header   - magic, version, record count and section offsets
+            records  - fixed width, sorted by checksum: checksum, file size and
+                       references to the path, host name, cloud bucket and
+                       cloud object name strings
+            paths    - fixed width, sorted by path: path reference and record index
+            strings  - UTF-8 strings referenced by (offset, length)
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError(f'Not a catalog snapshot: {path}')
+        magic, version, checksumSize, self.numRecords, self.recordsOffset, self.pathsOffset, self.stringsOffset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or checksumSize != CHECKSUM_SIZE:
+            raise ValueError(f'Not a catalog snapshot: {path}')
+        if version != VERSION:
+            raise ValueError(f'Unsupported catalog snapshot version ({version})!')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.numRecords
+
+    def close(self):
+        self.map.close()
+
+    def lookupChecksum(self, checksum):
+        ''' :returns: (list) SnapshotRecords of the files with this checksum '''
+        key = bytes.fromhex(checksum)
+        index = self._lowerBound(key, self._recordChecksum)
+        records = []
+        while index < self.numRecords and self._recordChecksum(index) == key:
+            records.append(self._record(index))
+            index += 1
+        return records
+
+    def lookupPath(self, path, hostName=None):
+        ''' :returns: (list) SnapshotRecords of the files at this path, on any host unless hostName is given '''
+        key = os.path.abspath(path).encode('utf-8')
+        index = self._lowerBound(key, self._entryPath)
+        records = []
+        while index < self.numRecords and self._entryPath(index) == key:
+            recordIndex = PATH_ENTRY.unpack_from(self.map, self.pathsOffset + index*PATH_ENTRY.size)[2]
+            record = self._record(recordIndex)
+            if hostName is None or record.hostName == hostName:
+                records.append(record)
+            index += 1
+        return records
+
+    def _lowerBound(self, key, getKey):
+        low, high = 0, self.numRecords
+        while low < high:
+            middle = (low + high)//2
+            if getKey(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _recordChecksum(self, index):
+        offset = self.recordsOffset + index*RECORD.size
+        return self.map[offset:offset + CHECKSUM_SIZE]
+
+    def _entryPath(self, index):
+        offset, length, recordIndex = PATH_ENTRY.unpack_from(self.map, self.pathsOffset + index*PATH_ENTRY.size)
+        return self.map[self.stringsOffset + offset:self.stringsOffset + offset + length]
+
+    def _string(self, offset, length):
+        if not length:
+            return None
+        return self.map[self.stringsOffset + offset:self.stringsOffset + offset + length].decode('utf-8')
+
+    def _record(self, index):
+        (checksum, fileSize, pathOffset, pathLength, hostOffset, hostLength,
+         bucketOffset, bucketLength, objectOffset, objectLength) = RECORD.unpack_from(self.map, self.recordsOffset + index*RECORD.size)
+        return SnapshotRecord(checksum.hex(), self._string(pathOffset, pathLength), self._string(hostOffset, hostLength),
+                              fileSize, self._string(bucketOffset, bucketLength), self._string(objectOffset, objectLength))
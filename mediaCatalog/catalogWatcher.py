@@ -0,0 +1,217 @@
+import os
+import time
+import contextlib
+
+from .fileWalker import FileWalker
+from .inotify import Inotify, IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_ONLYDIR, IN_ISDIR, IN_Q_OVERFLOW, IN_IGNORED
+from .utils import exifToolSession
+
+
+class CatalogWatcher(object):
+    ''' Watches directory trees with inotify and catalogs new files in small
+        batches, instead of rescanning everything from cron.
+
+        Files are cataloged once no event has been seen for them for the
+        debounce time, in batches of up to batchSize, through one exiftool
+        process that is kept running. Files and directories renamed within
+        the watched trees are moved in the catalog without being hashed
+        again. If the kernel's event queue overflows, the trees are
+        cataloged again, which skips the files already in the catalog.
+    '''
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+    DEFAULT_DEBOUNCE = 5.0
+    DEFAULT_BATCH_SIZE = 100
+    # A rename's MOVED_TO follows its MOVED_FROM immediately - without one, the file left the watched trees
+    MOVE_TIMEOUT = 0.5
+
+    def __init__(self, catalog, roots, debounce=None, batchSize=None):
+        ''' :param catalog: MediaCatalog to add files to
+            :param roots: (list) Directories to watch, recursively
+            :param debounce: (float) Seconds without events before a file is cataloged
+            :param batchSize: (int) Maximum number of files cataloged at once
+        '''
+        self.catalog = catalog
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.debounce = debounce if debounce is not None else self.DEFAULT_DEBOUNCE
+        self.batchSize = batchSize if batchSize else self.DEFAULT_BATCH_SIZE
+        self.walker = FileWalker.fromConfig(catalog.config)
+        self.inotify = None
+        self.exifTool = None
+        self.watches = {}
+        self.pending = {}
+        self.movedFrom = {}
+        self.rescan = False
+
+    @classmethod
+    def fromConfig(cls, catalog, roots=None, debounce=None, batchSize=None):
+        ''' Create a watcher from the watchPaths (falling back to catalogPaths),
+            watchDebounce and watchBatchSize config keys
+        '''
+        config = catalog.config if catalog.config else {}
+        if not roots:
+            roots = [os.path.expanduser(root) for root in config.get('watchPaths', config.get('catalogPaths', []))]
+        debounce = debounce if debounce is not None else config.get('watchDebounce')
+        batchSize = batchSize if batchSize else config.get('watchBatchSize')
+        return cls(catalog, roots, debounce, batchSize)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        ''' Start watching the roots and exiftool '''
+        self.inotify = Inotify()
+        self.exifTool = contextlib.ExitStack()
+        self.exifTool.enter_context(exifToolSession())
+        for root in self.roots:
+            print(f'Watching {root}')
+            self._watchTree(root)
+
+    def close(self):
+        if self.exifTool:
+            self.exifTool.close()
+            self.exifTool = None
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        self.watches = {}
+
+    def run(self, duration=None):
+        ''' Watch and catalog until interrupted
+
+            :param duration: (float) Stop after this many seconds
+        '''
+        endTime = time.monotonic() + duration if duration else None
+        with self:
+            while endTime is None or time.monotonic() < endTime:
+                timeout = self._nextTimeout()
+                if endTime is not None:
+                    remaining = max(0.0, endTime - time.monotonic())
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self.poll(timeout)
+            self.flush()
+
+    def poll(self, timeout=0.0):
+        ''' Handle the events that arrive within timeout, then catalog the files that are due
+
+            :param timeout: (float) Seconds to wait for events, or None to wait forever
+        '''
+        for event in self.inotify.read(timeout):
+            self._handleEvent(event, time.monotonic())
+        self._processDue(time.monotonic())
+
+    def flush(self):
+        ''' Catalog every pending file now '''
+        self._processDue(float('inf'))
+
+    def _nextTimeout(self):
+        deadlines = [eventTime + self.debounce for eventTime in self.pending.values()]
+        deadlines += [eventTime + self.MOVE_TIMEOUT for path, isDirectory, eventTime in self.movedFrom.values()]
+        if self.rescan:
+            return 0.0
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _watchTree(self, root):
+        ''' Watch root and the directories under it that aren't excluded
+
+            :returns: (list) Files found in the tree
+        '''
+        filePaths = []
+        for directory, directoryFiles in self.walker.walk(root):
+            try:
+                wd = self.inotify.addWatch(directory, self.WATCH_MASK)
+            except OSError as e:
+                print(f'[WARNING] Could not watch {directory}: {e}')
+                continue
+            self.watches[wd] = directory
+            filePaths.extend(directoryFiles)
+        return filePaths
+
+    def _unwatchTree(self, root):
+        for wd, directory in list(self.watches.items()):
+            if directory == root or directory.startswith(root + os.sep):
+                self.inotify.removeWatch(wd)
+                del self.watches[wd]
+
+    def _handleEvent(self, event, now):
+        if event.mask & IN_Q_OVERFLOW:
+            print('[WARNING] inotify event queue overflowed - cataloging the watched trees again')
+            self.rescan = True
+            return
+        if event.mask & IN_IGNORED:
+            self.watches.pop(event.wd, None)
+            return
+        directory = self.watches.get(event.wd)
+        if directory is None or not event.name:
+            return
+        path = os.path.join(directory, event.name)
+        isDirectory = bool(event.mask & IN_ISDIR)
+
+        if event.mask & IN_MOVED_FROM:
+            self.movedFrom[event.cookie] = (path, isDirectory, now)
+            return
+        if event.mask & IN_MOVED_TO:
+            source = self.movedFrom.pop(event.cookie, None)
+            if source is not None:
+                self._moved(source[0], path, isDirectory, now)
+                return
+        if isDirectory:
+            # Created, or moved in from outside the watched trees
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                for filePath in self._watchTree(path):
+                    self.pending[filePath] = now
+        elif event.mask & IN_MODIFY:
+            # Still being written - restart the debounce of files waiting for it
+            if path in self.pending:
+                self.pending[path] = now
+        else:
+            self.pending[path] = now
+
+    def _moved(self, oldPath, newPath, isDirectory, now):
+        ''' A rename within the watched trees '''
+        if isDirectory:
+            for wd, directory in self.watches.items():
+                if directory == oldPath or directory.startswith(oldPath + os.sep):
+                    self.watches[wd] = newPath + directory[len(oldPath):]
+            for filePath in [filePath for filePath in self.pending if filePath.startswith(oldPath + os.sep)]:
+                self.pending[newPath + filePath[len(oldPath):]] = self.pending.pop(filePath)
+            try:
+                self.catalog.move(oldPath, newPath, verifyChecksum=False)
+            except KeyError:
+                # Nothing under it was cataloged yet
+                pass
+        elif oldPath in self.pending:
+            self.pending[newPath] = self.pending.pop(oldPath)
+        elif not self.catalog.moveFile(oldPath, newPath, verifyChecksum=False):
+            self.pending[newPath] = now
+
+    def _processDue(self, now):
+        for cookie, (path, isDirectory, eventTime) in list(self.movedFrom.items()):
+            if now - eventTime >= self.MOVE_TIMEOUT:
+                # Moved out of the watched trees - the catalog keeps it, like a deleted file
+                del self.movedFrom[cookie]
+                if isDirectory:
+                    self._unwatchTree(path)
+                else:
+                    self.pending.pop(path, None)
+
+        if self.rescan:
+            self.rescan = False
+            self.pending = {}
+            for root in self.roots:
+                self._watchTree(root)
+                self.catalog.catalog(root)
+
+        duePaths = sorted(path for path, eventTime in self.pending.items() if now - eventTime >= self.debounce)
+        for i in range(0, len(duePaths), self.batchSize):
+            batch = duePaths[i:i + self.batchSize]
+            for path in batch:
+                del self.pending[path]
+            try:
+                self.catalog.catalogFiles(batch)
+            except Exception as e:
+                self.catalog.catalogDb.rollback()
+                print(f'[WARNING] Failed to catalog {len(batch)} files: {e}')
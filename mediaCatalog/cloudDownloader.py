@@ -0,0 +1,228 @@
+import os
+import shutil
+import datetime
+
+from .cloudStorage import CloudStorageObjectMissingException, CloudStorageObjectChecksumMismatchException, CloudStorageTransientException
+from .transferScheduler import TransferScheduler
+from .utils import HashingWriter
+
+class CloudDownloader(object):
+	PARTIAL_SUFFIX = '.mcat-download'
+
+	def __init__(self, catalog, cloudStorage, workers=None, copy=False, scheduler=None):
+		self.catalog = catalog
+		self.cloudStorage = cloudStorage
+		self.catalogDb = self.catalog.catalogDb
+		self.copy = copy
+		self.scheduler = scheduler if scheduler else TransferScheduler.fromConfig(self.catalog.config, maxWorkers=workers)
+		self.cloudStorage.setRateLimiter(self.scheduler)
+
+	def download(self, checksum, destinationPath):
+		''' Download a single file by checksum
+
+			:param checksum: (str) Checksum of the file to download
+			:param destinationPath: (str) Path or directory to download the file to
+			:returns: (str) Path the file was downloaded to
+		'''
+		# Raises a KeyError naming the checksum if it is not in the catalog
+		record = self.catalogDb.read(checksum)[0]
+		self.catalogDb.printFileRecord(checksum)
+		objectName = record['cloud_object_name']
+		if not objectName:
+			raise CloudStorageObjectMissingException(self.cloudStorage.bucketName, checksum)
+
+		# TODO verify project and bucket (cloud_storage)
+
+		if not self.cloudStorage.fileExists(objectName):
+			raise CloudStorageObjectMissingException(self.cloudStorage.bucketName, objectName)
+
+		if os.path.isdir(destinationPath):
+			destinationPath = os.path.join(destinationPath, record['file_name'])
+		self._downloadVerified(objectName, checksum, [destinationPath], record['file_size'])
+		return destinationPath
+
+	def restore(self, records, destination=None, baseDirectory=None, verifyChecksum=False, overwrite=False, dryRun=False):
+		''' Restore cataloged files from the cloud. Each distinct checksum is 
+			downloaded once, verified against the catalog checksum while 
+			streaming and then hardlinked (or copied) to every path that needs 
+			it. Large objects are downloaded as parallel slices and verified 
+			with the CRC32C of the object instead. Files that are already 
+			present with the right size (and checksum, if verifyChecksum is 
+			set) are skipped, and are used instead of the cloud when another 
+			copy of them is needed.
+
+			:param records: (list) Database records to restore, e.g. from CatalogDatabase.read()
+			:param destination: (str) Restore under this directory instead of the cataloged paths
+			:param baseDirectory: (str) Paths are made relative to this directory when restoring to a destination
+			:param verifyChecksum: (bool) Verify checksums of existing local files
+			:param overwrite: (bool) Replace local files that differ from the catalog
+			:param dryRun: (bool) Only report what would be restored
+			:returns: (tuple) Lists of restored, skipped and failed paths
+		'''
+		recordsByChecksum = {}
+		for record in records:
+			recordsByChecksum.setdefault(record['checksum'], []).append(record)
+
+		print(f'\n{len(records)} files ({len(recordsByChecksum)} unique) to check')
+
+		restoredFiles = []
+		skippedFiles = []
+		failedFiles = []
+		tasks = []
+		for checksum, checksumRecords in recordsByChecksum.items():
+			targets = []
+			localSource = None
+			for record in checksumRecords:
+				path = self._getTargetPath(record, destination, baseDirectory)
+				status = self._checkLocalFile(path, record, verifyChecksum)
+				if status == 'ok':
+					skippedFiles.append(path)
+					localSource = localSource or path
+				elif status == 'changed' and not overwrite:
+					print(f'[WARNING] Local file differs from catalog, use --overwrite to replace: {path}')
+					failedFiles.append(path)
+				else:
+					targets.append(path)
+
+			if not targets:
+				continue
+
+			objectName = checksumRecords[0]['cloud_object_name']
+			if not localSource and not objectName:
+				for path in targets:
+					print(f'[ERROR] File is not in the cloud: {path} ({checksum})')
+				failedFiles.extend(targets)
+				continue
+
+			tasks.append((checksum, objectName, localSource, targets))
+
+		bytesToDownload = sum(recordsByChecksum[checksum][0]['file_size'] for checksum, objectName, localSource, targets in tasks if not localSource)
+		numDownloads = sum(1 for task in tasks if not task[2])
+		numTargets = sum(len(task[3]) for task in tasks)
+		print(f'{numTargets} files to restore with {numDownloads} downloads ({bytesToDownload/2**30:.3f} GB)')
+
+		if dryRun:
+			for checksum, objectName, localSource, targets in tasks:
+				source = localSource if localSource else objectName
+				for path in targets:
+					print(f'    {source} -> {path}')
+			return [], skippedFiles, failedFiles
+
+		completedTasks = []
+		def onResult(task, result, exception):
+			checksum, objectName, localSource, targets = task[:4]
+			completedTasks.append(checksum)
+			i = len(completedTasks)
+			if isinstance(exception, (CloudStorageObjectMissingException, 
+									CloudStorageObjectChecksumMismatchException, 
+									CloudStorageTransientException, 
+									RuntimeError,
+									OSError)):
+				print(f'[ERROR] Failed to restore {targets[0]}: {exception}')
+				failedFiles.extend(targets)
+			elif exception:
+				raise exception
+			else:
+				restoredFiles.extend(targets)
+				for path in targets:
+					print(f'[{i}/{len(tasks)}] Restored {path}')
+
+		self.scheduler.run([(checksum, objectName, localSource, targets, recordsByChecksum[checksum][0], verifyChecksum) 
+							for checksum, objectName, localSource, targets in tasks], 
+						self._restoreChecksum, onResult)
+
+		print(f'\nRestore complete!')
+		print('====================')
+		print(f'Restored files: {len(restoredFiles)}')
+		print(f'Skipped files: {len(skippedFiles)}')
+		print(f'Failed files: {len(failedFiles)}')
+		for path in failedFiles:
+			print(f'    {path}')
+
+		return restoredFiles, skippedFiles, failedFiles
+
+	def _restoreChecksum(self, checksum, objectName, localSource, targets, record, localSourceVerified=False):
+		''' Restore the targets of one checksum from a local copy or the cloud. 
+			A local copy that was only checked by size is hashed before it is 
+			propagated - one local read, instead of a download. If it was 
+			already hashed by _checkLocalFile it is not read again.
+		'''
+		if localSource and (localSourceVerified or self.catalog.checksum(localSource) == checksum):
+			for path in targets:
+				self._linkOrCopy(localSource, path)
+		elif objectName:
+			self._downloadVerified(objectName, checksum, targets, record['file_size'])
+		else:
+			raise RuntimeError(f'Local copy {localSource} is corrupt and the file is not in the cloud!')
+
+		for path in targets:
+			self._setModifyTime(path, record)
+
+	def _downloadVerified(self, objectName, checksum, targets, fileSize=0):
+		''' Download an object to the first target, then link or copy it to 
+			the remaining targets. Small objects are hashed while streaming 
+			and checked against the catalog checksum. Large objects are 
+			downloaded as parallel slices, which arrive out of order and can't 
+			be hashed while streaming, so they are checked against the CRC32C 
+			of the object (verified against the local file at upload) instead 
+			of being read back - use mcat verify to check their SHA-256.
+		'''
+		firstPath = targets[0]
+		os.makedirs(os.path.dirname(os.path.abspath(firstPath)), exist_ok=True)
+		partialPath = firstPath + self.PARTIAL_SUFFIX
+		try:
+			if self.cloudStorage.getNumSlices(fileSize) > 1:
+				self.cloudStorage.downloadFileSliced(objectName, partialPath)
+			else:
+				with open(partialPath, 'wb') as f:
+					writer = HashingWriter(f, self.catalog.CHECKSUM_MODE)
+					self.cloudStorage.downloadFileObject(objectName, writer)
+				if writer.hexdigest() != checksum:
+					raise CloudStorageObjectChecksumMismatchException(self.cloudStorage.bucketName, objectName, checksum, writer.hexdigest())
+			os.replace(partialPath, firstPath)
+		finally:
+			if os.path.exists(partialPath):
+				os.remove(partialPath)
+
+		for path in targets[1:]:
+			self._linkOrCopy(firstPath, path)
+
+	def _linkOrCopy(self, sourcePath, path):
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		if os.path.lexists(path):
+			os.remove(path)
+		if not self.copy:
+			try:
+				os.link(sourcePath, path)
+				return
+			except OSError:
+				# Cross-device or the filesystem doesn't support hardlinks
+				pass
+		shutil.copy2(sourcePath, path)
+
+	def _checkLocalFile(self, path, record, verifyChecksum):
+		try:
+			fileSize = os.stat(path).st_size
+		except FileNotFoundError:
+			return 'missing'
+		if fileSize != record['file_size']:
+			return 'changed'
+		if verifyChecksum and self.catalog.checksum(path) != record['checksum']:
+			return 'changed'
+		return 'ok'
+
+	def _getTargetPath(self, record, destination, baseDirectory):
+		path = os.path.join(record['directory'], record['file_name'])
+		if destination is None:
+			return path
+		relativePath = os.path.relpath(path, baseDirectory if baseDirectory else '/')
+		return os.path.join(destination, relativePath)
+
+	def _setModifyTime(self, path, record):
+		''' Restore the modification time from the catalog (exiftool format) '''
+		try:
+			modifyTime = datetime.datetime.strptime(record['file_modify_datetime'], '%Y:%m:%d %H:%M:%S%z')
+		except (TypeError, ValueError):
+			return
+		timestamp = modifyTime.timestamp()
+		os.utime(path, (timestamp, timestamp))
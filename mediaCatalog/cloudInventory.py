@@ -0,0 +1,69 @@
+class CloudInventory(object):
+    ''' Copy of the cloud bucket listing kept in the catalog database, so 
+        routine cloud verification doesn't have to list the whole bucket. 
+        The uploader and remove keep it up to date object by object, and it 
+        is fully refreshed from a bucket listing once it is older than 
+        maxAge or when forced.
+    '''
+    DEFAULT_MAX_AGE = 7*24
+
+    def __init__(self, catalog, cloudStorage, maxAge=None):
+        ''' :param catalog: MediaCatalog the inventory is stored in
+            :param cloudStorage: CloudStorage object of the bucket
+            :param maxAge: (float) Hours before a full refresh - by default cloudInventoryMaxAge from the config
+        '''
+        self.catalogDb = catalog.catalogDb
+        self.cloudStorage = cloudStorage
+        self.prefix = catalog.config['cloudObjectPrefix'] + '/'
+        if maxAge is None:
+            maxAge = catalog.config.get('cloudInventoryMaxAge', self.DEFAULT_MAX_AGE)
+        self.maxAge = maxAge*3600
+
+    def getAge(self):
+        ''' :returns: (float) Seconds since the last full refresh, or None if there has been none '''
+        return self.catalogDb.getCloudInventoryAge(self.cloudStorage.projectId, self.cloudStorage.bucketName, self.prefix)
+
+    def isStale(self):
+        age = self.getAge()
+        return age is None or age > self.maxAge
+
+    def refresh(self, force=False):
+        ''' Replace the inventory with a full bucket listing if it is stale or force is set
+
+            :param force: (bool) Refresh even if the inventory is recent
+            :returns: (bool) True if the inventory was refreshed
+        '''
+        if not force and not self.isStale():
+            print(f'Using cloud inventory from {self.getAge()/3600:.1f} hours ago')
+            return False
+
+        print(f'\nDownloading cloud object metadata... this takes a minute or two...')
+        try:
+            numObjects = self.catalogDb.replaceCloudInventory(self.cloudStorage.projectId, 
+                                                              self.cloudStorage.bucketName, 
+                                                              self.prefix, 
+                                                              self.cloudStorage.listObjects(prefix=self.prefix))
+        except BaseException:
+            self.catalogDb.rollback()
+            raise
+        self.catalogDb.commit()
+        print(f'--> {numObjects} objects in cloud inventory')
+        return True
+
+    def get(self, objectName):
+        ''' :returns: The inventory record of an object, or None if it is not in the cloud '''
+        return self.catalogDb.getCloudObject(self.cloudStorage.projectId, self.cloudStorage.bucketName, objectName)
+
+    def iterObjects(self):
+        ''' :returns: Generator of the inventory records in object name order '''
+        return self.catalogDb.iterCloudObjects(self.cloudStorage.projectId, self.cloudStorage.bucketName, self.prefix)
+
+    def update(self, objectInfo):
+        ''' Record an object that was uploaded or checked
+
+            :param objectInfo: (tuple) (objectName, size, checksum, generation) from CloudStorage.getObjectInfo()
+        '''
+        self.catalogDb.setCloudObject(self.cloudStorage.projectId, self.cloudStorage.bucketName, *objectInfo)
+
+    def remove(self, objectName):
+        self.catalogDb.deleteCloudObject(self.cloudStorage.projectId, self.cloudStorage.bucketName, objectName)
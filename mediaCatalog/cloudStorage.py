@@ -1,3 +1,11 @@
+import os
+import io
+import math
+import time
+import random
+import concurrent.futures
+
+
 class CloudStorageObjectMissingException(Exception):
     def __init__(self, bucketName, objectName):
         self.bucketName = bucketName
@@ -29,11 +37,74 @@ class CloudStorageObjectChecksumMismatchException(Exception):
             self.message = f'Object {objectName} in bucket {bucketName} has checksum {actualChecksum} but expected checksum {expectedChecksum}!'
         super().__init__(self.message)
 
+class CloudStorageTransientException(Exception):
+    def __init__(self, bucketName, objectName, reason=None):
+        self.bucketName = bucketName
+        self.objectName = objectName
+        self.reason = reason
+        self.message = f'Transient error transferring object {objectName} in bucket {bucketName}!'
+        if reason:
+            self.message += f' ({reason})'
+        super().__init__(self.message)
+
+class ThrottledWriter(object):
+    ''' File-like object passing writes through a rate limiter '''
+    def __init__(self, fileObj, rateLimiter):
+        self.fileObj = fileObj
+        self.rateLimiter = rateLimiter
+
+    def write(self, data):
+        self.rateLimiter.consume(len(data))
+        return self.fileObj.write(data)
+
+    def flush(self):
+        self.fileObj.flush()
+
+def createCloudStorage(config):
+    ''' Create the cloud storage backend selected by a catalog config. 
+        cloudStorageType is 'google' (default) or 'local'. For local storage, 
+        cloudProject is the root directory of the buckets.
+
+        :param config: (dict) Catalog config
+        :returns: CloudStorage object
+    '''
+    cloudStorageType = config.get('cloudStorageType', 'google')
+    if cloudStorageType == 'google':
+        from .googleCloudStorage import GoogleCloudStorage
+        return GoogleCloudStorage(config['cloudProject'], 
+                                  config['defaultCloudBucket'], 
+                                  chunkSize=config.get('uploadChunkSize'))
+    elif cloudStorageType == 'local':
+        from .localCloudStorage import LocalCloudStorage
+        return LocalCloudStorage(config['cloudProject'], 
+                                 config['defaultCloudBucket'], 
+                                 chunkSize=config.get('uploadChunkSize'),
+                                 latency=config.get('localCloudLatency', 0.0),
+                                 bandwidth=config.get('localCloudBandwidth'),
+                                 failureRate=config.get('localCloudFailureRate', 0.0))
+    raise ValueError(f'Invalid cloudStorageType ({cloudStorageType})! Must be google or local')
+
 class CloudStorage(object):
+    MAX_RETRIES = 8
+    INITIAL_RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 64.0
+    SLICED_DOWNLOAD_THRESHOLD = 256*1024*1024
+    SLICED_DOWNLOAD_MIN_SLICE_SIZE = 64*1024*1024
+    SLICED_DOWNLOAD_MAX_SLICES = 8
+
     def __init__(self, bucketName):
         if not bucketName or not bucketName.strip():
             raise ValueError('bucketName is not set!')
         self.bucketName = bucketName
+        self.rateLimiter = None
+
+    def setRateLimiter(self, rateLimiter):
+        ''' Limit transfers with an object whose consume(numBytes) blocks 
+            until numBytes may be transferred, e.g. a TransferScheduler
+
+            :param rateLimiter: Rate limiter, or None to transfer at full speed
+        '''
+        self.rateLimiter = rateLimiter
 
     def listBuckets(self):
         raise NotImplementedError
@@ -47,14 +118,33 @@ class CloudStorage(object):
     def setBucket(self, bucketName):
         raise NotImplementedError
 
-    def listFiles(self, prefix=None, extended=False):
+    def listFiles(self, prefix=None, delimiter=None, extended=False):
         ''' List the files in the cloud, optionally filtering by prefix.
 
             :param prefix: (str) The prefix to filter by
+            :param delimiter: (str) If set, only list objects with no delimiter after the prefix
             :param extended: (bool) If True, return a list of tuples with (objectName, size, checksum)
             :returns: A list of object names or a list of tuples with (objectName, size, checksum)
         '''
-        self._listFiles(self.bucketName, prefix, extended)
+        return self._listFiles(self.bucketName, prefix=prefix, delimiter=delimiter, extended=extended)
+
+    def listObjects(self, prefix=None):
+        ''' Iterate over the objects in the cloud in lexicographic order of 
+            object name. Objects are fetched page by page as the iterator is 
+            consumed, so the listing is never held in memory.
+
+            :param prefix: (str) The prefix to filter by
+            :returns: Iterator of (objectName, size, checksum, generation) tuples
+        '''
+        return self._listObjects(self.bucketName, prefix=prefix)
+
+    def getObjectInfo(self, objectName):
+        ''' Get the metadata of an object
+
+            :param objectName: (str) The name of the file in the cloud
+            :returns: (tuple) (objectName, size, checksum, generation)
+        '''
+        return self._getObjectInfo(self.bucketName, objectName)
 
     def fileExists(self, objectName):
         return self._fileExists(self.bucketName, objectName)
@@ -75,8 +165,118 @@ class CloudStorage(object):
     def downloadFile(self, objectName, destinationPath):
         self._downloadFile(self.bucketName, objectName, destinationPath)
 
-    def uploadFile(self, sourcePath, objectName, mimeType=None):
-        self._uploadFile(sourcePath, self.bucketName, objectName, mimeType)
+    def downloadFileObject(self, objectName, fileObj):
+        ''' Stream an object from the cloud into a writable file-like object
+
+            :param objectName: (str) The name of the file in the cloud
+            :param fileObj: Object with a write() method that receives the data
+        '''
+        self._downloadFileObject(self.bucketName, objectName, self._throttledWriter(fileObj))
+
+    def readRange(self, objectName, start, end):
+        ''' Read a byte range of an object into memory
+
+            :param objectName: (str) The name of the file in the cloud
+            :param start: (int) First byte to read
+            :param end: (int) Last byte to read (inclusive)
+            :returns: (bytes) The data
+        '''
+        def attempt():
+            buffer = io.BytesIO()
+            self._downloadRange(self.bucketName, objectName, self._throttledWriter(buffer), start, end)
+            return buffer.getvalue()
+        return self._retry(attempt, self.bucketName, objectName)
+
+    def hashObject(self, objectName, mode='SHA256'):
+        ''' Stream an object through a hash function in memory, without 
+            writing it to disk. A retried transfer is hashed from the start.
+
+            :param objectName: (str) The name of the file in the cloud
+            :param mode: (str) Hash function - SHA256 or MD5
+            :returns: (tuple) Hex digest and number of bytes read
+        '''
+        from .utils import HashingWriter
+
+        def attempt():
+            writer = HashingWriter(None, mode)
+            self._downloadFileObject(self.bucketName, objectName, self._throttledWriter(writer))
+            return writer.hexdigest(), writer.bytesWritten
+        return self._retry(attempt, self.bucketName, objectName)
+
+    def downloadFileSliced(self, objectName, destinationPath, numSlices=None):
+        ''' Download an object as byte-range slices in parallel. The 
+            destination is preallocated and each slice is written into place 
+            with pwrite. The CRC32C of each slice is computed over the bytes 
+            received and the combined CRC32C is checked against the CRC32C of 
+            the object, so this verifies the transfer end to end - it does not 
+            read the file back from disk.
+
+            :param objectName: (str) The name of the file in the cloud
+            :param destinationPath: (str) The path to download the file to
+            :param numSlices: (int) Number of slices - by default chosen from the object size
+        '''
+        from .crc32cUtils import SliceWriter, crc32cCombine
+
+        fileSize = self.getSize(objectName)
+        checksum = self.getChecksum(objectName)
+        if numSlices is None:
+            numSlices = self.getNumSlices(fileSize)
+        numSlices = max(1, min(numSlices, fileSize))
+        sliceSize = math.ceil(fileSize/numSlices) if fileSize else 0
+        slices = [(start, min(start + sliceSize, fileSize) - 1) for start in range(0, fileSize, sliceSize)] if fileSize else []
+
+        def downloadSlice(fd, start, end):
+            # A retried slice is rewritten from its start
+            def attempt():
+                writer = SliceWriter(fd, start)
+                self._downloadRange(self.bucketName, objectName, self._throttledWriter(writer), start, end)
+                if writer.bytesWritten != end - start + 1:
+                    raise CloudStorageTransientException(self.bucketName, objectName, 
+                            f'short read of bytes {start}-{end} ({writer.bytesWritten} bytes)')
+                return writer.crc32c()
+            return self._retry(attempt, self.bucketName, objectName)
+
+        fd = os.open(destinationPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                if fileSize:
+                    try:
+                        os.posix_fallocate(fd, 0, fileSize)
+                    except (AttributeError, OSError):
+                        os.ftruncate(fd, fileSize)
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(slices))) as executor:
+                    sliceCrcs = list(executor.map(lambda s: downloadSlice(fd, *s), slices))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            combinedCrc = 0
+            for (start, end), sliceCrc in zip(slices, sliceCrcs):
+                combinedCrc = crc32cCombine(combinedCrc, sliceCrc, end - start + 1)
+            if combinedCrc != checksum:
+                raise CloudStorageObjectChecksumMismatchException(self.bucketName, objectName, checksum, combinedCrc)
+        except BaseException:
+            os.remove(destinationPath)
+            raise
+
+    def getNumSlices(self, fileSize):
+        ''' Number of slices to download an object of the given size with '''
+        if fileSize < self.SLICED_DOWNLOAD_THRESHOLD:
+            return 1
+        return min(self.SLICED_DOWNLOAD_MAX_SLICES, math.ceil(fileSize/self.SLICED_DOWNLOAD_MIN_SLICE_SIZE))
+
+    def uploadFile(self, sourcePath, objectName, mimeType=None, sessionUri=None, progressCallback=None):
+        ''' Upload a local file to the cloud. Large files are uploaded in 
+            chunks through a resumable session if the backend supports it.
+
+            :param sourcePath: (str) The path to the local file
+            :param objectName: (str) The name of the file in the cloud
+            :param mimeType: (str) The content type of the object
+            :param sessionUri: (str) A previously started upload session to resume
+            :param progressCallback: Called with (sessionUri, bytesUploaded) whenever 
+                                     a chunk has been persisted by the cloud
+        '''
+        self._uploadFile(sourcePath, self.bucketName, objectName, mimeType, sessionUri, progressCallback)
 
     def deleteFile(self, objectName):
         self._deleteFile(self.bucketName, objectName)
@@ -93,16 +293,32 @@ class CloudStorage(object):
     def computeChecksum(self, sourcePath):
         return self._computeChecksum(sourcePath)
 
-    def _listFiles(self, bucketName, prefix=None):
+    def _listFiles(self, bucketName, prefix=None, delimiter=None, extended=False):
+        raise NotImplementedError
+
+    def _listObjects(self, bucketName, prefix=None):
+        raise NotImplementedError
+
+    def _getObjectInfo(self, bucketName, objectName):
+        raise NotImplementedError
+
+    def _fileExists(self, bucketName, objectName):
         raise NotImplementedError
 
-    def _exists(self, bucketName, objectName):
+    def _validateFile(self, bucketName, objectName, fileSize=None, checksum=None, sourcePath=None):
         raise NotImplementedError
 
     def _downloadFile(self, bucketName, objectName, destinationPath):
         raise NotImplementedError
 
-    def _uploadFile(self, sourcePath, bucketName, objectName, mimeType=None):
+    def _downloadFileObject(self, bucketName, objectName, fileObj):
+        raise NotImplementedError
+
+    def _downloadRange(self, bucketName, objectName, fileObj, start, end):
+        ''' Stream bytes start to end (inclusive) of an object into fileObj '''
+        raise NotImplementedError
+
+    def _uploadFile(self, sourcePath, bucketName, objectName, mimeType=None, sessionUri=None, progressCallback=None):
         raise NotImplementedError
 
     def _deleteFile(self, bucketName, objectName):
@@ -113,3 +329,48 @@ class CloudStorage(object):
 
     def _getMimeType(self, bucketName, objectName):
         raise NotImplementedError
+
+    def _getChecksum(self, bucketName, objectName):
+        raise NotImplementedError
+
+    def _computeChecksum(self, sourcePath):
+        raise NotImplementedError
+
+    def _throttle(self, numBytes):
+        ''' Called by the backends before transferring numBytes '''
+        if self.rateLimiter:
+            self.rateLimiter.consume(numBytes)
+
+    def _throttledWriter(self, fileObj):
+        ''' Wrap a file object so writes to it are rate limited '''
+        return ThrottledWriter(fileObj, self.rateLimiter) if self.rateLimiter else fileObj
+
+    def _isTransientError(self, exception):
+        return isinstance(exception, CloudStorageTransientException)
+
+    def _retryDelay(self, attempt):
+        ''' Exponential backoff with jitter for the given (1-based) retry attempt '''
+        delay = min(self.MAX_RETRY_DELAY, self.INITIAL_RETRY_DELAY * 2**(attempt-1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retry(self, function, bucketName=None, objectName=None):
+        ''' Call function, retrying with exponential backoff on transient errors
+
+            :param function: Callable taking no arguments
+            :returns: The return value of function
+        '''
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except Exception as e:
+                if not self._isTransientError(e):
+                    raise
+                attempt += 1
+                if attempt > self.MAX_RETRIES:
+                    if isinstance(e, CloudStorageTransientException):
+                        raise
+                    raise CloudStorageTransientException(bucketName, objectName, str(e)) from e
+                delay = self._retryDelay(attempt)
+                print(f'    Transient error ({e}), retrying in {delay:.1f} s ({attempt}/{self.MAX_RETRIES})...')
+                time.sleep(delay)
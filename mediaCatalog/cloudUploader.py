@@ -1,13 +1,18 @@
 import logging
 import os
 
-from .cloudStorage import CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException
+from .cloudStorage import CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException, CloudStorageTransientException
+from .transferScheduler import TransferScheduler
+from .cloudInventory import CloudInventory
 
 class CloudUploader(object):
-	def __init__(self, catalog, cloudStorage):
+	def __init__(self, catalog, cloudStorage, scheduler=None):
 		self.catalog = catalog
 		self.cloudStorage = cloudStorage
 		self.catalogDb = self.catalog.catalogDb
+		self.scheduler = scheduler if scheduler else TransferScheduler.fromConfig(self.catalog.config)
+		self.cloudStorage.setRateLimiter(self.scheduler)
+		self.inventory = CloudInventory(self.catalog, self.cloudStorage)
 
 	def upload(self):
 		totalFileCount = self.catalogDb.getFileCount()
@@ -23,38 +28,101 @@ class CloudUploader(object):
 		notUploadedPercentage = len(filesToUpload)/totalFileCount*100
 		print(f'\n{len(filesToUpload)}/{totalFileCount} ({notUploadedPercentage:.3f} %) files to be uploaded')
 
-		uploadedFiles = []
-		skippedFiles = []
-		for i, (checksum, filename, directory, mimeType) in enumerate(filesToUpload, 1):
+		# Duplicates share a cloud object, so each checksum is uploaded once
+		tasks = []
+		checksums = set()
+		for checksum, filename, directory, mimeType in filesToUpload:
+			if checksum in checksums:
+				continue
+			checksums.add(checksum)
 			sourcePath = os.path.join(directory, filename)
 			objectName = os.path.join(self.catalog.config['cloudObjectPrefix'], checksum)
+			tasks.append((checksum, sourcePath, objectName, mimeType, self._getSessionUri(sourcePath, objectName)))
+		if len(tasks) < len(filesToUpload):
+			print(f'{len(tasks)} unique files to be uploaded')
 
-			uploadedPercentage = i/len(filesToUpload)*100
-			print(f'[{i}/{len(filesToUpload)} ({uploadedPercentage:.3f} %)] {sourcePath} -> {objectName}')
+		uploadedFiles = []
+		skippedFiles = []
+		failedFiles = []
+		def onResult(task, result, exception):
+			checksum, sourcePath, objectName, mimeType, sessionUri = task
+			i = len(uploadedFiles) + len(skippedFiles) + len(failedFiles) + 1
+			uploadedPercentage = i/len(tasks)*100
+			print(f'[{i}/{len(tasks)} ({uploadedPercentage:.3f} %)] {sourcePath} -> {objectName}')
+			if isinstance(exception, CloudStorageTransientException):
+				print(f'    ERROR: {exception} Upload will be resumed on the next run.')
+				failedFiles.append((sourcePath, objectName))
+				return
+			elif exception:
+				raise exception
 
-			try:
-				self.cloudStorage.validateFile(objectName, sourcePath=sourcePath)
-			except CloudStorageObjectMissingException as e:
-				self.cloudStorage.uploadFile(sourcePath, objectName, mimeType)
+			uploaded, objectInfo = result
+			objectChecksum = objectInfo[2]
+			if uploaded:
 				uploadedFiles.append((sourcePath, objectName))
+				self.catalogDb.deleteUploadSession(self.cloudStorage.projectId, self.cloudStorage.bucketName, objectName)
 			else:
 				print('    WARNING: Object already exists in the cloud!')
 				print('    Checksums match. Skipping upload.')
 				skippedFiles.append((sourcePath, objectName))
-			
-			objectChecksum = self.cloudStorage.getChecksum(objectName)
 			self.catalogDb.setCloudStorage(checksum, 
 											self.cloudStorage.projectId, 
 											self.cloudStorage.bucketName, 
 											objectName, 
 											objectChecksum
 											)
+			self.inventory.update(objectInfo)
 			self.catalogDb.commit()
 			# self.catalogDb.printFileRecord(checksum)
 
-		numProcessedFiles = len(uploadedFiles) + len(skippedFiles)
+		self.scheduler.run(tasks, self._uploadFile, onResult)
+
+		numProcessedFiles = len(uploadedFiles) + len(skippedFiles) + len(failedFiles)
 		print(f'\nUpload complete!')
 		print('====================')
 		print(f'Files processed: {numProcessedFiles}')
 		print(f'Uploaded files: {len(uploadedFiles)}')
-		print(f'Skipped files: {len(skippedFiles)}')
\ No newline at end of file
+		print(f'Skipped files: {len(skippedFiles)}')
+		print(f'Failed files: {len(failedFiles)}')
+		for sourcePath, objectName in failedFiles:
+			print(f'    {sourcePath} -> {objectName}')
+		print(f'Average throughput: {self.scheduler.throughput()/2**20:.2f} MB/s')
+
+	def _getSessionUri(self, sourcePath, objectName):
+		''' Get the upload session stored in the catalog for an object, if 
+			it was started for a file of the same size
+		'''
+		session = self.catalogDb.getUploadSession(self.cloudStorage.projectId, self.cloudStorage.bucketName, objectName)
+		if session and session['file_size'] == os.stat(sourcePath).st_size:
+			print(f'    Found upload session for {sourcePath} from {session["updated_datetime"]} ({session["bytes_uploaded"]}/{session["file_size"]} bytes)')
+			return session['session_uri']
+		return None
+
+	def _uploadFile(self, checksum, sourcePath, objectName, mimeType, sessionUri):
+		''' Upload a file unless it is already in the cloud, resuming a 
+			previously interrupted upload session if one is stored in the 
+			catalog. The session and the number of bytes persisted by the 
+			cloud are saved after every chunk so the upload survives a crash 
+			or reboot. Runs on a scheduler worker thread - catalog writes are 
+			handed to the main thread.
+
+			:returns: (tuple) Whether the file was uploaded and the (objectName, size, checksum, generation) of the object
+		'''
+		projectId = self.cloudStorage.projectId
+		bucketName = self.cloudStorage.bucketName
+		fileSize = os.stat(sourcePath).st_size
+
+		def saveProgress(sessionUri, bytesUploaded):
+			def save():
+				self.catalogDb.setUploadSession(projectId, bucketName, objectName, sourcePath, fileSize, sessionUri, bytesUploaded)
+				self.catalogDb.commit()
+			self.scheduler.callInMainThread(save)
+
+		try:
+			self.cloudStorage.validateFile(objectName, sourcePath=sourcePath)
+		except CloudStorageObjectMissingException as e:
+			self.cloudStorage.uploadFile(sourcePath, objectName, mimeType, sessionUri=sessionUri, progressCallback=saveProgress)
+			uploaded = True
+		else:
+			uploaded = False
+		return uploaded, self.cloudStorage.getObjectInfo(objectName)
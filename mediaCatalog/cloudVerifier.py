@@ -0,0 +1,112 @@
+import os
+import array
+import random
+import itertools
+
+from .cloudStorage import CloudStorageObjectMissingException, CloudStorageObjectChecksumMismatchException
+from .transferScheduler import TransferScheduler
+
+
+class CloudVerifier(object):
+    ''' Deep verification of cloud objects. Each object is streamed through
+        the catalog's SHA-256 hash function in memory, which proves it is
+        readable and matches the cataloged file. For a cheaper statistical
+        audit, a few random byte ranges of each object can be read instead,
+        and compared with the local file if it is present. Nothing is
+        written to disk.
+
+        Transfers run on a TransferScheduler, so they share its concurrency
+        and bandwidth limits.
+    '''
+    SAMPLE_SIZE = 1024*1024
+
+    def __init__(self, catalog, cloudStorage, scheduler=None):
+        self.catalog = catalog
+        self.cloudStorage = cloudStorage
+        self.scheduler = scheduler if scheduler else TransferScheduler.fromConfig(catalog.config)
+        self.cloudStorage.setRateLimiter(self.scheduler)
+
+    def verify(self, records, samples=None, budget=None):
+        ''' Verify the cloud objects of the records. Records sharing an object
+            are verified with one read if they are next to each other.
+
+            :param records: Iterable of database records, e.g. from CatalogDatabase.iterRecords() ordered by cloud_object_name
+            :param samples: (int) Read this many random ranges of SAMPLE_SIZE bytes from each object instead of all of it
+            :param budget: VerifyBudget - stop starting new objects when it is used up
+            :returns: (dict) Number of found, missing, changed and unreadable files, and the ids of the files that verified
+        '''
+        results = {'found': 0, 'missing': 0, 'changed': 0, 'unreadable': 0, 'verifiedIds': array.array('q')}
+
+        def tasks():
+            for objectName, group in itertools.groupby(records, key=lambda record: record['cloud_object_name']):
+                if budget and budget.exhausted():
+                    return
+                group = list(group)
+                if budget:
+                    fileSize = group[0]['file_size']
+                    budget.spend(min(fileSize, samples*self.SAMPLE_SIZE) if samples else fileSize)
+                yield objectName, group, samples
+
+        def onResult(task, result, exception):
+            objectName, group, samples = task
+            if exception:
+                status, message = 'unreadable', f'[WARNING] Cloud file could not be read: {objectName} ({exception})'
+            else:
+                status, message = result
+            for record in group:
+                results[status] += 1
+                if status == 'found':
+                    results['verifiedIds'].append(record['id'])
+            if message:
+                print(message)
+
+        self.scheduler.run(tasks(), self._verifyObject, onResult)
+        return results
+
+    def _verifyObject(self, objectName, records, samples=None):
+        ''' Runs on a worker thread
+
+            :returns: (tuple) Status - found, missing or changed - and a message to print
+        '''
+        record = records[0]
+        if objectName is None:
+            return 'missing', f'Cloud file not uploaded: {os.path.join(record["directory"], record["file_name"])}'
+        try:
+            if samples:
+                return self._sampleObject(objectName, record, samples)
+            checksum, numBytes = self.cloudStorage.hashObject(objectName, self.catalog.CHECKSUM_MODE)
+        except CloudStorageObjectMissingException:
+            return 'missing', f'Cloud file not found: {objectName}'
+        except CloudStorageObjectChecksumMismatchException:
+            return 'changed', f'[WARNING] Cloud file failed transfer checksum: {objectName}'
+        if numBytes != record['file_size']:
+            return 'changed', f'[WARNING] Cloud file changed size: {objectName} ({record["file_size"]} -> {numBytes})'
+        if checksum != record['checksum']:
+            return 'changed', f'[WARNING] Cloud file changed: {objectName} ({record["checksum"]} -> {checksum})'
+        return 'found', None
+
+    def _sampleObject(self, objectName, record, samples):
+        ''' Read random ranges of an object and compare them with the local
+            file, if it is present and the right size
+        '''
+        fileSize = record['file_size']
+        if fileSize == 0:
+            return 'found', None
+        localPath = os.path.join(record['directory'], record['file_name'])
+        try:
+            localFile = open(localPath, 'rb') if os.path.getsize(localPath) == fileSize else None
+        except OSError:
+            localFile = None
+        try:
+            for i in range(samples):
+                start = random.randrange(max(1, fileSize - self.SAMPLE_SIZE + 1))
+                end = min(start + self.SAMPLE_SIZE, fileSize) - 1
+                data = self.cloudStorage.readRange(objectName, start, end)
+                if len(data) != end - start + 1:
+                    return 'changed', f'[WARNING] Cloud file is short: {objectName} (read {len(data)} of bytes {start}-{end})'
+                if localFile is not None and os.pread(localFile.fileno(), len(data), start) != data:
+                    return 'changed', f'[WARNING] Cloud file differs from local file at bytes {start}-{end}: {objectName}'
+        finally:
+            if localFile is not None:
+                localFile.close()
+        return 'found', None
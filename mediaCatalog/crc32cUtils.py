@@ -0,0 +1,80 @@
+import os
+
+import google_crc32c
+
+
+CRC32C_POLYNOMIAL = 0x82F63B78  # Castagnoli, reflected
+
+def _gf2MatrixTimes(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+def _gf2MatrixSquare(matrix):
+    return [_gf2MatrixTimes(matrix, matrix[n]) for n in range(32)]
+
+def crc32cCombine(crc1, crc2, length2):
+    ''' Combine the CRC32C of two consecutive blocks of data, as zlib's 
+        crc32_combine() does for CRC32
+
+        :param crc1: (int) CRC32C of the first block
+        :param crc2: (int) CRC32C of the second block
+        :param length2: (int) Length of the second block in bytes
+        :returns: (int) CRC32C of the concatenated blocks
+    '''
+    if length2 == 0:
+        return crc1
+
+    # Operator for one zero bit, then squared to get two and four zero bits
+    odd = [CRC32C_POLYNOMIAL] + [1 << n for n in range(31)]
+    even = _gf2MatrixSquare(odd)
+    odd = _gf2MatrixSquare(even)
+
+    # Apply length2 zero bytes to crc1
+    while True:
+        even = _gf2MatrixSquare(odd)
+        if length2 & 1:
+            crc1 = _gf2MatrixTimes(even, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+        odd = _gf2MatrixSquare(even)
+        if length2 & 1:
+            crc1 = _gf2MatrixTimes(odd, crc1)
+        length2 >>= 1
+        if length2 == 0:
+            break
+
+    return crc1 ^ crc2
+
+class SliceWriter(object):
+    ''' File-like object that writes a byte range of a file in place with 
+        pwrite, computing the CRC32C of the data as it goes. The CRC32C covers 
+        the bytes received from the cloud, not a re-read of what is on disk.
+    '''
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+        self.bytesWritten = 0
+        self.crcHelper = google_crc32c.Checksum()
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        self.crcHelper.update(data)
+        self.bytesWritten += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def crc32c(self):
+        return self.crcHelper._crc
@@ -0,0 +1,154 @@
+import os
+import struct
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# FS_IOC_FIEMAP = _IOWR('f', 11, struct fiemap)
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQLLLL')
+FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
+FIEMAP_MAX_LENGTH = 0xFFFFFFFFFFFFFFFF
+FIEMAP_EXTENT_SHARED = 0x2000
+
+LAYOUT_ORDERS = ['path', 'inode', 'extent']
+
+
+def getFirstExtent(path):
+    ''' Physical byte offset of the first extent of a file from the FIEMAP ioctl
+
+        :returns: (int) Offset on the device, or None if it isn't available (not Linux,
+                  filesystem without FIEMAP, empty or inline file)
+    '''
+    extent = _getFirstExtent(path)
+    return extent[0] if extent else None
+
+
+def getSharedExtent(path):
+    ''' Physical byte offset of the first extent of a file if it is shared with
+        another file - a reflinked copy or a snapshot on btrfs or XFS
+
+        :returns: (int) Offset on the device, or None if the extent isn't shared or unknown
+    '''
+    extent = _getFirstExtent(path)
+    return extent[0] if extent and extent[1] & FIEMAP_EXTENT_SHARED else None
+
+
+def _getFirstExtent(path):
+    ''' :returns: (tuple) Physical offset and flags of the first extent, or None '''
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_HEADER.pack(0, FIEMAP_MAX_LENGTH, 0, 0, 1, 0) + bytes(FIEMAP_EXTENT.size))
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    mappedExtents = FIEMAP_HEADER.unpack_from(request)[3]
+    if not mappedExtents:
+        return None
+    extent = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+    return extent[1], extent[5]
+
+
+def sortByLayout(paths, order='path'):
+    ''' Sort paths so they can be read with as little seeking as possible
+
+        :param paths: (list) File paths
+        :param order: (str) path - sorted paths
+                            inode - by device and inode number, which most filesystems
+                                    allocate close to the data
+                            extent - by device and the physical offset of the first extent
+                                     (FIEMAP), falling back to the inode number
+        :returns: (list) Sorted paths - paths that can't be stat'd are sorted last by path
+    '''
+    if order not in LAYOUT_ORDERS:
+        raise ValueError(f'Invalid layout order ({order})! Valid orders are: {LAYOUT_ORDERS}')
+    if order == 'path':
+        return sorted(paths)
+
+    def key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return (1, 0, 0, 0, path)
+        if order == 'extent':
+            extent = getFirstExtent(path)
+            if extent is not None:
+                return (0, stat.st_dev, 0, extent, path)
+        return (0, stat.st_dev, 1, stat.st_ino, path)
+    return sorted(paths, key=key)
+
+
+def isRotational(path):
+    ''' Whether the block device a file is on is a spinning disk, from
+        /sys/dev/block/<major>:<minor>/queue/rotational on Linux
+
+        :returns: (bool) True for a spinning disk, False for an SSD, or None if unknown
+    '''
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    blockPath = f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}'
+    # Partitions don't have a queue, their disk does
+    for queuePath in [os.path.join(blockPath, 'queue', 'rotational'), os.path.join(blockPath, '..', 'queue', 'rotational')]:
+        try:
+            with open(queuePath, 'r') as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+class DeviceLimiter(object):
+    ''' Limits the number of concurrent readers per device, so spinning disks
+        get one or two sequential readers while SSDs get many
+    '''
+    DEFAULT_ROTATIONAL_READERS = 1
+    DEFAULT_SOLID_STATE_READERS = 8
+
+    def __init__(self, rotationalReaders=None, solidStateReaders=None):
+        self.rotationalReaders = rotationalReaders if rotationalReaders else self.DEFAULT_ROTATIONAL_READERS
+        self.solidStateReaders = solidStateReaders if solidStateReaders else self.DEFAULT_SOLID_STATE_READERS
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fromConfig(cls, config):
+        ''' Create a limiter from the hashReadersRotational and hashReadersSolidState config keys '''
+        config = config if config else {}
+        return cls(config.get('hashReadersRotational'), config.get('hashReadersSolidState'))
+
+    @property
+    def maxReaders(self):
+        return max(self.rotationalReaders, self.solidStateReaders)
+
+    def getReaders(self, path):
+        ''' Number of concurrent readers allowed on the device of path - unknown devices are treated as SSDs '''
+        return self.rotationalReaders if isRotational(path) else self.solidStateReaders
+
+    @contextlib.contextmanager
+    def reading(self, path):
+        ''' Context manager that holds one of the reader slots of the device of path '''
+        try:
+            dev = os.stat(path).st_dev
+        except OSError:
+            dev = None
+        with self.lock:
+            semaphore = self.semaphores.get(dev)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self.getReaders(path) if dev is not None else self.solidStateReaders)
+                self.semaphores[dev] = semaphore
+        with semaphore:
+            yield
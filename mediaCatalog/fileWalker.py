@@ -0,0 +1,140 @@
+import os
+import re
+import fnmatch
+
+
+class FileWalker(object):
+    ''' Walks directories with os.scandir and yields the files that may be
+        media, so files that can never be media never reach exiftool.
+
+        Files and directories are dropped if they match an exclude glob, or
+        if include globs are given and a file matches none of them. Globs
+        containing a / are matched against the full path, others against the
+        name. The prefilter then drops files with a known non-media extension,
+        or whose first bytes identify a non-media format. Everything else is
+        left to exiftool's MIME type detection.
+    '''
+    # Caches, previews, sidecars and system files
+    DEFAULT_EXCLUDES = ['*.lrtpreview', '*.lrprev', '*.lrdata', '*.lrcat', '*.lrcat-journal', '*.lock',
+                        '.DS_Store', '._*', 'Thumbs.db', 'desktop.ini', '.Spotlight-V100', '.Trashes',
+                        '.fseventsd', '@eaDir', '.thumbnails', '*.tmp', '*.part', '*.partial']
+    MEDIA_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.heic', '.heif', '.webp',
+                        '.dng', '.cr2', '.cr3', '.nef', '.arw', '.raf', '.orf', '.rw2', '.pef', '.srw',
+                        '.mov', '.mp4', '.m4v', '.avi', '.mts', '.m2ts', '.mkv', '.3gp', '.mpg', '.mpeg', '.wmv',
+                        '.mp3', '.m4a', '.aac', '.wav', '.flac', '.aiff', '.aif', '.ogg', '.opus', '.wma', '.txt'}
+    NON_MEDIA_EXTENSIONS = {'.db', '.sqlite', '.ini', '.plist', '.json', '.xml', '.xmp', '.pp3', '.dop',
+                            '.zip', '.gz', '.tgz', '.7z', '.rar', '.dmg', '.iso', '.exe', '.dll', '.so',
+                            '.dylib', '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.pyc'}
+    # Leading bytes of formats exiftool never reports as image, video, audio or text
+    NON_MEDIA_SIGNATURES = [b'SQLite format 3\x00', b'PK\x03\x04', b'\x1f\x8b', b'\x7fELF', b'%PDF',
+                            b'7z\xbc\xaf\x27\x1c', b'Rar!\x1a\x07', b'MZ', b'\xcf\xfa\xed\xfe', b'\xca\xfe\xba\xbe',
+                            b'bplist00']
+    SIGNATURE_LENGTH = 16
+
+    def __init__(self, include=None, exclude=None, prefilter=True):
+        ''' :param include: (list) Only yield files matching one of these globs
+            :param exclude: (list) Skip files and directories matching these globs, in addition to DEFAULT_EXCLUDES
+            :param prefilter: (bool) Skip files with a non-media extension or signature
+        '''
+        self.includeNames, self.includePaths = self._compile(include)
+        self.excludeNames, self.excludePaths = self._compile(self.DEFAULT_EXCLUDES + list(exclude if exclude else []))
+        self.prefilter = prefilter
+        self.numExcluded = 0
+        self.numPrefiltered = 0
+
+    @classmethod
+    def fromConfig(cls, config):
+        ''' Create a walker from the include, exclude and prefilter config keys '''
+        config = config if config else {}
+        return cls(config.get('include'), config.get('exclude'), config.get('prefilter', True))
+
+    def walk(self, path):
+        ''' Walk a directory tree top down, in sorted order. Symlinked directories are not followed.
+
+            :param path: (str) Directory to walk
+            :returns: Generator of (directory, list of file paths) for every directory that isn't excluded
+        '''
+        stack = [os.path.abspath(path)]
+        while stack:
+            directory = stack.pop()
+            filePaths = []
+            subdirectories = []
+            try:
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+            except OSError as e:
+                print(f'[WARNING] Could not list {directory}: {e}')
+                continue
+            for entry in entries:
+                if self._matches(self.excludeNames, self.excludePaths, entry.name, entry.path):
+                    self.numExcluded += 1
+                    continue
+                try:
+                    isDirectory = entry.is_dir()
+                except OSError:
+                    continue
+                if isDirectory:
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.path)
+                elif self._acceptFile(entry.name, entry.path):
+                    filePaths.append(entry.path)
+            yield directory, filePaths
+            stack.extend(reversed(subdirectories))
+
+    def filterFiles(self, paths):
+        ''' Apply the globs and the prefilter to a list of files, e.g. from inotify events
+
+            :param paths: (list) Absolute file paths
+            :returns: (list) The paths that may be media files
+        '''
+        filePaths = []
+        for path in paths:
+            name = os.path.basename(path)
+            if self._matches(self.excludeNames, self.excludePaths, name, path):
+                self.numExcluded += 1
+            elif os.path.isfile(path) and self._acceptFile(name, path):
+                filePaths.append(path)
+        return filePaths
+
+    def _acceptFile(self, name, path):
+        ''' Include globs and prefilter for a file that isn't excluded '''
+        if self.includeNames is not None or self.includePaths is not None:
+            if not self._matches(self.includeNames, self.includePaths, name, path):
+                self.numExcluded += 1
+                return False
+        if self.prefilter and not self.mayBeMedia(path):
+            self.numPrefiltered += 1
+            return False
+        return True
+
+    def mayBeMedia(self, path):
+        ''' Extension and magic-byte prefilter - False only for files that can't be media '''
+        extension = os.path.splitext(path)[1].lower()
+        if extension in self.MEDIA_EXTENSIONS:
+            return True
+        if extension in self.NON_MEDIA_EXTENSIONS:
+            return False
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(self.SIGNATURE_LENGTH)
+        except OSError:
+            # Let exiftool report it
+            return True
+        return not any(header.startswith(signature) for signature in self.NON_MEDIA_SIGNATURES)
+
+    @staticmethod
+    def _compile(patterns):
+        ''' Compile globs into one regex for names and one for paths
+
+            :returns: (tuple) Name and path regexes - None for both if there are no patterns
+        '''
+        if not patterns:
+            return None, None
+        namePatterns = [fnmatch.translate(pattern) for pattern in patterns if '/' not in pattern]
+        pathPatterns = [fnmatch.translate(os.path.expanduser(pattern)) for pattern in patterns if '/' in pattern]
+        return (re.compile('|'.join(namePatterns)) if namePatterns else None,
+                re.compile('|'.join(pathPatterns)) if pathPatterns else None)
+
+    @staticmethod
+    def _matches(names, paths, name, path):
+        return bool((names is not None and names.match(name)) or (paths is not None and paths.match(path)))
@@ -1,20 +1,44 @@
 import os
+import time
 import base64
 import struct
 
 from google.cloud import storage
+from google.api_core import exceptions as googleExceptions
+from google.resumable_media import DataCorruption
 import google_crc32c
+import requests
 
-from .cloudStorage import CloudStorage, CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException
+from .cloudStorage import CloudStorage, CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException, CloudStorageTransientException
 
 class GoogleCloudStorage(CloudStorage):
     TRANSFER_CHECKSUM = 'crc32c'
-    def __init__(self, projectId, bucketName):
+    # Resumable upload chunks must be a multiple of 256 KiB
+    UPLOAD_CHUNK_ALIGNMENT = 256*1024
+    DEFAULT_UPLOAD_CHUNK_SIZE = 32*1024*1024
+    UPLOAD_TIMEOUT = 120
+    CHECKSUM_CHUNK_SIZE = 16*1024*1024
+    TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+    TRANSIENT_EXCEPTIONS = (googleExceptions.TooManyRequests,
+                            googleExceptions.InternalServerError,
+                            googleExceptions.BadGateway,
+                            googleExceptions.ServiceUnavailable,
+                            googleExceptions.GatewayTimeout,
+                            requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout)
+
+    def __init__(self, projectId, bucketName, chunkSize=None):
         if not projectId or not projectId.strip():
             raise ValueError('projectId is not set!')
         self.projectId = projectId
         CloudStorage.__init__(self, bucketName)
         
+        if chunkSize:
+            if chunkSize < self.UPLOAD_CHUNK_ALIGNMENT:
+                raise ValueError(f'chunkSize must be at least {self.UPLOAD_CHUNK_ALIGNMENT} bytes!')
+            chunkSize -= chunkSize % self.UPLOAD_CHUNK_ALIGNMENT
+        self.chunkSize = chunkSize if chunkSize else self.DEFAULT_UPLOAD_CHUNK_SIZE
+
         self.storageClient = storage.Client(project=projectId)
 
         print(f'Initializing Google Cloud client with project {self.projectId} and bucket {self.bucketName}')
@@ -43,6 +67,19 @@ class GoogleCloudStorage(CloudStorage):
             return [(blob.name, blob.size, self._convertB64Crc32c(blob.crc32c)) for blob in blobs]
         return [blob.name for blob in blobs]
 
+    def _listObjects(self, bucketName, prefix=None):
+        for blob in self.storageClient.list_blobs(bucketName, prefix=prefix):
+            yield (blob.name, blob.size, self._convertB64Crc32c(blob.crc32c), blob.generation)
+
+    def _getObjectInfo(self, bucketName, objectName):
+        bucket = self.storageClient.bucket(bucketName)
+        blob = bucket.blob(objectName)
+        try:
+            blob.reload()
+        except googleExceptions.NotFound:
+            raise CloudStorageObjectMissingException(bucketName, objectName)
+        return (blob.name, blob.size, self._convertB64Crc32c(blob.crc32c), blob.generation)
+
     def _fileExists(self, bucketName, objectName):
         bucket = self.storageClient.bucket(bucketName)
         return bucket.blob(objectName).exists()
@@ -75,11 +112,152 @@ class GoogleCloudStorage(CloudStorage):
         blob = bucket.blob(objectName)
         blob.download_to_filename(destinationPath, checksum=self.TRANSFER_CHECKSUM)
 
-    def _uploadFile(self, sourcePath, bucketName, objectName, mimeType=None):
+    def _downloadFileObject(self, bucketName, objectName, fileObj):
+        bucket = self.storageClient.bucket(bucketName)
+        blob = bucket.blob(objectName)
+        try:
+            blob.download_to_file(fileObj, checksum=self.TRANSFER_CHECKSUM)
+        except googleExceptions.NotFound:
+            raise CloudStorageObjectMissingException(bucketName, objectName)
+        except DataCorruption as e:
+            raise CloudStorageObjectChecksumMismatchException(bucketName, objectName) from e
+
+    def _downloadRange(self, bucketName, objectName, fileObj, start, end):
+        bucket = self.storageClient.bucket(bucketName)
+        blob = bucket.blob(objectName)
+        # Ranges can't be checked by the client library - the caller combines the slice CRC32Cs
+        try:
+            blob.download_to_file(fileObj, start=start, end=end, checksum=None)
+        except googleExceptions.NotFound:
+            raise CloudStorageObjectMissingException(bucketName, objectName)
+
+    def _uploadFile(self, sourcePath, bucketName, objectName, mimeType=None, sessionUri=None, progressCallback=None):
         bucket = self.storageClient.bucket(bucketName)
         blob = bucket.blob(objectName)
 
-        blob.upload_from_filename(sourcePath, content_type=mimeType, checksum=self.TRANSFER_CHECKSUM)
+        fileSize = os.stat(sourcePath).st_size
+        if fileSize <= self.chunkSize and not sessionUri:
+            def upload():
+                self._throttle(fileSize)
+                blob.upload_from_filename(sourcePath, content_type=mimeType, checksum=self.TRANSFER_CHECKSUM)
+            self._retry(upload, bucketName, objectName)
+            return
+
+        self._resumableUpload(blob, sourcePath, fileSize, mimeType, sessionUri, progressCallback)
+
+    def _resumableUpload(self, blob, sourcePath, fileSize, mimeType=None, sessionUri=None, progressCallback=None):
+        ''' Upload a file in chunks through a resumable upload session. If a 
+            session URI is given, the upload continues from the offset the 
+            cloud has persisted. Transient errors are retried with exponential 
+            backoff, resynchronizing the offset with the cloud each time.
+        '''
+        bucketName = blob.bucket.name
+        offset = self._getSessionOffset(sessionUri, fileSize, bucketName, blob.name) if sessionUri else None
+        if offset is None:
+            if sessionUri:
+                print('    Upload session expired, starting a new session')
+            sessionUri = self._retry(lambda: blob.create_resumable_upload_session(content_type=mimeType, size=fileSize),
+                                     bucketName, blob.name)
+            offset = 0
+            if progressCallback:
+                progressCallback(sessionUri, offset)
+        else:
+            print(f'    Resuming upload at {offset}/{fileSize} bytes')
+
+        # The CRC32C is accumulated as the file is read so the completed object can be checked
+        crcHelper = google_crc32c.Checksum()
+        crcOffset = 0
+        response = None
+        attempt = 0
+        with open(sourcePath, 'rb') as f:
+            while crcOffset < offset:
+                data = f.read(min(self.CHECKSUM_CHUNK_SIZE, offset - crcOffset))
+                if not data:
+                    raise RuntimeError(f'File changed size during upload: {sourcePath}')
+                crcHelper.update(data)
+                crcOffset += len(data)
+
+            while offset < fileSize:
+                f.seek(offset)
+                data = f.read(self.chunkSize)
+                if not data:
+                    raise RuntimeError(f'File changed size during upload: {sourcePath}')
+                if offset + len(data) > crcOffset:
+                    crcHelper.update(data[crcOffset - offset:])
+                    crcOffset = offset + len(data)
+                headers = {'Content-Range': f'bytes {offset}-{offset + len(data) - 1}/{fileSize}'}
+                self._throttle(len(data))
+                try:
+                    response = self.storageClient._http.put(sessionUri, data=data, headers=headers, timeout=self.UPLOAD_TIMEOUT)
+                    status = response.status_code
+                    error = f'HTTP {status}'
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    status = None
+                    error = str(e)
+
+                if status in (200, 201):
+                    offset = fileSize
+                elif status == 308:
+                    offset = self._parseRangeHeader(response)
+                    attempt = 0
+                    if progressCallback:
+                        progressCallback(sessionUri, offset)
+                elif status is None or status in self.TRANSIENT_STATUS_CODES:
+                    attempt += 1
+                    if attempt > self.MAX_RETRIES:
+                        raise CloudStorageTransientException(bucketName, blob.name, error)
+                    delay = self._retryDelay(attempt)
+                    print(f'    Transient error ({error}), retrying in {delay:.1f} s ({attempt}/{self.MAX_RETRIES})...')
+                    time.sleep(delay)
+                    offset = self._getSessionOffset(sessionUri, fileSize, bucketName, blob.name)
+                    if offset is None:
+                        raise CloudStorageTransientException(bucketName, blob.name, 'upload session expired')
+                    if progressCallback:
+                        progressCallback(sessionUri, offset)
+                elif status in (404, 410):
+                    # The session expired between chunks - a new one is started on the next run
+                    raise CloudStorageTransientException(bucketName, blob.name, 'upload session expired')
+                else:
+                    response.raise_for_status()
+                    raise RuntimeError(f'Unexpected response ({status}) uploading {blob.name}!')
+
+        blob.reload()
+        localChecksum = crcHelper._crc
+        remoteChecksum = self._convertB64Crc32c(blob.crc32c)
+        if remoteChecksum != localChecksum:
+            blob.delete()
+            raise CloudStorageObjectChecksumMismatchException(bucketName, blob.name, localChecksum, remoteChecksum)
+
+    def _getSessionOffset(self, sessionUri, fileSize, bucketName=None, objectName=None):
+        ''' Ask the cloud how much of a resumable upload it has persisted
+
+            :returns: (int) Number of bytes persisted, or None if the session no longer exists
+        '''
+        def query():
+            try:
+                response = self.storageClient._http.put(sessionUri, headers={'Content-Range': f'bytes */{fileSize}'}, timeout=self.UPLOAD_TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise CloudStorageTransientException(bucketName, objectName, str(e))
+            if response.status_code in self.TRANSIENT_STATUS_CODES:
+                raise CloudStorageTransientException(bucketName, objectName, f'HTTP {response.status_code}')
+            return response
+
+        response = self._retry(query, bucketName, objectName)
+        if response.status_code in (200, 201):
+            return fileSize
+        if response.status_code == 308:
+            return self._parseRangeHeader(response)
+        if response.status_code in (404, 410):
+            return None
+        response.raise_for_status()
+        raise RuntimeError(f'Unexpected response ({response.status_code}) querying upload session!')
+
+    def _parseRangeHeader(self, response):
+        # The Range header is of the form bytes=0-N and is absent if nothing has been persisted
+        rangeHeader = response.headers.get('Range')
+        if not rangeHeader:
+            return 0
+        return int(rangeHeader.split('-')[-1]) + 1
 
     def _deleteFile(self, bucketName, objectName):
         bucket = self.storageClient.bucket(bucketName)
@@ -115,9 +293,12 @@ class GoogleCloudStorage(CloudStorage):
     def _computeCrc32c(self, sourcePath):
         helper = google_crc32c.Checksum()
         with open(sourcePath, 'rb') as f:
-            data = f.read()
-        helper.update(data)
+            for chunk in iter(lambda: f.read(self.CHECKSUM_CHUNK_SIZE), b''):
+                helper.update(chunk)
         return helper._crc
 
     def _convertB64Crc32c(self, b64encoded):
-        return struct.unpack('>I', base64.b64decode(b64encoded))[0]
\ No newline at end of file
+        return struct.unpack('>I', base64.b64decode(b64encoded))[0]
+
+    def _isTransientError(self, exception):
+        return isinstance(exception, self.TRANSIENT_EXCEPTIONS) or super()._isTransientError(exception)
@@ -0,0 +1,96 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import collections
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('=iIII')
+READ_SIZE = 64*1024
+
+InotifyEvent = collections.namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'name'])
+
+
+class Inotify(object):
+    ''' Minimal Linux inotify binding through ctypes '''
+    def __init__(self):
+        libcName = ctypes.util.find_library('c')
+        if libcName is None:
+            raise OSError(errno.ENOSYS, 'inotify requires Linux')
+        self.libc = ctypes.CDLL(libcName, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify requires Linux')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def addWatch(self, path, mask):
+        ''' :returns: (int) Watch descriptor - the same one if path is already watched '''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def removeWatch(self, wd):
+        if self.libc.inotify_rm_watch(self.fd, wd) < 0:
+            error = ctypes.get_errno()
+            # The watch is already gone if its directory was deleted
+            if error != errno.EINVAL:
+                raise OSError(error, os.strerror(error))
+
+    def read(self, timeout=None):
+        ''' Wait for events
+
+            :param timeout: (float) Seconds to wait, or None to wait forever
+            :returns: (list) InotifyEvents - empty on timeout
+        '''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\x00'))
+            offset += length
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
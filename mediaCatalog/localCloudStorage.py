@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import random
+import shutil
+import threading
+import uuid
+
+import google_crc32c
+
+from .cloudStorage import CloudStorage, CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException, CloudStorageTransientException
+
+class LocalCloudStorage(CloudStorage):
+    ''' Cloud storage backed by a local directory, for offline testing and
+        benchmarking. Each bucket is a directory under rootPath holding the
+        objects, a JSON metadata file per object (size, CRC32C, content type,
+        generation) and the partial files of resumable upload sessions.
+
+        Latency (seconds per request), bandwidth (bytes per second per
+        transfer) and a transient failure rate (probability per request)
+        can be injected to simulate a real cloud.
+    '''
+    OBJECTS_FOLDERNAME = 'objects'
+    METADATA_FOLDERNAME = 'metadata'
+    UPLOADS_FOLDERNAME = 'uploads'
+    SESSION_URI_SCHEME = 'local://'
+    DEFAULT_UPLOAD_CHUNK_SIZE = 32*1024*1024
+    TRANSFER_CHUNK_SIZE = 1024*1024
+
+    def __init__(self, rootPath, bucketName, chunkSize=None, latency=0.0, bandwidth=None, failureRate=0.0, seed=None):
+        if not rootPath or not str(rootPath).strip():
+            raise ValueError('rootPath is not set!')
+        CloudStorage.__init__(self, bucketName)
+        self.rootPath = os.path.abspath(rootPath)
+        self.projectId = self.rootPath
+        self.chunkSize = chunkSize if chunkSize else self.DEFAULT_UPLOAD_CHUNK_SIZE
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.randomLock = threading.Lock()
+
+        if not os.path.isdir(self.rootPath):
+            os.makedirs(self.rootPath)
+
+        print(f'Initializing local cloud storage at {self.rootPath} with bucket {self.bucketName}')
+
+    def listBuckets(self):
+        self._request()
+        return sorted(name for name in os.listdir(self.rootPath) if os.path.isdir(os.path.join(self.rootPath, name)))
+
+    def createBucket(self, bucketName):
+        self._request()
+        bucketPath = os.path.join(self.rootPath, bucketName)
+        if os.path.exists(bucketPath):
+            raise FileExistsError(f'Bucket {bucketName} already exists!')
+        for folderName in [self.OBJECTS_FOLDERNAME, self.METADATA_FOLDERNAME, self.UPLOADS_FOLDERNAME]:
+            os.makedirs(os.path.join(bucketPath, folderName))
+
+    def deleteBucket(self, bucketName):
+        self._request()
+        bucketPath = os.path.join(self.rootPath, bucketName)
+        if not os.path.isdir(bucketPath):
+            raise FileNotFoundError(f'Bucket {bucketName} does not exist!')
+        if self._listFiles(bucketName):
+            raise RuntimeError(f'Bucket {bucketName} is not empty!')
+        shutil.rmtree(bucketPath)
+
+    def setBucket(self, bucketName):
+        self.bucketName = bucketName
+
+    def _listFiles(self, bucketName, prefix=None, delimiter=None, extended=False):
+        self._request(bucketName)
+        objectsPath = self._getBucketPath(bucketName, self.OBJECTS_FOLDERNAME)
+        objectNames = []
+        for dirName, subdirList, fileList in os.walk(objectsPath):
+            relativeDir = os.path.relpath(dirName, objectsPath)
+            for filename in fileList:
+                objectName = filename if relativeDir == '.' else '/'.join([*relativeDir.split(os.sep), filename])
+                if prefix and not objectName.startswith(prefix):
+                    continue
+                if delimiter and delimiter in objectName[len(prefix) if prefix else 0:]:
+                    continue
+                objectNames.append(objectName)
+
+        # Match the lexicographic ordering of cloud listings
+        objectNames.sort()
+
+        if extended:
+            output = []
+            for objectName in objectNames:
+                metadata = self._readMetadata(bucketName, objectName)
+                output.append((objectName, metadata['size'], metadata['crc32c']))
+            return output
+        return objectNames
+
+    def _listObjects(self, bucketName, prefix=None):
+        for objectName in self._listFiles(bucketName, prefix=prefix):
+            metadata = self._readMetadata(bucketName, objectName)
+            yield (objectName, metadata['size'], metadata['crc32c'], metadata['generation'])
+
+    def _getObjectInfo(self, bucketName, objectName):
+        metadata = self._readMetadata(bucketName, objectName, request=True)
+        return (objectName, metadata['size'], metadata['crc32c'], metadata['generation'])
+
+    def _fileExists(self, bucketName, objectName):
+        self._request(bucketName, objectName)
+        return os.path.isfile(self._getObjectPath(bucketName, objectName))
+
+    def _validateFile(self, bucketName, objectName, fileSize=None, checksum=None, sourcePath=None):
+        self._request(bucketName, objectName)
+        metadata = self._readMetadata(bucketName, objectName)
+
+        if sourcePath:
+            fileSize = os.stat(sourcePath).st_size
+            checksum = self._computeCrc32c(sourcePath)
+
+        if fileSize and metadata['size'] != fileSize:
+            raise CloudStorageObjectSizeMismatchException(bucketName, objectName, fileSize, metadata['size'])
+
+        if checksum and metadata['crc32c'] != checksum:
+            raise CloudStorageObjectChecksumMismatchException(bucketName, objectName, checksum, metadata['crc32c'])
+
+        return True
+
+    def _downloadFile(self, bucketName, objectName, destinationPath):
+        try:
+            with open(destinationPath, 'wb') as f:
+                self._downloadFileObject(bucketName, objectName, f)
+        except CloudStorageObjectChecksumMismatchException:
+            os.remove(destinationPath)
+            raise
+
+    def _downloadFileObject(self, bucketName, objectName, fileObj):
+        metadata = self._readMetadata(bucketName, objectName, request=True)
+        crcHelper = google_crc32c.Checksum()
+        with open(self._getObjectPath(bucketName, objectName), 'rb') as src:
+            self._transfer(src, fileObj, crcHelper)
+        if crcHelper._crc != metadata['crc32c']:
+            raise CloudStorageObjectChecksumMismatchException(bucketName, objectName, metadata['crc32c'], crcHelper._crc)
+
+    def _downloadRange(self, bucketName, objectName, fileObj, start, end):
+        self._readMetadata(bucketName, objectName)
+        self._request(bucketName, objectName, retry=False)
+        with open(self._getObjectPath(bucketName, objectName), 'rb') as src:
+            src.seek(start)
+            self._transfer(src, fileObj, maxBytes=end - start + 1)
+
+    def _uploadFile(self, sourcePath, bucketName, objectName, mimeType=None, sessionUri=None, progressCallback=None):
+        fileSize = os.stat(sourcePath).st_size
+        if fileSize <= self.chunkSize and not sessionUri:
+            def upload():
+                self._request(bucketName, objectName, retry=False)
+                partialPath = os.path.join(self._getBucketPath(bucketName, self.UPLOADS_FOLDERNAME), uuid.uuid4().hex)
+                crcHelper = google_crc32c.Checksum()
+                with open(sourcePath, 'rb') as src, open(partialPath, 'wb') as dst:
+                    self._transfer(src, self._throttledWriter(dst), crcHelper)
+                self._commitObject(bucketName, objectName, partialPath, mimeType, crcHelper._crc)
+            self._retry(upload, bucketName, objectName)
+            return
+
+        # Resumable upload - the session is the partial file in the uploads folder
+        uploadsPath = self._getBucketPath(bucketName, self.UPLOADS_FOLDERNAME)
+        partialPath = os.path.join(uploadsPath, sessionUri[len(self.SESSION_URI_SCHEME):]) if sessionUri else None
+        if partialPath and os.path.isfile(partialPath):
+            print(f'    Resuming upload at {os.stat(partialPath).st_size}/{fileSize} bytes')
+        else:
+            if sessionUri:
+                print('    Upload session expired, starting a new session')
+            self._request(bucketName, objectName)
+            sessionUri = self.SESSION_URI_SCHEME + uuid.uuid4().hex
+            partialPath = os.path.join(uploadsPath, sessionUri[len(self.SESSION_URI_SCHEME):])
+            open(partialPath, 'wb').close()
+            if progressCallback:
+                progressCallback(sessionUri, 0)
+
+        def uploadChunk():
+            self._request(bucketName, objectName, retry=False)
+            offset = os.stat(partialPath).st_size
+            with open(sourcePath, 'rb') as src, open(partialPath, 'ab') as dst:
+                src.seek(offset)
+                self._transfer(src, self._throttledWriter(dst), maxBytes=self.chunkSize)
+            return os.stat(partialPath).st_size
+
+        offset = os.stat(partialPath).st_size
+        while offset < fileSize:
+            offset = self._retry(uploadChunk, bucketName, objectName)
+            if progressCallback and offset < fileSize:
+                progressCallback(sessionUri, offset)
+
+        checksum = self._computeCrc32c(partialPath)
+        localChecksum = self._computeCrc32c(sourcePath)
+        if checksum != localChecksum:
+            os.remove(partialPath)
+            raise CloudStorageObjectChecksumMismatchException(bucketName, objectName, localChecksum, checksum)
+        self._commitObject(bucketName, objectName, partialPath, mimeType, checksum)
+
+    def _deleteFile(self, bucketName, objectName):
+        self._request(bucketName, objectName)
+        objectPath = self._getObjectPath(bucketName, objectName)
+        if not os.path.isfile(objectPath):
+            raise CloudStorageObjectMissingException(bucketName, objectName)
+        os.remove(objectPath)
+        os.remove(self._getMetadataPath(bucketName, objectName))
+        for path in [objectPath, self._getMetadataPath(bucketName, objectName)]:
+            self._removeEmptyDirectories(os.path.dirname(path), bucketName)
+
+    def _getSize(self, bucketName, objectName):
+        return self._readMetadata(bucketName, objectName, request=True)['size']
+
+    def _getMimeType(self, bucketName, objectName):
+        return self._readMetadata(bucketName, objectName, request=True)['contentType']
+
+    def _getChecksum(self, bucketName, objectName):
+        return self._readMetadata(bucketName, objectName, request=True)['crc32c']
+
+    def _computeChecksum(self, sourcePath):
+        return self._computeCrc32c(sourcePath)
+
+    def _computeCrc32c(self, sourcePath):
+        helper = google_crc32c.Checksum()
+        with open(sourcePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.TRANSFER_CHUNK_SIZE), b''):
+                helper.update(chunk)
+        return helper._crc
+
+    def _request(self, bucketName=None, objectName=None, retry=True):
+        ''' Simulate the latency and transient failures of a cloud request. 
+            Failures are retried like the cloud client libraries do unless 
+            retry is False.
+        '''
+        def request():
+            if self.latency:
+                time.sleep(self.latency)
+            if self.failureRate:
+                with self.randomLock:
+                    fail = self.random.random() < self.failureRate
+                if fail:
+                    raise CloudStorageTransientException(bucketName, objectName, 'injected failure')
+
+        if retry:
+            self._retry(request, bucketName, objectName)
+        else:
+            request()
+
+    def _transfer(self, src, dst, crcHelper=None, maxBytes=None):
+        ''' Copy between file objects, throttled to the simulated bandwidth '''
+        startTime = time.monotonic()
+        bytesTransferred = 0
+        while maxBytes is None or bytesTransferred < maxBytes:
+            readSize = self.TRANSFER_CHUNK_SIZE if maxBytes is None else min(self.TRANSFER_CHUNK_SIZE, maxBytes - bytesTransferred)
+            chunk = src.read(readSize)
+            if not chunk:
+                break
+            dst.write(chunk)
+            if crcHelper:
+                crcHelper.update(chunk)
+            bytesTransferred += len(chunk)
+            if self.bandwidth:
+                delay = bytesTransferred/self.bandwidth - (time.monotonic() - startTime)
+                if delay > 0:
+                    time.sleep(delay)
+        return bytesTransferred
+
+    def _commitObject(self, bucketName, objectName, partialPath, mimeType, checksum):
+        objectPath = self._getObjectPath(bucketName, objectName)
+        metadataPath = self._getMetadataPath(bucketName, objectName)
+        for path in [objectPath, metadataPath]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        metadata = {'size': os.stat(partialPath).st_size,
+                    'crc32c': checksum,
+                    'contentType': mimeType,
+                    'generation': time.time_ns()}
+        os.replace(partialPath, objectPath)
+        with open(metadataPath + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(metadataPath + '.tmp', metadataPath)
+
+    def _readMetadata(self, bucketName, objectName, request=False):
+        if request:
+            self._request(bucketName, objectName)
+        try:
+            with open(self._getMetadataPath(bucketName, objectName), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CloudStorageObjectMissingException(bucketName, objectName)
+
+    def _getBucketPath(self, bucketName, folderName):
+        bucketPath = os.path.join(self.rootPath, bucketName)
+        if not os.path.isdir(bucketPath):
+            raise FileNotFoundError(f'Bucket {bucketName} does not exist!')
+        return os.path.join(bucketPath, folderName)
+
+    def _getObjectPath(self, bucketName, objectName):
+        return os.path.join(self._getBucketPath(bucketName, self.OBJECTS_FOLDERNAME), *self._splitObjectName(objectName))
+
+    def _getMetadataPath(self, bucketName, objectName):
+        return os.path.join(self._getBucketPath(bucketName, self.METADATA_FOLDERNAME), *self._splitObjectName(objectName)) + '.json'
+
+    def _splitObjectName(self, objectName):
+        objectName = str(objectName)
+        segments = objectName.split('/')
+        if objectName.startswith('/') or any(segment in ('', '.', '..') for segment in segments):
+            raise ValueError(f'Invalid object name for local cloud storage: {objectName}')
+        return segments
+
+    def _removeEmptyDirectories(self, path, bucketName):
+        bucketPath = os.path.join(self.rootPath, bucketName)
+        while os.path.dirname(path) != bucketPath:
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
@@ -1,16 +1,25 @@
 import os
 import pathlib
+import array
+import datetime
+import itertools
+import concurrent.futures
 import logging
 import socket
 import yaml
 from typing import Optional
 
-import jsonlines
-
 from .metadataCatalogHDT import MetadataCatalogHDT
 from .catalogDatabase import CatalogDatabase
+from .cloudInventory import CloudInventory
+from .cloudVerifier import CloudVerifier
+from .verifyBudget import VerifyBudget
+from .diskLayout import DeviceLimiter, sortByLayout, getSharedExtent
+from .fileWalker import FileWalker
+from .catalogJournal import CatalogJournal
+from .moveDetector import MoveDetector
 from .cloudStorage import CloudStorage, CloudStorageObjectMissingException, CloudStorageObjectSizeMismatchException, CloudStorageObjectChecksumMismatchException
-from .utils import md5sum, sha256sum, getMimeTypes, getMetadata, getAcoustid
+from .utils import md5sum, sha256sum, copyFile, getMimeTypes, getMetadata, getAcoustid, getChecksumXattr, setChecksumXattr
 
 
 class MediaCatalog(object):
@@ -19,10 +28,17 @@ class MediaCatalog(object):
     CATALOG_CSV_FILENAME = 'catalog.csv'
     METADATA_FOLDERNAME = 'metadata'
     HASH_TABLE_FILENAME = 'hashTable.jsonl'
+    CATALOG_JOURNAL_FILENAME = 'catalogJournal.jsonl'
+    ARCHIVE_FILTER_FILENAME = 'archiveFilter.bin'
+    SNAPSHOT_FILENAME = 'catalogSnapshot.bin'
+    SOCKET_FILENAME = 'catalog.sock'
     MEDIA_MIME_TYPES = ['image', 'video', 'audio', 'text']
     CHECKSUM_MODE = 'SHA256'
     DEFAULT_CLOUD_OBJECT_PREFIX = 'file'
     HASH_CHUNK_SIZE = 1024*1024*16
+    DEFAULT_HASH_IO_MODE = 'fadvise'
+    DEFAULT_VERIFY_WORKERS = 8
+    DEFAULT_VERIFY_CYCLE_DAYS = 30
 
     def __init__(self, catalogPath, create=False, update=False, verbose=False):
         self.catalogPath = catalogPath
@@ -33,6 +49,9 @@ class MediaCatalog(object):
         self.configPath = os.path.join(self.catalogPath, self.CONFIG_FILENAME)
         self.catalogDbPath = os.path.join(self.catalogPath, self.CATALOG_DB_FILENAME)
         self.catalogCsvPath = os.path.join(self.catalogPath, self.CATALOG_CSV_FILENAME)
+        self.catalogJournalPath = os.path.join(self.catalogPath, self.CATALOG_JOURNAL_FILENAME)
+        self.archiveFilterPath = os.path.join(self.catalogPath, self.ARCHIVE_FILTER_FILENAME)
+        self.snapshotPath = os.path.join(self.catalogPath, self.SNAPSHOT_FILENAME)
         self.metadataCatalogPath = os.path.join(self.catalogPath, self.METADATA_FOLDERNAME)
         self.hashDict = {}
         self.config = None
@@ -96,98 +115,382 @@ class MediaCatalog(object):
         self.metadataCatalog = MetadataCatalogHDT(self.metadataCatalogPath, self.CHECKSUM_MODE)
 
     def _loadHashTable(self):
+        import jsonlines
         with jsonlines.open(self.hashFilePath) as reader:
             for obj in reader:
                 self.hashDict[obj['hash']] = obj
 
     def catalog(self, path):
-        newFiles = []
-        updatedFiles = []
-        skippedFiles = []
-        failedFiles = []
-        hostname = socket.gethostname()
-        for dirName, subdirList, fileList in os.walk(path):
-            subdirList.sort()
+        ''' Add the media files under path to the catalog. Within each directory, files are read 
+            in catalogOrder (config): path (default), inode or extent - the physical order on disk, 
+            which avoids seeking on spinning disks. Files are hashed in parallel within the 
+            per-device reader limits of hashReadersRotational and hashReadersSolidState, and 
+            hardlinked files are hashed once (see _checksumFiles).
+
+            Directories are walked by FileWalker, so files excluded by the include and exclude 
+            globs (config), or that can't be media, are never passed to exiftool.
+
+            Progress is kept in a CatalogJournal in the catalog directory. If a run is 
+            interrupted, cataloging the same path again skips the directories it committed 
+            and rewrites the metadata of the batch it was writing. Files already in the 
+            catalog are skipped without being hashed, unless in update mode.
+
+            Files that moved within path since it was last cataloged are moved in the catalog 
+            instead of being added again (see MoveDetector) - disable with detectMoves: false 
+            (config).
+
+            :param path: (str) Directory to catalog
+            :returns: (tuple) Lists of new, updated, skipped and failed files
+        '''
+        results = ([], [], [], [], [])
+        limiter = DeviceLimiter.fromConfig(self.config)
+        inodeChecksums = {}
+        walker = FileWalker.fromConfig(self.config)
+        journal = CatalogJournal(self.catalogJournalPath)
+        if journal.start(path):
+            print(f'Resuming interrupted run of {path}: {len(journal.completed)} directories already cataloged')
+        moveDetector = None
+        if self.config.get('detectMoves', True):
+            moveDetector = MoveDetector.fromCatalog(self.catalogDb, path, socket.gethostname())
+            if moveDetector:
+                print(f'Files missing from their cataloged paths: {len(moveDetector)} - looking for where they moved')
+        for dirName, filePaths in walker.walk(path):
             print(f'\nProcessing directory: {dirName}')
-            if not fileList:
+            if dirName in journal.completed:
+                print(f' -> [SKIP] Directory cataloged before the run was interrupted')
                 continue
-            filesToProcess = []
-            fullFilePaths = [os.path.abspath(os.path.join(dirName, fname)) for fname in fileList]
-            mimeTypes = getMimeTypes(fullFilePaths)
-            for filePath, mimeType in sorted(zip(fullFilePaths, mimeTypes)):
-                if mimeType and mimeType.split('/')[0] in self.MEDIA_MIME_TYPES:
-                    checksum = self._checksum(filePath, self.CHECKSUM_MODE)
-                    # TODO Extend the database check to also look for same capture device and filename/time in case of corruption
-                    if self.updateMode or not self.catalogDb.existsPath(filename=os.path.basename(filePath), directory=os.path.dirname(filePath)):
-                        filesToProcess.append((filePath, checksum))
-                    else:
-                        skippedFiles.append((filePath, mimeType, checksum))
-                        print(f' -> {filePath} -> [SKIP] File already in catalog')
-                else:
-                    skippedFiles.append((filePath, mimeType, None))
-                    mimeTypeOutput = mimeType if mimeType else 'Unknown'
-                    print(f' -> {filePath} -> [SKIP] Non-media/corrupt file of type: {mimeTypeOutput}')
-
-            if not filesToProcess:
+            if not filePaths:
                 continue
+            self._catalogDirectory(dirName, filePaths, results, limiter, inodeChecksums, journal, moveDetector)
+
+        journal.finish()
+        self._printCatalogProcessResults(*results)
+        print(f'Excluded files and directories: {walker.numExcluded}')
+        print(f'Files skipped by the media prefilter: {walker.numPrefiltered}')
+
+        return results[:4]
+
+    def catalogFiles(self, filePaths):
+        ''' Add individual files to the catalog, e.g. the files a CatalogWatcher saw being 
+            written. Files excluded by the include and exclude globs (config), or that can't 
+            be media, are ignored.
+
+            :param filePaths: (list) Files to catalog
+            :returns: (tuple) Lists of new, updated, skipped and failed files
+        '''
+        results = ([], [], [], [], [])
+        limiter = DeviceLimiter.fromConfig(self.config)
+        inodeChecksums = {}
+        walker = FileWalker.fromConfig(self.config)
+        filePaths = walker.filterFiles([os.path.abspath(filePath) for filePath in filePaths])
+        for dirName, group in itertools.groupby(sorted(filePaths, key=os.path.dirname), key=os.path.dirname):
+            print(f'\nProcessing directory: {dirName}')
+            self._catalogDirectory(dirName, list(group), results, limiter, inodeChecksums)
+        self._printCatalogProcessResults(*results)
+
+        return results[:4]
 
-            files, checksums = zip(*filesToProcess)
-            if len(filesToProcess) > 0:
-                metadata = self._getMetadata(files)        
+    def ingest(self, source, destination):
+        ''' Copy the files under source, e.g. a memory card, to destination and catalog 
+            them in one pass. Each file is hashed while it is copied, so it is read once. 
+            Copies of media already in the catalog, or copied earlier in the same run, 
+            are deleted again rather than kept. Files are copied in parallel within the 
+            per-device reader limits (see catalog), and each directory is cataloged as 
+            soon as it is copied.
 
-                for file, md, checksum in zip(files, metadata, checksums):
-                    if md is None:
-                        failedFiles.append((file, checksum))
+            Files matching the exclude globs (config) aren't copied. All other files are 
+            copied, sidecars included, but only media is cataloged.
+
+            :param source: (str) Directory to copy from
+            :param destination: (str) Directory to copy to - the directory tree under 
+                                      source is recreated under it
+            :returns: (tuple) Lists of copied, duplicate, skipped and failed files
+        '''
+        source = os.path.abspath(source)
+        destination = os.path.abspath(destination)
+        print(f'Ingesting {source} into {destination}...')
+        copiedFiles = []
+        duplicateFiles = []
+        skippedFiles = []
+        failedFiles = []
+        results = ([], [], [], [], [])
+        limiter = DeviceLimiter.fromConfig(self.config)
+        inodeChecksums = {}
+        ingestedChecksums = set()
+        copyWalker = FileWalker(self.config.get('include'), self.config.get('exclude'), prefilter=False)
+        mediaWalker = FileWalker.fromConfig(self.config)
+
+        def copy(sourcePath, partPath):
+            with limiter.reading(sourcePath):
+                return copyFile(sourcePath, partPath, self.CHECKSUM_MODE, self.HASH_CHUNK_SIZE)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=limiter.maxReaders) as executor:
+            for dirName, filePaths in copyWalker.walk(source):
+                print(f'\nIngesting directory: {dirName}')
+                if not filePaths:
+                    continue
+                destinationDir = os.path.normpath(os.path.join(destination, os.path.relpath(dirName, source)))
+                os.makedirs(destinationDir, exist_ok=True)
+                mediaSourcePaths = set(mediaWalker.filterFiles(filePaths))
+                futures = {}
+                for sourcePath in filePaths:
+                    destinationPath = os.path.join(destinationDir, os.path.basename(sourcePath))
+                    if os.path.lexists(destinationPath):
+                        skippedFiles.append((sourcePath, destinationPath))
+                        print(f' -> {sourcePath} -> [SKIP] Destination exists: {destinationPath}')
                         continue
-                    
-                    md['HostName'] = hostname
-                    md[self.checksumKey] = checksum
-
-                    output = f' -> {file}'
-
-                    if self.catalogDb.existsPath(filename=md['File:FileName'],
-                                                 directory=md['File:Directory']):
-                        if self.updateMode:
-                            updatedFiles.append((file, checksum))
-                            output += ' -> [UPDATE] File in catalog'
-                        else:
-                            raise RuntimeError('An existing file should not be in the main processing loop if not in update mode!')
-                    else:
-                        newFiles.append((file, checksum))
-                        output += f' -> [NEW] {checksum}'
+                    futures[executor.submit(copy, sourcePath, destinationPath + '.part')] = (sourcePath, destinationPath)
 
-                    print(output)
+                checksums = {}
+                # In walk order, so the first of several identical files is the one kept
+                for future, (sourcePath, destinationPath) in futures.items():
+                    try:
+                        checksum = future.result()
+                    except OSError as e:
+                        failedFiles.append((sourcePath, str(e)))
+                        print(f' -> {sourcePath} -> [FAILED] {e}')
+                        if os.path.exists(destinationPath + '.part'):
+                            os.remove(destinationPath + '.part')
+                        continue
+                    isMedia = sourcePath in mediaSourcePaths
+                    if isMedia and (checksum in ingestedChecksums or self.catalogDb.existsChecksum(checksum)):
+                        os.remove(destinationPath + '.part')
+                        duplicateFiles.append((sourcePath, checksum))
+                        print(f' -> {sourcePath} -> [DUPLICATE] Already in catalog: {checksum}')
+                        continue
+                    os.rename(destinationPath + '.part', destinationPath)
+                    copiedFiles.append((sourcePath, destinationPath))
+                    print(f' -> {sourcePath} -> [COPY] {destinationPath}')
+                    if isMedia:
+                        ingestedChecksums.add(checksum)
+                        checksums[destinationPath] = checksum
 
-                    if md['File:MIMEType'].startswith('audio'):
-                        logging.warning('Audio fingerprinting disabled!')
-                        # md['Acoustid:MatchResults'] = getAcoustid(file)
+                if checksums:
+                    self._catalogDirectory(destinationDir, sorted(checksums), results, limiter, inodeChecksums, knownChecksums=checksums)
 
-                    self.metadataCatalog.write(md, self.updateMode)
-                    self.catalogDb.write(md, self.updateMode)
+        self._printCatalogProcessResults(*results)
+        print(f'\nIngest complete!')
+        print('====================')
+        print(f'Copied files: {len(copiedFiles)}')
+        print(f'Duplicate files not copied: {len(duplicateFiles)}')
+        print(f'Skipped files (destination exists): {len(skippedFiles)}')
+        print(f'Failed files: {len(failedFiles)}')
+        for file, error in failedFiles:
+            print(f'    {file} -> {error}')
+
+        return copiedFiles, duplicateFiles, skippedFiles, failedFiles
 
-                    # Readback test - TODO Move this to a test case
-                    md_readback, _ = self.metadataCatalog.read(md[self.checksumKey], 
-                                                    filename=md['File:FileName'],
-                                                    directory=md['File:Directory'],
-                                                    hostname=md['HostName'])
-                    assert self._compareMetadata(md, md_readback)
+    def _catalogDirectory(self, dirName, filePaths, results, limiter, inodeChecksums, journal=None, moveDetector=None, knownChecksums=None):
+        ''' Catalog the files of one directory and commit them
 
-                    if self.verbose:
-                        self.catalogDb.printFileRecord(md[self.checksumKey])
+            :param results: (tuple) Lists of new, updated, skipped, failed and moved files to append to
+            :param journal: CatalogJournal of the run, if any
+            :param moveDetector: MoveDetector with the records whose files vanished, if any
+            :param knownChecksums: (dict) Checksums of files that were hashed already, by path
+        '''
+        newFiles, updatedFiles, skippedFiles, failedFiles, movedFiles = results
+        hostname = socket.gethostname()
+        order = self.config.get('catalogOrder', 'path')
+        filesToProcess = []
+        # Files already in the catalog are skipped before they are hashed
+        catalogedFiles = {} if self.updateMode else self._getCatalogedFiles(dirName)
+        for filePath in filePaths:
+            record = catalogedFiles.get(os.path.basename(filePath))
+            if record:
+                skippedFiles.append((filePath, record['file_mime_type'], record['checksum']))
+                print(f' -> {filePath} -> [SKIP] File already in catalog')
+        candidatePaths = [filePath for filePath in filePaths if os.path.basename(filePath) not in catalogedFiles]
+        # Files with the name, size and modification time of a vanished file aren't read
+        moves = []
+        if moveDetector:
+            unmatchedPaths = []
+            for filePath in candidatePaths:
+                try:
+                    record = moveDetector.matchStat(filePath, os.stat(filePath))
+                except OSError:
+                    record = None
+                if record:
+                    moves.append((record, filePath))
+                else:
+                    unmatchedPaths.append(filePath)
+            candidatePaths = unmatchedPaths
+        fullFilePaths = sortByLayout(candidatePaths, order)
+        mimeTypes = getMimeTypes(fullFilePaths) if fullFilePaths else []
+        mediaFilePaths = [filePath for filePath, mimeType in zip(fullFilePaths, mimeTypes) 
+                          if mimeType and mimeType.split('/')[0] in self.MEDIA_MIME_TYPES]
+        knownChecksums = knownChecksums if knownChecksums else {}
+        checksums = self._checksumFiles([filePath for filePath in mediaFilePaths if filePath not in knownChecksums], limiter, inodeChecksums)
+        checksums.update(knownChecksums)
+        self.catalogDb.commit()
+        for filePath, mimeType in zip(fullFilePaths, mimeTypes):
+            if mimeType and mimeType.split('/')[0] in self.MEDIA_MIME_TYPES:
+                # TODO Extend the database check to also look for same capture device and filename/time in case of corruption
+                checksum = checksums[filePath]
+                record = moveDetector.matchChecksum(checksum, os.path.getsize(filePath)) if moveDetector else None
+                if record:
+                    moves.append((record, filePath))
+                else:
+                    filesToProcess.append((filePath, checksum))
+            else:
+                skippedFiles.append((filePath, mimeType, None))
+                mimeTypeOutput = mimeType if mimeType else 'Unknown'
+                print(f' -> {filePath} -> [SKIP] Non-media/corrupt file of type: {mimeTypeOutput}')
 
+        for record, filePath in moves:
+            print(f' -> {os.path.join(os.path.normpath(record["directory"]), record["file_name"])} -> [MOVE] {filePath}')
+            self._moveRecord(record, filePath, verifyChecksum=False)
+            movedFiles.append((filePath, record['checksum']))
+
+        if not filesToProcess:
             self.catalogDb.commit()
+            if journal:
+                journal.completeDirectory(dirName)
+            return
+
+        # Files of a batch that was in flight when the last run stopped may have 
+        # metadata without a committed database record - their metadata is rewritten
+        reconcileFiles = set()
+        if journal:
+            reconcileFiles = journal.inFlight.get(dirName, set())
+            journal.beginBatch(dirName, [filePath for filePath, checksum in filesToProcess])
+        files, checksums = zip(*filesToProcess)
+        if len(filesToProcess) > 0:
+            metadata = self._getMetadata(files)        
+
+            for file, md, checksum in zip(files, metadata, checksums):
+                if md is None:
+                    failedFiles.append((file, checksum))
+                    continue
+                
+                md['HostName'] = hostname
+                md[self.checksumKey] = checksum
+
+                output = f' -> {file}'
+
+                if self.catalogDb.existsPath(filename=md['File:FileName'],
+                                             directory=md['File:Directory']):
+                    if self.updateMode:
+                        updatedFiles.append((file, checksum))
+                        output += ' -> [UPDATE] File in catalog'
+                    else:
+                        raise RuntimeError('An existing file should not be in the main processing loop if not in update mode!')
+                else:
+                    newFiles.append((file, checksum))
+                    output += f' -> [NEW] {checksum}'
+
+                print(output)
+
+                if md['File:MIMEType'].startswith('audio'):
+                    logging.warning('Audio fingerprinting disabled!')
+                    # md['Acoustid:MatchResults'] = getAcoustid(file)
 
-        self._printCatalogProcessResults(newFiles, updatedFiles, skippedFiles, failedFiles)
+                self.metadataCatalog.write(md, self.updateMode or file in reconcileFiles)
+                self.catalogDb.write(md, self.updateMode)
 
-        return newFiles, updatedFiles, skippedFiles, failedFiles
+                # Readback test - TODO Move this to a test case
+                md_readback, _ = self.metadataCatalog.read(md[self.checksumKey], 
+                                                filename=md['File:FileName'],
+                                                directory=md['File:Directory'],
+                                                hostname=md['HostName'])
+                assert self._compareMetadata(md, md_readback)
+
+                if self.verbose:
+                    self.catalogDb.printFileRecord(md[self.checksumKey])
+
+        self.catalogDb.commit()
+        if journal:
+            journal.completeDirectory(dirName)
     
-    def _printCatalogProcessResults(self, newFiles, updatedFiles, skippedFiles, failedFiles):
-        numProcessedFiles = len(newFiles) + len(updatedFiles) + len(skippedFiles) + len(failedFiles)
+    def _getCatalogedFiles(self, directory):
+        ''' :returns: (dict) Database records of the files in directory, by file name '''
+        directory = os.path.normpath(directory)
+        return {record['file_name']: record for record in self.catalogDb.iterRecords(directory=directory)
+                if os.path.normpath(record['directory']) == directory}
+
+    def _checksumFiles(self, paths, limiter, inodeChecksums=None):
+        ''' Checksum files in parallel, started in the given order, with at most the 
+            allowed number of readers per device.
+
+            Files with more than one hardlink are hashed once per inode: within the run 
+            through inodeChecksums, and across runs through the inode checksums stored in 
+            the catalog, which are trusted while the size and modification time match. 
+            With detectReflinks (config), files that share their first extent with another 
+            file of the same size (reflinked copies on btrfs or XFS) are reported - they 
+            are still hashed, as either copy may have been changed since.
+
+            :param paths: (list) File paths
+            :param limiter: DeviceLimiter
+            :param inodeChecksums: (dict) Checksums already hashed in this run by (st_dev, st_ino, st_size, st_mtime_ns)
+            :returns: (dict) Checksum of each path
+        '''
+        hostname = socket.gethostname()
+        inodeChecksums = inodeChecksums if inodeChecksums is not None else {}
+        checksums = {}
+        # Paths to hash, by inode key for hardlinked files and by path otherwise
+        pathsToHash = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                pathsToHash[path] = [path]
+                continue
+            if stat.st_nlink < 2:
+                pathsToHash[path] = [path]
+                continue
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if key in pathsToHash:
+                pathsToHash[key].append(path)
+                continue
+            checksum = inodeChecksums.get(key) or self.catalogDb.getInodeChecksum(hostname, *key)
+            if checksum:
+                inodeChecksums[key] = checksum
+                checksums[path] = checksum
+            else:
+                pathsToHash[key] = [path]
+
+        if self.config.get('detectReflinks'):
+            self._reportReflinks([keyPaths[0] for keyPaths in pathsToHash.values()])
+
+        def checksum(path):
+            with limiter.reading(path):
+                return self._checksum(path, self.CHECKSUM_MODE)
+        keys = list(pathsToHash)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=limiter.maxReaders) as executor:
+            results = list(executor.map(checksum, [pathsToHash[key][0] for key in keys]))
+        for key, checksum in zip(keys, results):
+            for path in pathsToHash[key]:
+                checksums[path] = checksum
+            if isinstance(key, tuple):
+                inodeChecksums[key] = checksum
+                self.catalogDb.setInodeChecksum(hostname, *key, checksum)
+        return checksums
+
+    @staticmethod
+    def _reportReflinks(paths):
+        ''' Print the files that share their first extent with another file of the same size
+
+            :returns: (list) Lists of paths that are likely reflinked copies of each other
+        '''
+        groups = {}
+        for path in paths:
+            extent = getSharedExtent(path)
+            if extent is not None:
+                stat = os.stat(path)
+                groups.setdefault((stat.st_dev, extent, stat.st_size), []).append(path)
+        candidates = [group for group in groups.values() if len(group) > 1]
+        for group in candidates:
+            for path in group[1:]:
+                print(f' -> {path} -> [REFLINK] Shares its data with {group[0]}')
+        return candidates
+
+    def _printCatalogProcessResults(self, newFiles, updatedFiles, skippedFiles, failedFiles, movedFiles=()):
+        numProcessedFiles = len(newFiles) + len(updatedFiles) + len(skippedFiles) + len(failedFiles) + len(movedFiles)
         print(f'\nCataloging complete!')
         print('====================')
         print(f'Files processed: {numProcessedFiles}')
         print(f'New files: {len(newFiles)}')
         print(f'Updated files: {len(updatedFiles)}')
+        print(f'Moved files: {len(movedFiles)}')
         print(f'Skipped files: {len(skippedFiles)}')
         noUpdateFlag = False
         for file, mimeType, checksum in skippedFiles:
@@ -212,78 +515,78 @@ class MediaCatalog(object):
                 path: Optional[str]=None, 
                 local: bool=False, 
                 cloudStorage: Optional[CloudStorage]=None, 
-                verifyChecksum: bool=False) -> bool:
+                verifyChecksum: bool=False,
+                refreshInventory: bool=False,
+                budget=None,
+                deep: bool=False,
+                samples: Optional[int]=None,
+                scheduler=None) -> bool:
         ''' Verify the catalog against the local files and in the cloud. If path is specified, only verify files in that path and subpaths.
+            Cloud files are verified against the cloud inventory in the catalog, which is refreshed 
+            from a full bucket listing when it is older than cloudInventoryMaxAge hours.
+
+            Local files are checked with one directory listing per directory, on a pool of threads.
+            For the cloud, the catalog records and the inventory are streamed in cloud object name 
+            order and merge-joined, so memory use doesn't grow with the size of the catalog or the 
+            bucket. When verifying the whole catalog, cloud objects without a catalog record are 
+            reported as orphans.
+
+            Files that verify are stamped with the time, and with a budget only the files verified 
+            longest ago are checked, until the budget is used up. Running this regularly covers the 
+            whole catalog over verifyCycleDays days (config, default 30) - with budget='auto', each 
+            daily run gets 1/verifyCycleDays of the catalog size. Cloud files are checked against the 
+            inventory without reading them, so a budget in bytes only limits local and deep cloud verification.
+
+            Deep cloud verification reads the objects instead and checks them against the catalog 
+            SHA-256 in memory (see CloudVerifier), within the transfer limits of the scheduler.
         
             :param path: (str) Only verify files in this path and subpaths
             :param local: (bool) Verify local files
             :param cloudStorage: CloudStorage object to use for cloud verification
             :param verifyChecksum: (bool) Verify checksums of files
+            :param refreshInventory: (bool) Refresh the cloud inventory even if it is recent
+            :param budget: Bytes (e.g. '500G'), minutes or hours (e.g. '90min', '2h') or 'auto' to verify the stalest files within
+            :param deep: (bool) Read the cloud objects and verify their SHA-256
+            :param samples: (int) With deep, only read this many random ranges of each object and compare them with the local file
+            :param scheduler: TransferScheduler for deep verification - by default created from the config
             :returns: (bool) True if all files are found and optionally matches checksums, False otherwise
         '''
+        if not local and not cloudStorage:
+            raise ValueError('At least one of local or cloudStorage must be set!')
+        directory = None
         if path:
             path = os.path.abspath(path)
             directory = self.catalogDb._normalizeDirectory(path)
             if not directory.endswith('*'):
                 directory += '*'
-            records = self.catalogDb.read(directory=directory)
+            numFiles = self.catalogDb.getFileCount(directory=directory)
+            if numFiles == 0:
+                raise KeyError(f'File not found in database with directory: {directory} !')
         else:
-            records = self.catalogDb.read(all=True)
-        if not local and not cloudStorage:
-            raise ValueError('At least one of local or cloudStorage must be set!')
-
-        numFiles = len(records)
+            numFiles = self.catalogDb.getFileCount()
         print(f'{numFiles} files in catalog')
 
-        foundLocalFiles = []
-        missingLocalFiles = []
-        changedLocalFiles = []
-        foundCloudFiles = []
-        missingCloudFiles = []
-        changedCloudFiles = []
+        cycleDays = self.config.get('verifyCycleDays', self.DEFAULT_VERIFY_CYCLE_DAYS)
+        if budget == 'auto':
+            budget = max(1, self.catalogDb.getTotalFileSize()//cycleDays)
+        if budget is not None:
+            budget = VerifyBudget(budget)
+            print(f'Verifying the stalest files within a budget of {budget}')
+        verifiedDatetime = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
+        localResults = None
+        cloudResults = None
+        if local:
+            localResults = self._verifyLocal(directory, numFiles, verifyChecksum, budget)
+            self.catalogDb.setLastVerified(localResults['verifiedIds'], 'local', verifiedDatetime)
+            self.catalogDb.commit()
         if cloudStorage:
-            print(f'\nDownloading cloud object metadata... this takes a minute or two...')
-            blobData = cloudStorage.listFiles(extended=True)
-            print('--> Building cloud object dictionary...')
-            objectNames = [bd[0] for bd in blobData]
-            blobDict = dict(zip(objectNames, blobData))
-            print('')
-        
-        for i, record in enumerate(records, 1):
-            if i % 1000 == 0:
-                print(f'Verifying file {i}/{numFiles}...')
-            filePath = os.path.join(record['directory'], record['file_name'])
-            if local:
-                if os.path.exists(filePath):
-                    if os.stat(filePath).st_size != record['file_size']:
-                        changedLocalFiles.append(record)
-                        print(f'[WARNING] Local file changed size: {filePath} ({record["file_size"]} -> {os.stat(filePath).st_size}))')
-                    elif verifyChecksum and self._checksum(filePath, self.CHECKSUM_MODE) != record['checksum']:
-                        changedLocalFiles.append(record)
-                        print(f'[WARNING] Local file changed: {filePath}')
-                    else:
-                        foundLocalFiles.append(record)
-                else:
-                    missingLocalFiles.append(record)
-                    print(f'Local file not found: {filePath}')
-
-            if cloudStorage:
-                if record['cloud_object_name'] not in blobDict:
-                    missingCloudFiles.append(record)
-                    print(f'Cloud file not found: {record["cloud_object_name"]} ({filePath})')
-                    continue
-                else:
-                    objectName, fileSize, cloudChecksum = blobDict[record['cloud_object_name']]
-                    if fileSize != record['file_size']:
-                        changedCloudFiles.append(record)
-                        print(f'[WARNING] Cloud file changed size: {record["cloud_object_name"]} ({record["file_size"]} -> {fileSize})')
-                        continue
-                    if cloudChecksum != record['cloud_object_checksum']:
-                        changedCloudFiles.append(record)
-                        print(f'[WARNING] Cloud file changed: {record["cloud_object_name"]} ({record["cloud_object_checksum"]} -> {cloudChecksum})')
-                        continue
-                foundCloudFiles.append(record)
+            if deep:
+                cloudResults = self._verifyCloudDeep(directory, cloudStorage, samples, budget, scheduler)
+            else:
+                cloudResults = self._verifyCloud(directory, numFiles, cloudStorage, refreshInventory, budget)
+            self.catalogDb.setLastVerified(cloudResults['verifiedIds'], 'cloud', verifiedDatetime)
+            self.catalogDb.commit()
 
         print('\nVerification complete!')
         print('======================')
@@ -291,19 +594,225 @@ class MediaCatalog(object):
             print(f'For path: {path}')
         print(f'Files in catalog: {numFiles}')
         if local:
-            print(f'\nLocal files found: {len(foundLocalFiles)}')
-            print(f'Local files missing: {len(missingLocalFiles)}')
-            print(f'Local files changed: {len(changedLocalFiles)}')
+            print(f'\nLocal files found: {localResults["found"]}')
+            print(f'Local files missing: {localResults["missing"]}')
+            print(f'Local files changed: {localResults["changed"]}')
+            print(f'Local files not verified in {cycleDays} days: {self.catalogDb.getUnverifiedFileCount("local", cycleDays, directory)}')
         if cloudStorage:
-            print(f'\nCloud files found: {len(foundCloudFiles)}')
-            print(f'Cloud files missing: {len(missingCloudFiles)}')
-            print(f'Cloud files changed: {len(changedCloudFiles)}')
+            print(f'\nCloud files found: {cloudResults["found"]}')
+            print(f'Cloud files missing: {cloudResults["missing"]}')
+            print(f'Cloud files changed: {cloudResults["changed"]}')
+            if deep:
+                print(f'Cloud files unreadable: {cloudResults["unreadable"]}')
+            print(f'Cloud files not verified in {cycleDays} days: {self.catalogDb.getUnverifiedFileCount("cloud", cycleDays, directory)}')
+            if not path and not deep and not (budget and budget.seconds):
+                print(f'Orphan cloud objects: {cloudResults["orphans"]} ({cloudResults["orphanBytes"]/2**30:.3f} GB)')
 
-        if missingLocalFiles or changedLocalFiles or missingCloudFiles or changedCloudFiles:
-            return False
+        for results in [localResults, cloudResults]:
+            if results and (results['missing'] or results['changed'] or results.get('unreadable')):
+                return False
         
         return True
 
+    def _verifyLocal(self, directory, numFiles, verifyChecksum, budget=None):
+        ''' Verify local files against the catalog. Records are streamed in directory order 
+            and each directory is listed once, on a pool of verifyWorkers threads (config, 
+            default 8), which also hash the files when verifyChecksum is set.
+
+            :param directory: (str) Only verify files in directories matching this pattern, or all files if None
+            :param numFiles: (int) Number of files to verify, for progress
+            :param verifyChecksum: (bool) Verify checksums of files
+            :param budget: VerifyBudget - verify the files verified longest ago first, until it is used up
+            :returns: (dict) Number of found, missing and changed files, and the ids of the files that verified
+        '''
+        results = {'found': 0, 'missing': 0, 'changed': 0, 'verifiedIds': array.array('q')}
+        workers = self.config.get('verifyWorkers', self.DEFAULT_VERIFY_WORKERS)
+        orderBy = ['last_verified_local', 'directory'] if budget else 'directory'
+        records = self.catalogDb.iterRecords(directory=directory, all=directory is None, orderBy=orderBy)
+        groups = itertools.groupby(records, key=lambda record: record['directory'])
+        numVerified = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            running = set()
+            while True:
+                # Keep a bounded number of directories and files in flight, so memory stays flat
+                while len(running) < 2*workers and not (budget and budget.exhausted()):
+                    group = next(groups, None)
+                    if group is None:
+                        break
+                    groupRecords = []
+                    for record in group[1]:
+                        if budget:
+                            if budget.exhausted():
+                                break
+                            budget.spend(record['file_size'])
+                        groupRecords.append(record)
+                    running.add(executor.submit(self._verifyLocalDirectory, group[0], groupRecords))
+                if not running:
+                    break
+
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for record, status, message in future.result():
+                        if status == 'unverified':
+                            if verifyChecksum:
+                                running.add(executor.submit(self._verifyLocalChecksum, record))
+                                continue
+                            status = 'found'
+                        results[status] += 1
+                        if status == 'found':
+                            # Written once the records have been read - updating them while iterating could revisit them
+                            results['verifiedIds'].append(record['id'])
+                        if message:
+                            print(message)
+                        numVerified += 1
+                        if numVerified % 1000 == 0:
+                            print(f'Verifying local file {numVerified}/{numFiles}...')
+        return results
+
+    @staticmethod
+    def _verifyLocalDirectory(directory, records):
+        ''' Check the files of one directory exist with the catalog size, listing the directory once
+
+            :returns: (list) (record, status, message) tuples - status is missing, changed or
+                      unverified if the size matches but the checksum hasn't been checked
+        '''
+        fileNames = set(record['file_name'] for record in records)
+        fileSizes = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name in fileNames and entry.is_file():
+                        fileSizes[entry.name] = entry.stat().st_size
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+        results = []
+        for record in records:
+            filePath = os.path.join(record['directory'], record['file_name'])
+            fileSize = fileSizes.get(record['file_name'])
+            if fileSize is None:
+                results.append((record, 'missing', f'Local file not found: {filePath}'))
+            elif fileSize != record['file_size']:
+                results.append((record, 'changed', f'[WARNING] Local file changed size: {filePath} ({record["file_size"]} -> {fileSize})'))
+            else:
+                results.append((record, 'unverified', None))
+        return results
+
+    def _verifyLocalChecksum(self, record):
+        filePath = os.path.join(record['directory'], record['file_name'])
+        try:
+            # Checksum verification looks for silent corruption, so cached checksums aren't trusted
+            checksum = self._checksum(filePath, self.CHECKSUM_MODE, useCache=False)
+        except FileNotFoundError:
+            return [(record, 'missing', f'Local file not found: {filePath}')]
+        if checksum != record['checksum']:
+            return [(record, 'changed', f'[WARNING] Local file changed: {filePath}')]
+        return [(record, 'found', None)]
+
+    def _verifyCloud(self, directory, numFiles, cloudStorage, refreshInventory, budget=None):
+        ''' Verify cloud files against the cloud inventory. The catalog records and the inventory 
+            are streamed in object name order and merge-joined. With a time budget, the files 
+            verified longest ago are looked up in the inventory one by one instead.
+
+            :param directory: (str) Only verify files in directories matching this pattern, or all files if None
+            :param numFiles: (int) Number of files to verify, for progress
+            :param cloudStorage: CloudStorage object to use for cloud verification
+            :param refreshInventory: (bool) Refresh the cloud inventory even if it is recent
+            :param budget: VerifyBudget - only a time budget limits cloud verification
+            :returns: (dict) Number of found, missing and changed files, of orphan objects and their bytes, 
+                      and the ids of the files that verified
+        '''
+        results = {'found': 0, 'missing': 0, 'changed': 0, 'orphans': 0, 'orphanBytes': 0, 'verifiedIds': array.array('q')}
+        inventory = CloudInventory(self, cloudStorage)
+        inventory.refresh(force=refreshInventory)
+        print('')
+
+        if budget and budget.seconds:
+            records = self.catalogDb.iterRecords(directory=directory, all=directory is None, orderBy='last_verified_cloud')
+            pairs = ((record, inventory.get(record['cloud_object_name'])) 
+                     for record in itertools.takewhile(lambda record: not budget.exhausted(), records))
+        else:
+            records = self.catalogDb.iterRecords(directory=directory, all=directory is None, orderBy='cloud_object_name')
+            pairs = self._mergeCloudObjects(records, inventory.iterObjects())
+        numVerified = 0
+        for record, cloudObject in pairs:
+            if record is None:
+                # Orphans only mean something when the whole catalog is verified
+                if directory is None:
+                    results['orphans'] += 1
+                    results['orphanBytes'] += cloudObject['object_size']
+                    print(f'[WARNING] Cloud object not in catalog: {cloudObject["object_name"]} ({cloudObject["object_size"]} bytes)')
+                continue
+
+            numVerified += 1
+            if numVerified % 1000 == 0:
+                print(f'Verifying cloud file {numVerified}/{numFiles}...')
+            if cloudObject is None:
+                results['missing'] += 1
+                filePath = os.path.join(record['directory'], record['file_name'])
+                print(f'Cloud file not found: {record["cloud_object_name"]} ({filePath})')
+            elif cloudObject['object_size'] != record['file_size']:
+                results['changed'] += 1
+                print(f'[WARNING] Cloud file changed size: {record["cloud_object_name"]} ({record["file_size"]} -> {cloudObject["object_size"]})')
+            elif cloudObject['object_checksum'] != record['cloud_object_checksum']:
+                results['changed'] += 1
+                print(f'[WARNING] Cloud file changed: {record["cloud_object_name"]} ({record["cloud_object_checksum"]} -> {cloudObject["object_checksum"]})')
+            else:
+                results['found'] += 1
+                results['verifiedIds'].append(record['id'])
+        return results
+
+    def _verifyCloudDeep(self, directory, cloudStorage, samples=None, budget=None, scheduler=None):
+        ''' Read the cloud objects and verify them against the catalog, without writing them to disk
+
+            :param directory: (str) Only verify files in directories matching this pattern, or all files if None
+            :param cloudStorage: CloudStorage object to use for cloud verification
+            :param samples: (int) Only read this many random ranges of each object
+            :param budget: VerifyBudget - verify the files verified longest ago first, until it is used up
+            :param scheduler: TransferScheduler to run the transfers on
+            :returns: (dict) Number of found, missing, changed and unreadable files, and the ids of the files that verified
+        '''
+        mode = f'{samples} samples of each object' if samples else 'whole objects'
+        print(f'\nDeep verifying cloud files ({mode})...')
+        orderBy = 'last_verified_cloud' if budget else 'cloud_object_name'
+        records = self.catalogDb.iterRecords(directory=directory, all=directory is None, orderBy=orderBy)
+        verifier = CloudVerifier(self, cloudStorage, scheduler)
+        return verifier.verify(records, samples=samples, budget=budget)
+
+    @staticmethod
+    def _mergeCloudObjects(records, cloudObjects):
+        ''' Merge-join catalog records and cloud inventory records, both sorted by object name.
+            Several records can share one object when files are duplicates.
+
+            :param records: Catalog records ordered by cloud_object_name (records without one come first)
+            :param cloudObjects: Inventory records ordered by object_name
+            :returns: Generator of (record, cloudObject) pairs - cloudObject is None if the record's object
+                      is not in the cloud, and record is None for cloud objects without a catalog record
+        '''
+        cloudObjects = iter(cloudObjects)
+        cloudObject = next(cloudObjects, None)
+        matched = False
+        for record in records:
+            objectName = record['cloud_object_name']
+            if objectName is None:
+                yield record, None
+                continue
+            while cloudObject is not None and cloudObject['object_name'] < objectName:
+                if not matched:
+                    yield None, cloudObject
+                cloudObject = next(cloudObjects, None)
+                matched = False
+            if cloudObject is not None and cloudObject['object_name'] == objectName:
+                matched = True
+                yield record, cloudObject
+            else:
+                yield record, None
+        while cloudObject is not None:
+            if not matched:
+                yield None, cloudObject
+            cloudObject = next(cloudObjects, None)
+            matched = False
+
     def query(self, checksum=None, filename=None, directory=None, hostname=None):
         directory = os.path.abspath(directory) if directory else None
         dbRecords = self.catalogDb.read(checksum=checksum, filename=filename, directory=directory, hostname=hostname)
@@ -316,12 +825,26 @@ class MediaCatalog(object):
                 metadataAndPaths.extend(currentMetadataAndPaths)
         return dbRecords, metadataAndPaths
 
-    def move(self, oldDirectory, newDirectory):
+    def queryBatch(self, keys, keyType='checksum', hostname=None):
+        ''' Look up many checksums, paths or filenames at once - see CatalogDatabase.iterRecordsBatch()
+
+            :param keys: Iterable of checksums, paths or filenames - relative paths are made absolute
+            :param keyType: (str) checksum, path or filename
+            :returns: Generator of (key, record), with record None for keys not in the catalog
+        '''
+        if keyType == 'path':
+            keys = (os.path.abspath(key) for key in keys)
+        return self.catalogDb.iterRecordsBatch(keys, keyType, hostname)
+
+    def move(self, oldDirectory, newDirectory, verifyChecksum=True):
         ''' Moves files in the catalog from oldDirectory to newDirectory. 
             Validates the checksum amd updates the catalog and metadata catalog.
         
             :param oldDirectory: (str) Move files from this directory
             :param newDirectory: (str) Move files to this directory
+            :param verifyChecksum: (bool) Validate the checksums of the moved files - only
+                                          skip this if the move is known to be a rename, 
+                                          e.g. from inotify
             :returns: (int) Number of files moved
         '''
         print(f'Moving files from {oldDirectory} to {newDirectory}...')
@@ -331,27 +854,54 @@ class MediaCatalog(object):
         print(f'Found {len(records)} files in database to move...')
         for i, record in enumerate(records, 1):
             filename = record['file_name']
-            directory = os.path.join(newDirectory, record['directory'][len(oldDirectory):-1])
+            recordDirectory = os.path.normpath(record['directory'])
+            directory = os.path.normpath(os.path.join(newDirectory, os.path.relpath(recordDirectory, oldDirectory)))
             fullPath = os.path.join(directory, filename)
             percentComplete = i/len(records)*100
-            print(f'[{i}/{len(records)} ({percentComplete:.3f} %)] {os.path.join(oldDirectory, filename)} -> {fullPath}...')
-            
-            if not os.path.exists(fullPath):
-                raise FileNotFoundError(f'File not found: {fullPath}')
+            print(f'[{i}/{len(records)} ({percentComplete:.3f} %)] {os.path.join(recordDirectory, filename)} -> {fullPath}...')
+            self._moveRecord(record, fullPath, verifyChecksum)
             
+        self.catalogDb.commit()
+
+        return len(records)
+
+    def moveFile(self, oldPath, newPath, verifyChecksum=True):
+        ''' Moves or renames a single file in the catalog and metadata catalog
+
+            :param oldPath: (str) Path the file was cataloged at
+            :param newPath: (str) Path the file has been moved to
+            :param verifyChecksum: (bool) Validate the checksum of the moved file
+            :returns: (bool) True if the file was in the catalog
+        '''
+        oldPath = os.path.abspath(oldPath)
+        newPath = os.path.abspath(newPath)
+        records = [record for record in self.catalogDb.iterRecords(filename=os.path.basename(oldPath), directory=os.path.dirname(oldPath))
+                   if os.path.join(os.path.normpath(record['directory']), record['file_name']) == oldPath]
+        for record in records:
+            print(f' -> {oldPath} -> [MOVE] {newPath}')
+            self._moveRecord(record, newPath, verifyChecksum)
+        self.catalogDb.commit()
+        return bool(records)
+
+    def _moveRecord(self, record, fullPath, verifyChecksum=True):
+        ''' Point a database record and its metadata at a new path - does not commit '''
+        if not os.path.exists(fullPath):
+            raise FileNotFoundError(f'File not found: {fullPath}')
+        
+        if verifyChecksum:
             checksum = self._checksum(fullPath, self.CHECKSUM_MODE)
             if checksum != record['checksum']:
                 raise RuntimeError(f'Checksum mismatch for {fullPath} ({checksum} != {record["checksum"]})!')
-            
-            record = dict(record)
-            record['directory'] = directory
-            self.catalogDb.update(record, fields=['directory'])
-
-            self.metadataCatalog.move(record['checksum'], filename, oldDirectory, newDirectory)
-            
-        self.catalogDb.commit()
+        
+        oldFilename = record['file_name']
+        oldDirectory = os.path.normpath(record['directory'])
+        directory, filename = os.path.split(fullPath)
+        record = dict(record)
+        record['file_name'] = filename
+        record['directory'] = os.path.join(directory, '')
+        self.catalogDb.update(record, fields=['file_name', 'directory'])
 
-        return len(records)
+        self.metadataCatalog.move(record['checksum'], oldFilename, oldDirectory, directory, newFilename=filename)
 
     def remove(self, records, cloudStorage=None):
         ''' Removes files from the catalog and deletes the metadata files. 
@@ -379,6 +929,7 @@ class MediaCatalog(object):
                 if len(dbRecords) == 1:
                     if cloudStorage:
                         cloudStorage.deleteFile(objectName)
+                        CloudInventory(self, cloudStorage).remove(objectName)
                     else:
                         raise RuntimeError('Cannot remove files from the catalog that are in the cloud! Remove from the cloud first.')
 
@@ -463,7 +1014,7 @@ class MediaCatalog(object):
             cloudStorage.uploadFile(self.catalogDbPath, catalogDbObject, mimeType='application/vnd.sqlite3')
 
         print('--> Exporting catalog database to CSV...')
-        catalogCsvObject = os.path.join(self.catalogPath, self.CATALOG_CSV_FILENAME)
+        catalogCsvObject = os.path.join(*pathlib.Path(self.catalogCsvPath).parts[-2:])
         self.catalogDb.export(self.catalogCsvPath)
         try:
             cloudStorage.validateFile(catalogCsvObject, sourcePath=self.catalogCsvPath)
@@ -510,12 +1061,30 @@ class MediaCatalog(object):
             
         return True
 
-    @classmethod
-    def _checksum(self, filename: str, mode: str) -> str:
+    def _checksum(self, filename: str, mode: str, useCache: bool=True) -> str:
+        ''' Checksum a file. With checksumXattr (config), the checksum is cached in a 
+            user.mediacatalog.<mode> extended attribute of the file together with its size 
+            and modification time, and trusted while they match.
+
+            :param useCache: (bool) Trust a cached checksum - disable to detect silent corruption
+        '''
+        if mode not in ['MD5', 'SHA256']:
+            raise ValueError(f'Invalid checksum mode ({mode})!')
+        useXattr = self.config.get('checksumXattr', False)
+        stat = None
+        if useXattr:
+            stat = os.stat(filename)
+            if useCache:
+                checksum = getChecksumXattr(filename, mode, stat)
+                if checksum:
+                    return checksum
+
+        ioMode = self.config.get('hashIoMode', self.DEFAULT_HASH_IO_MODE)
         if mode == 'MD5':
-            return md5sum(filename, self.HASH_CHUNK_SIZE)
-        elif mode == 'SHA256':
-            return sha256sum(filename, self.HASH_CHUNK_SIZE)
+            checksum = md5sum(filename, self.HASH_CHUNK_SIZE, ioMode)
         else:
-            raise ValueError(f'Invalid checksum mode ({mode})!')
+            checksum = sha256sum(filename, self.HASH_CHUNK_SIZE, ioMode)
+        if useXattr:
+            setChecksumXattr(filename, checksum, mode, stat)
+        return checksum
         
@@ -106,12 +106,13 @@ class MetadataCatalogHDT(MetadataCatalog):
 
         return outputMetadata[0]
 
-    def move(self, hash_, filename, oldDirectory, newDirectory):
+    def move(self, hash_, filename, oldDirectory, newDirectory, newFilename=None):
         ''' Update metadata for a file to reflect a new directory location
             :param hash_: (str) The hash of the file to move
             :param filename: (str) The filename of the file to move
             :param oldDirectory: (str) The old directory of the file to move
             :param newDirectory: (str) The new directory of the file to move
+            :param newFilename: (str) The new filename, if the file was renamed
             :returns: (str) The path of the updated metadata file
         '''
 
@@ -119,10 +120,17 @@ class MetadataCatalogHDT(MetadataCatalog):
         if not metadata:
             raise Exception('No metadata found for file!')
         
-        metadata[self.sourceFileKey] = os.path.join(newDirectory, filename)
+        newFilename = newFilename if newFilename else filename
+        newDirectory = os.path.normpath(newDirectory)
+        metadata[self.sourceFileKey] = os.path.join(newDirectory, newFilename)
+        metadata[self.filenameKey] = newFilename
         metadata[self.directoryKey] = newDirectory
 
-        newPath = self.write(metadata, updateMode=True)
+        # Rewrite in place, so the entry isn't duplicated
+        with open(path, 'wt') as f:
+            f.write(json.dumps(metadata) + '\n')
+
+        return path
 
     def delete(self, hash_, filename=None, directory=None, hostname=None, all=False):
         ''' Deletes metadata for a file. If all is True, all metadata matching the query is deleted.
@@ -0,0 +1,76 @@
+import os
+import datetime
+
+
+class MoveDetector(object):
+    ''' Matches catalog records whose files have vanished to the new files a
+        rescan finds, so reorganized folders are moved in the catalog instead
+        of being cataloged again as duplicates.
+
+        A new file with the same name, size and modification time as a
+        vanished record is taken to be that file without reading it. Other
+        new files are matched on checksum and size once they are hashed.
+    '''
+    MODIFY_DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S%z'
+
+    def __init__(self, records):
+        ''' :param records: Iterable of database records whose files have vanished '''
+        self.bySignature = {}
+        self.byChecksum = {}
+        self.numRecords = 0
+        for record in records:
+            self.numRecords += 1
+            modifyTime = self._parseModifyTime(record['file_modify_datetime'])
+            if modifyTime is not None:
+                self.bySignature.setdefault((record['file_name'], record['file_size'], modifyTime), []).append(record)
+            self.byChecksum.setdefault((record['checksum'], record['file_size']), []).append(record)
+
+    @classmethod
+    def fromCatalog(cls, catalogDb, root, hostname):
+        ''' Find the records under root on this host whose files no longer exist
+
+            :param catalogDb: CatalogDatabase
+            :param root: (str) Directory being rescanned
+            :param hostname: (str) Host the files are on
+        '''
+        root = os.path.abspath(root)
+        return cls(record for record in catalogDb.iterRecords(directory=os.path.join(root, '*'), hostname=hostname)
+                   if not os.path.lexists(os.path.join(record['directory'], record['file_name'])))
+
+    def __len__(self):
+        return self.numRecords
+
+    def matchStat(self, path, stat):
+        ''' Match a new file on name, size and modification time
+
+            :returns: The vanished record it was moved from, or None
+        '''
+        records = self.bySignature.get((os.path.basename(path), stat.st_size, int(stat.st_mtime)))
+        return self._pop(records[0]) if records else None
+
+    def matchChecksum(self, checksum, fileSize):
+        ''' Match a new, hashed file on checksum and size
+
+            :returns: The vanished record it was moved from, or None
+        '''
+        records = self.byChecksum.get((checksum, fileSize))
+        return self._pop(records[0]) if records else None
+
+    def _pop(self, record):
+        ''' Remove a matched record, so it isn't matched twice '''
+        modifyTime = self._parseModifyTime(record['file_modify_datetime'])
+        for index, key in [(self.bySignature, (record['file_name'], record['file_size'], modifyTime)),
+                           (self.byChecksum, (record['checksum'], record['file_size']))]:
+            if key in index:
+                index[key] = [other for other in index[key] if other is not record]
+                if not index[key]:
+                    del index[key]
+        self.numRecords -= 1
+        return record
+
+    @classmethod
+    def _parseModifyTime(cls, modifyDatetime):
+        try:
+            return int(datetime.datetime.strptime(modifyDatetime, cls.MODIFY_DATETIME_FORMAT).timestamp())
+        except (TypeError, ValueError):
+            return None
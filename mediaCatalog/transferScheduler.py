@@ -0,0 +1,267 @@
+import time
+import queue
+import datetime
+import threading
+import concurrent.futures
+
+from .cloudStorage import CloudStorageTransientException
+
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+def parseByteSize(value):
+    ''' Parse a size or rate in bytes, optionally with a K, M, G or T suffix
+
+        :param value: (str, int or float) e.g. 500000, '500K', '2.5M'
+        :returns: (float) Number of bytes, or None if value is empty or zero
+    '''
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.strip().upper().removesuffix('B')
+        multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+        if value[-1:] in SIZE_SUFFIXES:
+            value = value[:-1]
+        value = float(value) * multiplier
+    if value < 0:
+        raise ValueError(f'Invalid byte size: {value}')
+    return float(value) if value else None
+
+class TokenBucket(object):
+    ''' Thread-safe token bucket limiting the aggregate rate of all callers.
+        A caller that takes more tokens than are available goes into debt and
+        sleeps until the debt is repaid, so large chunks are throttled too.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self.tokens = self.burst
+        self.lastTime = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, numBytes):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.lastTime)*self.rate)
+            self.lastTime = now
+            self.tokens -= numBytes
+            delay = -self.tokens/self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+class TransferWindow(object):
+    ''' Daily time-of-day window in which transfers may run, e.g. 22:00-07:00.
+        Windows that end before they start wrap around midnight.
+    '''
+    def __init__(self, window):
+        try:
+            start, end = window.split('-')
+            self.start = datetime.datetime.strptime(start.strip(), '%H:%M').time()
+            self.end = datetime.datetime.strptime(end.strip(), '%H:%M').time()
+        except ValueError:
+            raise ValueError(f'Invalid transfer window ({window})! Must be HH:MM-HH:MM')
+        self.window = window
+
+    def contains(self, now):
+        time_ = now.time()
+        if self.start <= self.end:
+            return self.start <= time_ < self.end
+        return time_ >= self.start or time_ < self.end
+
+    def secondsUntilOpen(self, now):
+        if self.contains(now):
+            return 0.0
+        start = datetime.datetime.combine(now.date(), self.start, tzinfo=now.tzinfo)
+        if start <= now:
+            start += datetime.timedelta(days=1)
+        return (start - now).total_seconds()
+
+class TransferScheduler(object):
+    ''' Runs cloud transfers on a pool of worker threads within a global
+        bandwidth cap and optional daily transfer windows.
+
+        Concurrency adapts to the observed throughput and error rate (AIMD):
+        a worker is added every ADAPT_INTERVAL while that increases throughput
+        and the bandwidth cap isn't reached, and concurrency is halved when
+        transient errors occur. Task results are handed back on the calling
+        thread, so callers can keep using their SQLite connection there.
+
+        The scheduler is also the rate limiter for the cloud storage backend,
+        which calls consume() for every chunk it transfers.
+    '''
+    DEFAULT_MAX_WORKERS = 4
+    ADAPT_INTERVAL = 10.0
+    REPORT_INTERVAL = 30.0
+    WINDOW_POLL_INTERVAL = 60.0
+    # Throughput at this fraction of the bandwidth cap counts as saturated
+    SATURATION = 0.9
+
+    def __init__(self, bandwidthLimit=None, windows=None, maxWorkers=None, minWorkers=1):
+        self.bandwidthLimit = parseByteSize(bandwidthLimit)
+        self.rateLimiter = TokenBucket(self.bandwidthLimit) if self.bandwidthLimit else None
+        self.windows = [TransferWindow(window) for window in windows] if windows else []
+        self.maxWorkers = maxWorkers if maxWorkers else self.DEFAULT_MAX_WORKERS
+        self.minWorkers = max(1, min(minWorkers, self.maxWorkers))
+        self.concurrency = self.minWorkers
+
+        self.lock = threading.Lock()
+        self.bytesTransferred = 0
+        self.runStartBytes = 0
+        self.errors = 0
+        self.mainThreadCalls = queue.Queue()
+        self.runThreadId = None
+
+        self.startTime = None
+        self.adaptTime = None
+        self.adaptBytes = 0
+        self.adaptErrors = 0
+        self.lastThroughput = None
+        self.increased = False
+        self.reportTime = None
+
+    @classmethod
+    def fromConfig(cls, config, bandwidthLimit=None, windows=None, maxWorkers=None):
+        ''' Create a scheduler from the catalog config. Arguments that are set
+            override transferBandwidthLimit, transferWindows and transferWorkers.
+        '''
+        config = config if config else {}
+        return cls(bandwidthLimit=bandwidthLimit if bandwidthLimit else config.get('transferBandwidthLimit'),
+                   windows=windows if windows else config.get('transferWindows'),
+                   maxWorkers=maxWorkers if maxWorkers else config.get('transferWorkers'))
+
+    def consume(self, numBytes):
+        ''' Account for numBytes about to be transferred, blocking as needed to
+            stay within the bandwidth cap
+        '''
+        with self.lock:
+            self.bytesTransferred += numBytes
+        if self.rateLimiter:
+            self.rateLimiter.consume(numBytes)
+
+    def callInMainThread(self, function):
+        ''' Run function on the thread that called run(), e.g. to write to the
+            catalog database from a transfer's progress callback
+        '''
+        if threading.get_ident() == self.runThreadId:
+            function()
+        else:
+            self.mainThreadCalls.put(function)
+
+    def inWindow(self, now=None):
+        if not self.windows:
+            return True
+        now = now if now else datetime.datetime.now()
+        return any(window.contains(now) for window in self.windows)
+
+    def secondsUntilWindow(self, now=None):
+        if not self.windows:
+            return 0.0
+        now = now if now else datetime.datetime.now()
+        return min(window.secondsUntilOpen(now) for window in self.windows)
+
+    def run(self, tasks, function, onResult=None):
+        ''' Run function(*task) for every task. Tasks are only started inside
+            the transfer windows - transfers in progress when a window closes
+            are finished.
+
+            :param tasks: Iterable of argument tuples for function - tasks are only taken 
+                          from it as workers become free, so it can be a generator
+            :param function: Callable run on the worker threads
+            :param onResult: Called on this thread as onResult(task, result, exception)
+                             as each task completes
+        '''
+        tasks = iter(tasks)
+        nextTask = next(tasks, None)
+        self.runThreadId = threading.get_ident()
+        self.startTime = self.adaptTime = self.reportTime = time.monotonic()
+        self.adaptBytes = self.runStartBytes = self.bytesTransferred
+        self.adaptErrors = self.errors
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            running = {}
+            while nextTask is not None or running:
+                self._runMainThreadCalls()
+                if nextTask is not None and not running and not self.inWindow():
+                    delay = self.secondsUntilWindow()
+                    print(f'Outside the transfer windows ({", ".join(window.window for window in self.windows)}), '
+                          f'waiting {delay/60:.0f} minutes...')
+                    time.sleep(min(delay, self.WINDOW_POLL_INTERVAL))
+                    continue
+
+                while nextTask is not None and len(running) < self.concurrency and self.inWindow():
+                    running[executor.submit(function, *nextTask)] = nextTask
+                    nextTask = next(tasks, None)
+
+                done, notDone = concurrent.futures.wait(running, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+                # Calls queued by a task run before its result is handled
+                self._runMainThreadCalls()
+                for future in done:
+                    task = running.pop(future)
+                    exception = future.exception()
+                    if isinstance(exception, CloudStorageTransientException):
+                        with self.lock:
+                            self.errors += 1
+                    if onResult:
+                        onResult(task, None if exception else future.result(), exception)
+                    elif exception:
+                        raise exception
+
+                self._adapt(saturated=len(running) >= self.concurrency or nextTask is not None)
+                self._report()
+            self._runMainThreadCalls()
+        self.runThreadId = None
+        self._report(force=True)
+
+    def throughput(self):
+        ''' Average throughput of the current run in bytes per second '''
+        elapsed = time.monotonic() - self.startTime if self.startTime else 0
+        return (self.bytesTransferred - self.runStartBytes)/elapsed if elapsed > 0 else 0.0
+
+    def _runMainThreadCalls(self):
+        while True:
+            try:
+                function = self.mainThreadCalls.get_nowait()
+            except queue.Empty:
+                return
+            function()
+
+    def _adapt(self, saturated, now=None):
+        ''' Additive increase, multiplicative decrease of the number of workers '''
+        now = now if now else time.monotonic()
+        elapsed = now - self.adaptTime
+        if elapsed < self.ADAPT_INTERVAL:
+            return
+        throughput = (self.bytesTransferred - self.adaptBytes)/elapsed
+        errors = self.errors - self.adaptErrors
+        self.adaptTime = now
+        self.adaptBytes = self.bytesTransferred
+        self.adaptErrors = self.errors
+
+        concurrency = self.concurrency
+        if errors:
+            concurrency = max(self.minWorkers, self.concurrency//2)
+            self.increased = False
+        elif self.increased and self.lastThroughput and throughput < self.lastThroughput:
+            # The last worker added didn't help
+            concurrency = max(self.minWorkers, self.concurrency - 1)
+            self.increased = False
+        elif self.bandwidthLimit and throughput >= self.SATURATION*self.bandwidthLimit:
+            self.increased = False
+        elif saturated and self.concurrency < self.maxWorkers:
+            concurrency = self.concurrency + 1
+            self.increased = True
+        else:
+            self.increased = False
+        self.lastThroughput = throughput
+
+        if concurrency != self.concurrency:
+            reason = f'{errors} transient errors' if errors else f'{throughput/2**20:.2f} MB/s'
+            print(f'    Transfer workers: {self.concurrency} -> {concurrency} ({reason})')
+            self.concurrency = concurrency
+
+    def _report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.reportTime < self.REPORT_INTERVAL:
+            return
+        self.reportTime = now
+        print(f'    Throughput: {self.throughput()/2**20:.2f} MB/s average, {self.concurrency} workers, '
+              f'{(self.bytesTransferred - self.runStartBytes)/2**30:.3f} GB transferred')
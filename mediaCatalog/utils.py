@@ -1,12 +1,42 @@
+import os
+import mmap
+import shutil
+import errno
 import hashlib
 import logging
+import threading
+import contextlib
 
-import exiftool
-import acoustid
 
+_exifTool = threading.local()
 
-def getMimeTypes(filenames: list) -> list:
+
+@contextlib.contextmanager
+def exifToolSession():
+    ''' Keep one exiftool process running for the getMimeTypes() and getMetadata() 
+        calls of this thread within the context, instead of starting one per call
+    '''
+    # exiftool and acoustid are imported where used, so importing utils stays fast
+    import exiftool
     with exiftool.ExifToolHelper() as et:
+        _exifTool.helper = et
+        try:
+            yield et
+        finally:
+            _exifTool.helper = None
+
+@contextlib.contextmanager
+def _getExifTool():
+    et = getattr(_exifTool, 'helper', None)
+    if et is not None:
+        yield et
+    else:
+        import exiftool
+        with exiftool.ExifToolHelper() as et:
+            yield et
+
+def getMimeTypes(filenames: list) -> list:
+    with _getExifTool() as et:
         try:
             tags = et.get_tags(filenames, tags=['File:MIMEType'])
             mimeTypes = [tag['File:MIMEType'] for tag in tags]
@@ -22,7 +52,7 @@ def getMimeTypes(filenames: list) -> list:
     return mimeTypes
 
 def getMetadata(filenames: list) -> list:
-    with exiftool.ExifToolHelper() as et:
+    with _getExifTool() as et:
         try:
             metadata = et.get_metadata(filenames)
         except Exception as e:
@@ -36,20 +66,193 @@ def getMetadata(filenames: list) -> list:
     return metadata
 
 
-def md5sum(filename: str, chunkSize=1024*1024) -> str:
-    hash_function = hashlib.md5()
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(chunkSize), b""):
-            hash_function.update(chunk)
-    return hash_function.hexdigest()
+HASH_IO_MODES = ['buffered', 'fadvise', 'direct']
+DIRECT_IO_ALIGNMENT = 4096
+_hashBuffers = threading.local()
+
+
+def md5sum(filename: str, chunkSize=1024*1024, ioMode='fadvise') -> str:
+    return hashFile(filename, 'MD5', chunkSize, ioMode)
+
+
+def sha256sum(filename: str, chunkSize=1024*1024, ioMode='fadvise') -> str:
+    return hashFile(filename, 'SHA256', chunkSize, ioMode)
+
+
+def hashFile(filename: str, mode='SHA256', chunkSize=1024*1024, ioMode='fadvise') -> str:
+    ''' Hash a file, reading it with readinto() into a reusable page-aligned buffer per thread
+
+        :param filename: (str) Path of the file
+        :param mode: (str) SHA256 or MD5
+        :param chunkSize: (int) Size of the reads - rounded up to a multiple of 4096
+        :param ioMode: (str) buffered - normal reads through the page cache
+                             fadvise - tell the kernel the file is read sequentially and drop it 
+                                       from the page cache once hashed, so hashing media doesn't 
+                                       evict the catalog and everything else from the cache
+                             direct - bypass the page cache with O_DIRECT, falling back to fadvise 
+                                      where the filesystem doesn't support it
+        :returns: (str) Hex digest
+    '''
+    if mode not in ['MD5', 'SHA256']:
+        raise ValueError(f'Invalid checksum mode ({mode})!')
+    if ioMode not in HASH_IO_MODES:
+        raise ValueError(f'Invalid hash I/O mode ({ioMode})! Valid modes are: {HASH_IO_MODES}')
+    chunkSize = -(-chunkSize//DIRECT_IO_ALIGNMENT)*DIRECT_IO_ALIGNMENT
+
+    if ioMode == 'direct' and hasattr(os, 'O_DIRECT'):
+        try:
+            return _hashFd(os.open(filename, os.O_RDONLY | os.O_DIRECT), mode, chunkSize, advise=False)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+    advise = ioMode != 'buffered' and hasattr(os, 'posix_fadvise')
+    return _hashFd(os.open(filename, os.O_RDONLY), mode, chunkSize, advise)
+
+
+def _hashFd(fd, mode, chunkSize, advise):
+    ''' Hash an open file descriptor and close it '''
+    hashFunction = hashlib.md5() if mode == 'MD5' else hashlib.sha256()
+    buffer = _getHashBuffer(chunkSize)
+    view = memoryview(buffer)
+    try:
+        with open(fd, 'rb', buffering=0) as f:
+            if advise:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            offset = 0
+            while True:
+                numBytes = f.readinto(buffer)
+                if not numBytes:
+                    break
+                hashFunction.update(view[:numBytes])
+                if advise:
+                    os.posix_fadvise(fd, offset, numBytes, os.POSIX_FADV_DONTNEED)
+                offset += numBytes
+    finally:
+        view.release()
+    return hashFunction.hexdigest()
+
+
+def copyFile(source: str, destination: str, mode='SHA256', chunkSize=1024*1024) -> str:
+    ''' Copy a file and hash it in the same pass, so the source is only read once.
+        The copy is flushed to disk and gets the source's permissions and times.
+
+        :param source: (str) Path of the file to copy
+        :param destination: (str) Path of the copy - must not exist
+        :param mode: (str) SHA256 or MD5
+        :param chunkSize: (int) Size of the reads - rounded up to a multiple of 4096
+        :returns: (str) Hex digest of the data copied
+    '''
+    if mode not in ['MD5', 'SHA256']:
+        raise ValueError(f'Invalid checksum mode ({mode})!')
+    chunkSize = -(-chunkSize//DIRECT_IO_ALIGNMENT)*DIRECT_IO_ALIGNMENT
+    hashFunction = hashlib.md5() if mode == 'MD5' else hashlib.sha256()
+    buffer = _getHashBuffer(chunkSize)
+    view = memoryview(buffer)
+    try:
+        with open(source, 'rb', buffering=0) as sourceFile, open(destination, 'xb', buffering=0) as destinationFile:
+            advise = hasattr(os, 'posix_fadvise')
+            if advise:
+                os.posix_fadvise(sourceFile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                numBytes = sourceFile.readinto(buffer)
+                if not numBytes:
+                    break
+                hashFunction.update(view[:numBytes])
+                written = 0
+                while written < numBytes:
+                    written += destinationFile.write(view[written:numBytes])
+            os.fsync(destinationFile.fileno())
+            if advise:
+                os.posix_fadvise(sourceFile.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        view.release()
+    shutil.copystat(source, destination)
+    return hashFunction.hexdigest()
+
+
+def _getHashBuffer(size):
+    ''' Page-aligned read buffer for the calling thread, reused between files '''
+    buffer = getattr(_hashBuffers, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        if buffer is not None:
+            buffer.close()
+        # Anonymous mmaps are page aligned, as O_DIRECT needs
+        buffer = mmap.mmap(-1, size)
+        _hashBuffers.buffer = buffer
+    return buffer
+
+
+CHECKSUM_XATTR_PREFIX = 'user.mediacatalog.'
+
+
+def getChecksumXattr(filename: str, mode='SHA256', stat=None):
+    ''' Read the checksum cached in an extended attribute of a file. It is only 
+        returned if the size and modification time stored with it still match.
+
+        :param filename: (str) Path of the file
+        :param mode: (str) SHA256 or MD5 - the attribute is user.mediacatalog.<mode>
+        :param stat: os.stat_result of the file, if already known
+        :returns: (str) The checksum, or None if there is no valid cached checksum
+    '''
+    if not hasattr(os, 'getxattr'):
+        return None
+    try:
+        value = os.getxattr(filename, CHECKSUM_XATTR_PREFIX + mode.lower()).decode('ascii')
+        checksum, fileSize, modifyTimeNs = value.split(' ')
+        stat = stat if stat else os.stat(filename)
+    except (OSError, UnicodeDecodeError, ValueError):
+        return None
+    if int(fileSize) != stat.st_size or int(modifyTimeNs) != stat.st_mtime_ns:
+        return None
+    return checksum
+
+
+def setChecksumXattr(filename: str, checksum: str, mode='SHA256', stat=None):
+    ''' Cache a checksum in an extended attribute of a file, with the size and 
+        modification time it was computed for. Copies that keep extended attributes 
+        and times (e.g. rsync -aX) carry it to other hosts.
+
+        :param stat: os.stat_result of the file from before it was hashed
+        :returns: (bool) True if the attribute was written - the filesystem may not support it
+    '''
+    if not hasattr(os, 'setxattr'):
+        return False
+    try:
+        stat = stat if stat else os.stat(filename)
+        value = f'{checksum} {stat.st_size} {stat.st_mtime_ns}'
+        os.setxattr(filename, CHECKSUM_XATTR_PREFIX + mode.lower(), value.encode('ascii'))
+    except OSError:
+        return False
+    return True
+
+
+class HashingWriter(object):
+    ''' File-like object that hashes everything written to it, optionally 
+        passing the data through to another file object
+    '''
+    def __init__(self, fileObj=None, mode='SHA256'):
+        if mode == 'MD5':
+            self.hashFunction = hashlib.md5()
+        elif mode == 'SHA256':
+            self.hashFunction = hashlib.sha256()
+        else:
+            raise ValueError(f'Invalid checksum mode ({mode})!')
+        self.fileObj = fileObj
+        self.bytesWritten = 0
+
+    def write(self, data):
+        self.hashFunction.update(data)
+        self.bytesWritten += len(data)
+        if self.fileObj is not None:
+            self.fileObj.write(data)
+        return len(data)
 
+    def flush(self):
+        if self.fileObj is not None:
+            self.fileObj.flush()
 
-def sha256sum(filename: str, chunkSize=1024*1024) -> str:
-    hash_function = hashlib.sha256()
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(chunkSize), b""):
-            hash_function.update(chunk)
-    return hash_function.hexdigest()
+    def hexdigest(self):
+        return self.hashFunction.hexdigest()
 
 
 def getPreciseCaptureTimeFromExif(metadata):
@@ -68,6 +271,7 @@ def getPreciseCaptureTimeFromExif(metadata):
 
 
 def getAcoustid(filename: str, quiet=False, ACOUSTID_API_KEY=None) -> list:
+    import acoustid
     if ACOUSTID_API_KEY:
         results = acoustid.match(ACOUSTID_API_KEY, filename)
     else:
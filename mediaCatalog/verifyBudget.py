@@ -0,0 +1,45 @@
+import time
+
+from .transferScheduler import parseByteSize
+
+
+class VerifyBudget(object):
+    ''' Limit on how much a rolling verification run may do - either bytes of 
+        files verified, e.g. 500G, or time, e.g. 90min or 2h. Work already 
+        started when the budget runs out is finished.
+    '''
+    TIME_SUFFIXES = {'MIN': 60, 'H': 3600}
+
+    def __init__(self, budget):
+        ''' :param budget: (str, int or float) Bytes with an optional K, M, G or T suffix, or minutes or hours with a min or h suffix '''
+        self.budget = budget
+        self.numBytes = None
+        self.seconds = None
+        value = budget.strip().upper() if isinstance(budget, str) else budget
+        for suffix, multiplier in self.TIME_SUFFIXES.items():
+            if isinstance(value, str) and value.endswith(suffix):
+                try:
+                    self.seconds = float(value.removesuffix(suffix))*multiplier
+                except ValueError:
+                    raise ValueError(f'Invalid verify budget ({budget})!')
+                break
+        else:
+            self.numBytes = parseByteSize(value)
+        if not self.numBytes and not self.seconds:
+            raise ValueError(f'Invalid verify budget ({budget})! Must be more than zero')
+
+        self.bytesSpent = 0
+        self.startTime = time.monotonic()
+
+    def spend(self, numBytes):
+        self.bytesSpent += numBytes
+
+    def exhausted(self):
+        if self.seconds:
+            return time.monotonic() - self.startTime >= self.seconds
+        return self.bytesSpent >= self.numBytes
+
+    def __str__(self):
+        if self.seconds:
+            return f'{self.seconds/60:.0f} minutes'
+        return f'{self.numBytes/2**30:.3f} GB'
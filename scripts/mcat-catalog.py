@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import logging
 
 from mediaCatalog.mediaCatalog import MediaCatalog
@@ -8,7 +9,7 @@ if __name__=='__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--catalog', '-c', required=True, help='Catalog path')
-    parser.add_argument('path', nargs='+', help='Path(s) to process')
+    parser.add_argument('path', nargs='*', help='Path(s) to process - defaults to catalogPaths in the catalog config')
     parser.add_argument('--new', '-n', action='store_true', default=False, help='Create new catalog')
     parser.add_argument('--update', '-u', action='store_true', default=False, help='Update existing catalog entries (rewrite metadata and database)')
     parser.add_argument('--verbose', '-v', action='store_true', default=False, help='Verbose output')
@@ -20,7 +21,12 @@ if __name__=='__main__':
         logging.basicConfig(level=logging.WARNING)
     cataloger = MediaCatalog(args.catalog, create=args.new, update=args.update, verbose=args.verbose)
 
-    for path in args.path:
-        cataloger.catalog(path)
+    paths = args.path if args.path else cataloger.config.get('catalogPaths', [])
+    if not paths:
+        cataloger.close()
+        parser.error('No paths given and no catalogPaths in the catalog config')
+
+    for path in paths:
+        cataloger.catalog(os.path.expanduser(path))
 
     cataloger.close()   
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import logging
+
+from mediaCatalog.bloomFilter import ArchiveFilter
+from mediaCatalog.catalogDatabase import CatalogDatabase
+from mediaCatalog.fileWalker import FileWalker
+
+if __name__=='__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Check whether files are archived, using an archive filter from mcat export --archiveFilter')
+	parser.add_argument('path', nargs='+', help='Files or directories to check')
+	parser.add_argument('--filter', '-f', help='Archive filter - defaults to archiveFilter.bin in the catalog')
+	parser.add_argument('--catalog', '-c', help='Catalog path - if available, files the filter reports as archived are confirmed with the catalog database')
+	parser.add_argument('--verbose', '-v', action='store_true', default=False, help='List every file, not only new ones')
+	args = parser.parse_args()
+
+	if args.verbose:
+		logging.basicConfig(level=logging.INFO)
+	else:
+		logging.basicConfig(level=logging.WARNING)
+	if not args.filter and not args.catalog:
+		parser.error('One of --filter or --catalog is required')
+
+	archiveFilter = ArchiveFilter.load(args.filter if args.filter else os.path.join(args.catalog, 'archiveFilter.bin'))
+	catalogDb = None
+	if args.catalog and os.path.exists(os.path.join(args.catalog, 'catalog.db')):
+		catalogDb = CatalogDatabase(os.path.join(args.catalog, 'catalog.db'))
+
+	walker = FileWalker()
+	counts = {'new': 0, 'archived': 0, 'probably archived': 0}
+	startTime = time.monotonic()
+	for path in args.path:
+		if os.path.isdir(path):
+			filePaths = [filePath for directory, directoryFiles in walker.walk(path) for filePath in directoryFiles]
+		else:
+			filePaths = [os.path.abspath(path)]
+		for filePath in filePaths:
+			status = archiveFilter.classify(filePath, catalogDb)
+			counts[status] += 1
+			if status == 'new' or args.verbose:
+				print(f'{filePath} -> [{status.upper()}]')
+
+	print(f'\nChecked {sum(counts.values())} files in {time.monotonic() - startTime:.1f} s')
+	print(f'New: {counts["new"]}')
+	if catalogDb is not None:
+		print(f'Archived: {counts["archived"]}')
+		catalogDb.close()
+	else:
+		print(f'Probably archived (confirm with --catalog): {counts["probably archived"]}')
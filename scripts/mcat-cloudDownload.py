@@ -4,26 +4,8 @@ import logging
 import os
 
 from mediaCatalog.mediaCatalog import MediaCatalog
-from mediaCatalog.googleCloudStorage import GoogleCloudStorage
-
-class CloudDownloader(object):
-	def __init__(self, catalog, cloudStorage):
-		self.catalog = catalog
-		self.cloudStorage = cloudStorage
-		self.catalogDb = self.catalog.catalogDb
-
-	def download(self, checksum, destinationPath):
-		record = self.catalogDb.read(checksum)
-		self.catalogDb.printFileRecord(checksum)
-		objectName = record['cloud_object_name']
-
-		# TODO verify project and bucket (cloud_storage)
-
-		if not cloudStorage.fileExists(objectName):
-			raise Exception(f'Object {objectName} does not exist in bucket {self.cloudStorage.bucketName}!')
-		
-		fullDestinationPath = os.path.join(destinationPath, record['file_name'])
-		self.cloudStorage.downloadFile(objectName, fullDestinationPath)
+from mediaCatalog.cloudStorage import createCloudStorage
+from mediaCatalog.cloudDownloader import CloudDownloader
 
 
 if __name__=='__main__':
@@ -34,7 +16,10 @@ if __name__=='__main__':
 	parser.add_argument('destination', help='Path to download file to')
 	args = parser.parse_args()
 
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
 	with MediaCatalog(args.catalog) as catalog:
-		cloudStorage = GoogleCloudStorage(catalog.config['project'], catalog.config['defaultBucket'])
+		cloudStorage = createCloudStorage(catalog.config)
 		downloader = CloudDownloader(catalog, cloudStorage)
-		downloader.download(args.checksum, args.destination)
+		downloadPath = downloader.download(args.checksum, args.destination)
+		print(f'\nDownloaded {args.checksum} to {downloadPath}')
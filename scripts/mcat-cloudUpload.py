@@ -3,19 +3,24 @@
 import logging
 
 from mediaCatalog.mediaCatalog import MediaCatalog
-from mediaCatalog.googleCloudStorage import GoogleCloudStorage
+from mediaCatalog.cloudStorage import createCloudStorage
 from mediaCatalog.cloudUploader import CloudUploader
+from mediaCatalog.transferScheduler import TransferScheduler
 
 
 if __name__=='__main__':
 	import argparse
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--catalog', '-c', required=True, help='Path to catalog')
+	parser.add_argument('--workers', '-w', type=int, help=f'Maximum number of concurrent uploads (default: transferWorkers from the config or {TransferScheduler.DEFAULT_MAX_WORKERS})')
+	parser.add_argument('--bandwidth', '-b', help='Bandwidth limit in bytes per second, K, M and G suffixes supported (default: transferBandwidthLimit from the config)')
+	parser.add_argument('--window', action='append', help='Only start uploads in this daily time window, e.g. 22:00-07:00 - may be repeated (default: transferWindows from the config)')
 	args = parser.parse_args()
 
 	logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
 
 	with MediaCatalog(args.catalog) as catalog:
-		cloudStorage = GoogleCloudStorage(catalog.config['cloudProject'], catalog.config['defaultCloudBucket'])
-		uploader = CloudUploader(catalog, cloudStorage)
+		cloudStorage = createCloudStorage(catalog.config)
+		scheduler = TransferScheduler.fromConfig(catalog.config, bandwidthLimit=args.bandwidth, windows=args.window, maxWorkers=args.workers)
+		uploader = CloudUploader(catalog, cloudStorage, scheduler=scheduler)
 		uploader.upload()
@@ -20,21 +20,20 @@ if __name__=='__main__':
     catalog = MediaCatalog(args.catalog, verbose=args.verbose)
 
     print(f'\nQuerying for duplicates in {args.directory if args.directory else "database"}...')
-    checksumsWithDuplicates = catalog.catalogDb.getDuplicates(args.directory)
-    print(f'--> {len(checksumsWithDuplicates)} checksums with duplicates found.')
-
-    print(f'\nQuerying for records...')
-    recordSets = []
-    for checksum in checksumsWithDuplicates:
-        records = catalog.catalogDb.read(checksum)
-        recordSets.append((os.path.join(records[0]["directory"], records[0]["file_name"]), records))
-
-    recordSets.sort()
-
-    for _, records in recordSets:
-        checksum = records[0]["checksum"]
-        print(f'\nChecksum {checksum}:')
+    numGroups = 0
+    for checksum, records in catalog.catalogDb.iterDuplicates(args.directory):
+        numGroups += 1
+        print(f'\nChecksum {checksum} ({records[0]["file_size"]} bytes):')
         for i, record in enumerate(records, 1):
-            print(f'--> {i}) {os.path.join(record["directory"], record["file_name"])}')
-
-    print(f'\n{len(recordSets)} duplicate checksums found in {args.directory if args.directory else "database"}')
+            print(f'--> {i}) {record["host_name"]}:{os.path.join(record["directory"], record["file_name"])}')
+
+    print(f'\n{numGroups} duplicate checksums found in {args.directory if args.directory else "database"}')
+
+    directoryPairs = catalog.catalogDb.getDuplicateDirectoryPairs(args.directory)
+    if directoryPairs:
+        BYTES_PER_GB = 2**30
+        print('\nReclaimable space by directory pair')
+        print('-----------------------------------')
+        for hostA, directoryA, hostB, directoryB, numFiles, numBytes in directoryPairs:
+            print(f'{numBytes/BYTES_PER_GB:9.3f} GB ({numFiles:7d} files): {hostA}:{directoryA} <-> {hostB}:{directoryB}')
+    catalog.close()
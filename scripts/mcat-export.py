@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
+import os
 import logging
 
 from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog.bloomFilter import ArchiveFilter
+from mediaCatalog.catalogSnapshot import writeSnapshot
 
 if __name__=='__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--catalog', '-c', required=True, help='Catalog path')
+    parser.add_argument('--archiveFilter', '-a', nargs='?', const='', metavar='PATH', help='Also export a Bloom filter of the catalog checksums for mcat checkArchived, to PATH or <catalog path>/archiveFilter.bin')
+    parser.add_argument('--falsePositiveRate', type=float, default=ArchiveFilter.DEFAULT_FALSE_POSITIVE_RATE, help='False positive rate of the archive filter (default 0.001)')
+    parser.add_argument('--snapshot', '-s', nargs='?', const='', metavar='PATH', help='Also export a read-only snapshot for checksum and path lookups, to PATH or <catalog path>/catalogSnapshot.bin')
     parser.add_argument('--verbose', '-v', action='store_true', default=False, help='Verbose output')
     args = parser.parse_args()
 
@@ -19,4 +25,13 @@ if __name__=='__main__':
     cataloger = MediaCatalog(args.catalog, verbose=args.verbose)
     print(f'\nExporting catalog to {cataloger.catalogCsvPath}')
     cataloger.catalogDb.export(cataloger.catalogCsvPath)
+    if args.archiveFilter is not None:
+        archiveFilterPath = args.archiveFilter if args.archiveFilter else cataloger.archiveFilterPath
+        archiveFilter = ArchiveFilter.fromCatalog(cataloger.catalogDb, cataloger.CHECKSUM_MODE, args.falsePositiveRate)
+        archiveFilter.save(archiveFilterPath)
+        print(f'Exported archive filter of {len(archiveFilter.fileFilter)} files to {archiveFilterPath} ({os.path.getsize(archiveFilterPath)} bytes)')
+    if args.snapshot is not None:
+        snapshotPath = args.snapshot if args.snapshot else cataloger.snapshotPath
+        numRecords = writeSnapshot(snapshotPath, cataloger.catalogDb.iterRecords(all=True, orderBy='checksum'))
+        print(f'Exported snapshot of {numRecords} files to {snapshotPath} ({os.path.getsize(snapshotPath)} bytes)')
     cataloger.close()   
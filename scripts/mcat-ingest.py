@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import logging
+
+from mediaCatalog.mediaCatalog import MediaCatalog
+
+if __name__=='__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Copy files from a card to the archive and catalog them in one pass, skipping media already in the catalog')
+	parser.add_argument('--catalog', '-c', required=True, help='Catalog path')
+	parser.add_argument('source', help='Directory to copy from, e.g. a memory card')
+	parser.add_argument('destination', help='Directory to copy to - the directory tree under source is recreated here')
+	parser.add_argument('--verbose', '-v', action='store_true', default=False, help='Verbose output')
+	args = parser.parse_args()
+
+	if args.verbose:
+		logging.basicConfig(level=logging.INFO)
+	else:
+		logging.basicConfig(level=logging.WARNING)
+	catalog = MediaCatalog(args.catalog, verbose=args.verbose)
+	try:
+		copiedFiles, duplicateFiles, skippedFiles, failedFiles = catalog.ingest(args.source, args.destination)
+	finally:
+		catalog.close()
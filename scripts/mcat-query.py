@@ -2,6 +2,9 @@
 
 import logging
 import os
+import sys
+import json
+import contextlib
 
 from mediaCatalog.mediaCatalog import MediaCatalog
 
@@ -17,8 +20,30 @@ if __name__=='__main__':
 	parser.add_argument('--metadata', '-m', action='store_true', help='Print metadata')
 	parser.add_argument('--short', '-t', action='store_true', help='Only print checksums and paths')
 	parser.add_argument('--showBadMatches', '-b', action='store_true', help='Show bad matches')
+	parser.add_argument('--fromFile', '-i', metavar='FILE', help='Query the checksums, paths or filenames in FILE, one per line (- for stdin), and print the results as JSON lines')
+	parser.add_argument('--keyType', '-k', choices=['checksum', 'path', 'filename'], default='path', help='What the lines of --fromFile are (default path)')
+	parser.add_argument('--hostname', help='Only match files on this host with --fromFile')
 	args = parser.parse_args()
 
+	if args.fromFile:
+		# Keep stdout for the JSON lines
+		with contextlib.redirect_stdout(sys.stderr):
+			catalog = MediaCatalog(args.catalog)
+		with catalog, contextlib.ExitStack() as stack:
+			f = sys.stdin if args.fromFile == '-' else stack.enter_context(open(args.fromFile))
+			keys = (line.rstrip('\n') for line in f if line.strip())
+			numRecords = 0
+			numMissing = 0
+			for key, record in catalog.queryBatch(keys, args.keyType, args.hostname):
+				if record is None:
+					numMissing += 1
+				else:
+					numRecords += 1
+					record = {column: record[column] for column in record.keys() if column != 'query_key'}
+				print(json.dumps({'query': key, 'record': record}, default=str))
+		print(f'Found {numRecords} records - {numMissing} queries not in the catalog', file=sys.stderr)
+		sys.exit(0)
+
 	filename = None
 	directory = None
 	badMatches = False
@@ -4,7 +4,7 @@ import logging
 import os
 
 from mediaCatalog.mediaCatalog import MediaCatalog
-from mediaCatalog.googleCloudStorage import GoogleCloudStorage
+from mediaCatalog.cloudStorage import createCloudStorage
 
 if __name__=='__main__':
 	import argparse
@@ -23,11 +23,6 @@ if __name__=='__main__':
 		raise Exception('Must supply at least one of --checksum, --path, --filename, or --directory!')
 
 	with MediaCatalog(args.catalog) as catalog:
-		if catalog.config['cloudProject'] and catalog.config['defaultCloudBucket']:
-			cloudStorage = GoogleCloudStorage(catalog.config['cloudProject'], catalog.config['defaultCloudBucket'])
-		else:
-			cloudStorage = None
-
 		filename = None
 		directory = None
 		queryTokens = []
@@ -82,6 +77,12 @@ if __name__=='__main__':
 			response = input("Are you sure you want to delete these files? Enter the word DELETE to continue: ")
 			if response.upper() == 'DELETE':
 				break
+
+		# Only connect to the cloud once there is something to remove
+		if catalog.config['cloudProject'] and catalog.config['defaultCloudBucket']:
+			cloudStorage = createCloudStorage(catalog.config)
+		else:
+			cloudStorage = None
 		
 		numRemoved = catalog.remove(dbRecords, cloudStorage)
 		
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import socket
+
+from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog.cloudStorage import createCloudStorage
+from mediaCatalog.cloudDownloader import CloudDownloader
+from mediaCatalog.transferScheduler import TransferScheduler
+
+
+if __name__=='__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Restore cataloged files from the cloud')
+	parser.add_argument('--catalog', '-c', required=True, help='Path to catalog')
+	parser.add_argument('--path', '-p', help='Exact path to restore - this takes precedence over --filename and --directory')
+	parser.add_argument('--checksum', '-s', help='Checksum to restore')
+	parser.add_argument('--directory', '-d', help='Directory to restore, wildcards supported')
+	parser.add_argument('--filename', '-f', help='Filename to restore, wildcards supported')
+	parser.add_argument('--hostname', help=f'Only restore files cataloged on this host, wildcards supported (default: {socket.gethostname()})')
+	parser.add_argument('--destination', help='Restore under this directory instead of the cataloged paths')
+	parser.add_argument('--workers', '-w', type=int, help=f'Maximum number of concurrent downloads (default: transferWorkers from the config or {TransferScheduler.DEFAULT_MAX_WORKERS})')
+	parser.add_argument('--bandwidth', '-b', help='Bandwidth limit in bytes per second, K, M and G suffixes supported (default: transferBandwidthLimit from the config)')
+	parser.add_argument('--window', action='append', help='Only start downloads in this daily time window, e.g. 22:00-07:00 - may be repeated (default: transferWindows from the config)')
+	parser.add_argument('--copy', action='store_true', help='Copy duplicate files instead of hardlinking them')
+	parser.add_argument('--overwrite', action='store_true', help='Replace local files that differ from the catalog')
+	parser.add_argument('--verifyLocalChecksums', action='store_true', help='Verify checksums of existing local files - this is very slow!')
+	parser.add_argument('--dryrun', '-r', action='store_true', help='Only show what would be restored')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+	if args.checksum is None and args.path is None and args.filename is None and args.directory is None:
+		raise Exception('Must supply at least one of --checksum, --path, --filename, or --directory!')
+
+	filename = None
+	directory = None
+	if args.path:
+		args.path = os.path.abspath(args.path)
+		filename = os.path.basename(args.path)
+		directory = os.path.dirname(args.path)
+		if args.filename or args.directory:
+			print('WARNING: --path takes precedence over --filename and --directory! Ignoring --filename and --directory!')
+	else:
+		filename = args.filename
+		if args.directory:
+			directory = os.path.abspath(args.directory)
+	hostname = args.hostname if args.hostname else socket.gethostname()
+
+	with MediaCatalog(args.catalog) as catalog:
+		try:
+			records = catalog.catalogDb.read(checksum=args.checksum, filename=filename, directory=directory, hostname=hostname)
+		except KeyError as e:
+			print(f'WARNING: {e} Use --hostname to restore files cataloged on another host.')
+			import sys; sys.exit(1)
+
+		# Restored paths are relative to the non-wildcard part of the directory
+		baseDirectory = directory
+		if directory and ('*' in directory or '?' in directory):
+			baseDirectory = os.path.dirname(directory.split('*')[0].split('?')[0])
+		cloudStorage = createCloudStorage(catalog.config)
+		scheduler = TransferScheduler.fromConfig(catalog.config, bandwidthLimit=args.bandwidth, windows=args.window, maxWorkers=args.workers)
+		downloader = CloudDownloader(catalog, cloudStorage, copy=args.copy, scheduler=scheduler)
+		downloader.restore(records, 
+						destination=args.destination, 
+						baseDirectory=baseDirectory,
+						verifyChecksum=args.verifyLocalChecksums, 
+						overwrite=args.overwrite, 
+						dryRun=args.dryrun)
+
+		if args.dryrun:
+			print('\n*** DRY RUN - NO FILES RESTORED ***')
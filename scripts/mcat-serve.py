@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import logging
+
+from mediaCatalog.catalogServer import CatalogServer
+
+if __name__=='__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Serve catalog queries over a Unix socket, keeping the catalog open between requests')
+	parser.add_argument('--catalog', '-c', required=True, help='Catalog path')
+	parser.add_argument('--socket', '-s', help='Unix socket to listen on (default <catalog path>/catalog.sock)')
+	parser.add_argument('--readers', '-r', type=int, default=CatalogServer.DEFAULT_READERS, help='Number of threads answering queries (default 4)')
+	parser.add_argument('--update', '-u', action='store_true', help='Update files that are already cataloged when cataloging')
+	parser.add_argument('--verbose', '-v', action='store_true', default=False, help='Verbose output')
+	args = parser.parse_args()
+
+	if args.verbose:
+		logging.basicConfig(level=logging.INFO)
+	else:
+		logging.basicConfig(level=logging.WARNING)
+
+	with CatalogServer(args.catalog, args.socket, args.readers, args.update) as server:
+		try:
+			server.serveForever()
+		except KeyboardInterrupt:
+			print('\nStopped serving')
@@ -4,7 +4,8 @@ import logging
 import os
 
 from mediaCatalog.mediaCatalog import MediaCatalog
-from mediaCatalog.googleCloudStorage import GoogleCloudStorage
+from mediaCatalog.cloudStorage import createCloudStorage
+from mediaCatalog.transferScheduler import TransferScheduler
 
 if __name__=='__main__':
 	import argparse
@@ -15,6 +16,12 @@ if __name__=='__main__':
 	parser.add_argument('--cloud', action='store_true', help='Verify files in the cloud')
 	parser.add_argument('--all', action='store_true', help='Verify files in all locations')
 	parser.add_argument('--verifyLocalChecksums', action='store_true', help='Verify checksums - this is very slow for local files!')
+	parser.add_argument('--budget', help="Only verify the files verified longest ago, within this many bytes (e.g. 500G), minutes or hours (e.g. 90min, 2h), or 'auto' for a verifyCycleDays share of the catalog")
+	parser.add_argument('--deep', action='store_true', help='Read the cloud objects and verify their SHA256 in memory - this downloads everything!')
+	parser.add_argument('--samples', type=int, help='With --deep, only read this many random 1 MB ranges of each object and compare them with the local file')
+	parser.add_argument('--workers', '-w', type=int, help=f'Maximum number of concurrent downloads for --deep (default: transferWorkers from the config or {TransferScheduler.DEFAULT_MAX_WORKERS})')
+	parser.add_argument('--bandwidth', '-b', help='Bandwidth limit for --deep in bytes per second, K, M and G suffixes supported (default: transferBandwidthLimit from the config)')
+	parser.add_argument('--refreshInventory', action='store_true', help='List the whole bucket to refresh the cloud inventory, even if it is recent')
 	args = parser.parse_args()
 
 	logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
@@ -28,11 +35,13 @@ if __name__=='__main__':
 
 	with MediaCatalog(args.catalog) as catalog:
 		if args.cloud:
-			cloudStorage = GoogleCloudStorage(catalog.config['cloudProject'], catalog.config['defaultCloudBucket'])
+			cloudStorage = createCloudStorage(catalog.config)
 		else:
 			cloudStorage = None
+		scheduler = TransferScheduler.fromConfig(catalog.config, bandwidthLimit=args.bandwidth, maxWorkers=args.workers) if args.deep else None
 
-		if catalog.verify(path=args.path, local=args.local, cloudStorage=cloudStorage, verifyChecksum=args.verifyLocalChecksums):
+		if catalog.verify(path=args.path, local=args.local, cloudStorage=cloudStorage, verifyChecksum=args.verifyLocalChecksums, refreshInventory=args.refreshInventory, budget=args.budget, 
+						  deep=args.deep, samples=args.samples, scheduler=scheduler):
 			print('\nVerification successful!')
 		else:
 			print('\n*** Verification failed! ***')
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import logging
+
+from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog.catalogWatcher import CatalogWatcher
+
+if __name__=='__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Watch directories with inotify and catalog new files as they arrive')
+	parser.add_argument('--catalog', '-c', required=True, help='Catalog path')
+	parser.add_argument('path', nargs='*', help='Path(s) to watch - defaults to watchPaths, then catalogPaths, in the catalog config')
+	parser.add_argument('--scan', '-s', action='store_true', help='Catalog the paths before watching, to pick up files added while not watching')
+	parser.add_argument('--debounce', '-d', type=float, help='Seconds without changes before a file is cataloged (default 5)')
+	parser.add_argument('--batchSize', '-b', type=int, help='Maximum number of files to catalog at once (default 100)')
+	parser.add_argument('--verbose', '-v', action='store_true', default=False, help='Verbose output')
+	args = parser.parse_args()
+
+	if args.verbose:
+		logging.basicConfig(level=logging.INFO)
+	else:
+		logging.basicConfig(level=logging.WARNING)
+	catalog = MediaCatalog(args.catalog, verbose=args.verbose)
+	watcher = CatalogWatcher.fromConfig(catalog, args.path, args.debounce, args.batchSize)
+	if not watcher.roots:
+		catalog.close()
+		parser.error('No paths given and no watchPaths or catalogPaths in the catalog config')
+
+	if args.scan:
+		for root in watcher.roots:
+			catalog.catalog(root)
+
+	try:
+		watcher.run()
+	except KeyboardInterrupt:
+		print('\nStopped watching')
+	finally:
+		catalog.close()
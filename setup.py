@@ -25,7 +25,12 @@ setup(
         'scripts/mcat-export.py',
         'scripts/mcat-cloudUpload.py', 
         'scripts/mcat-cloudDownload.py',
-        'scripts/mcat-getMetadata.py'
+        'scripts/mcat-restore.py',
+        'scripts/mcat-getMetadata.py',
+        'scripts/mcat-watch.py',
+        'scripts/mcat-ingest.py',
+        'scripts/mcat-checkArchived.py',
+        'scripts/mcat-serve.py'
     ],
     author='John Kua',
     author_email='john@kua.fm',
@@ -0,0 +1,45 @@
+import pytest
+import os
+import shutil
+import socket
+from mediaCatalog.mediaCatalog import MediaCatalog
+
+def writeSyntheticRecord(catalog, path, mimeType='image/jpeg'):
+    ''' Write a catalog database record for a file without running exiftool '''
+    metadata = {'HostName': socket.gethostname(),
+                'File:FileName': os.path.basename(path),
+                'File:Directory': os.path.dirname(os.path.abspath(path)),
+                'File:FileSize': os.stat(path).st_size,
+                'File:FileModifyDate': '2024:01:01 12:00:00+00:00',
+                'File:MIMEType': mimeType,
+                'File:SHA256Sum': catalog.checksum(path)}
+    catalog.catalogDb.write(metadata)
+    return metadata
+
+@pytest.fixture
+def synthetic_data_dir(tmp_path):
+    ''' Five random files in album1, with copies of two of them in album1_duplicate '''
+    dataDir = tmp_path / 'data'
+    albumDir = dataDir / 'album1'
+    duplicateDir = dataDir / 'album1_duplicate'
+    os.makedirs(albumDir)
+    os.makedirs(duplicateDir)
+    for i in range(5):
+        with open(albumDir / f'IMG_{i:04d}.JPG', 'wb') as f:
+            f.write(os.urandom(100000*(i+1)))
+    for i in [0, 3]:
+        shutil.copy2(albumDir / f'IMG_{i:04d}.JPG', duplicateDir / f'IMG_{i:04d}.JPG')
+    return dataDir
+
+@pytest.fixture
+def synthetic_catalog(tmp_path, synthetic_data_dir):
+    ''' Catalog of the synthetic data written directly to the database, so 
+        no exiftool or sample data is needed
+    '''
+    catalog = MediaCatalog(tmp_path / 'catalog', create=True)
+    for dirName, subdirList, fileList in os.walk(synthetic_data_dir):
+        subdirList.sort()
+        for filename in sorted(fileList):
+            writeSyntheticRecord(catalog, os.path.join(dirName, filename))
+    catalog.catalogDb.commit()
+    return catalog
@@ -0,0 +1,56 @@
+import pytest
+import os
+import shutil
+from mediaCatalog import bloomFilter
+from mediaCatalog.bloomFilter import BloomFilter, ArchiveFilter
+
+
+class TestBloomFilter:
+    def test_bloom_filter(self):
+        bloom = BloomFilter.fromCapacity(10000, 0.01)
+        keys = [os.urandom(16) for i in range(10000)]
+        for key in keys:
+            bloom.add(key)
+        assert len(bloom) == 10000
+        assert all(key in bloom for key in keys)
+        falsePositives = sum(os.urandom(16) in bloom for i in range(10000))
+        assert falsePositives < 300
+
+    def test_archive_filter(self, synthetic_catalog, synthetic_data_dir, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        filterPath = str(tmp_path / 'archiveFilter.bin')
+        ArchiveFilter.fromCatalog(catalog.catalogDb, catalog.CHECKSUM_MODE).save(filterPath)
+        archiveFilter = ArchiveFilter.load(filterPath)
+        assert archiveFilter.checksumMode == 'SHA256'
+        # 5 unique files, one entry per checksum and size
+        assert len(archiveFilter.fileFilter) == 5
+        # Far smaller than the catalog database
+        assert os.path.getsize(filterPath) < os.path.getsize(catalog.catalogDbPath)/10
+
+        hashed = []
+        hashFile = bloomFilter.hashFile
+        def countingHashFile(path, mode):
+            hashed.append(os.path.basename(path))
+            return hashFile(path, mode)
+        monkeypatch.setattr(bloomFilter, 'hashFile', countingHashFile)
+
+        cardDir = tmp_path / 'card'
+        os.makedirs(cardDir)
+        shutil.copy(synthetic_data_dir / 'album1' / 'IMG_0002.JPG', cardDir / 'archived.JPG')
+        with open(cardDir / 'newSize.JPG', 'wb') as f:
+            f.write(os.urandom(12345))
+        with open(cardDir / 'sameSize.JPG', 'wb') as f:
+            f.write(os.urandom(os.path.getsize(synthetic_data_dir / 'album1' / 'IMG_0001.JPG')))
+
+        assert archiveFilter.classify(str(cardDir / 'archived.JPG')) == 'probably archived'
+        assert archiveFilter.classify(str(cardDir / 'archived.JPG'), catalog.catalogDb) == 'archived'
+        assert archiveFilter.classify(str(cardDir / 'sameSize.JPG')) == 'new'
+        hashed.clear()
+        # Files of a size not in the catalog aren't read
+        assert archiveFilter.classify(str(cardDir / 'newSize.JPG')) == 'new'
+        assert hashed == []
+
+        with open(filterPath, 'r+b') as f:
+            f.write(b'garbage!')
+        with pytest.raises(ValueError):
+            ArchiveFilter.load(filterPath)
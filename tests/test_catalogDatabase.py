@@ -0,0 +1,143 @@
+import pytest
+import os
+import shutil
+import sqlite3
+from mediaCatalog.catalogDatabase import CatalogDatabase
+from conftest import writeSyntheticRecord
+
+class TestCatalogDatabase:
+    @pytest.fixture
+    def new_db(self, tmp_path):
+        return CatalogDatabase(tmp_path / 'catalog.db')
+
+    def test_migrate(self, tmp_path):
+        # Create a database with the 1.0.0 schema
+        dbPath = tmp_path / 'catalog.db'
+        db = CatalogDatabase(dbPath)
+        for table in ['upload_session', 'cloud_object', 'cloud_inventory', 'inode_checksum']:
+            db.cursor.execute(f'DROP TABLE {table}')
+        db.cursor.execute('DROP INDEX file_cloud_object_name')
+        for location in ['local', 'cloud']:
+            db.cursor.execute(f'DROP INDEX file_last_verified_{location}')
+            db.cursor.execute(f'ALTER TABLE file DROP COLUMN last_verified_{location}')
+        db.cursor.execute('UPDATE schema_version SET major = 1, minor = 0, patch = 0')
+        db.commit()
+        db.close()
+
+        db = CatalogDatabase(dbPath)
+        db.cursor.execute('SELECT major, minor, patch FROM schema_version WHERE valid_to IS NULL')
+        assert tuple(db.cursor.fetchone()) == (CatalogDatabase.SCHEMA_VERSION.major, 
+                                                CatalogDatabase.SCHEMA_VERSION.minor, 
+                                                CatalogDatabase.SCHEMA_VERSION.micro)
+        db.cursor.execute('SELECT COUNT(*) FROM schema_version')
+        assert db.cursor.fetchone()[0] == 2
+        assert db.getUploadSession('project', 'bucket', 'file/abc') is None
+        assert db.getCloudObject('project', 'bucket', 'file/abc') is None
+        assert db.getUnverifiedFileCount('local', 30) == 0
+        assert db.getInodeChecksum('host', 1, 2, 3, 4) is None
+
+    def test_upload_session(self, new_db):
+        db = new_db
+        assert db.getUploadSession('project', 'bucket', 'file/abc') is None
+
+        db.setUploadSession('project', 'bucket', 'file/abc', '/data/a.mov', 1000, 'https://session/1', 0)
+        session = db.getUploadSession('project', 'bucket', 'file/abc')
+        assert session['session_uri'] == 'https://session/1'
+        assert session['bytes_uploaded'] == 0
+        assert session['file_size'] == 1000
+        assert session['source_path'] == '/data/a.mov'
+
+        # Progress updates the existing session
+        db.setUploadSession('project', 'bucket', 'file/abc', '/data/a.mov', 1000, 'https://session/1', 512)
+        session = db.getUploadSession('project', 'bucket', 'file/abc')
+        assert session['bytes_uploaded'] == 512
+
+        # Sessions are per bucket
+        assert db.getUploadSession('project', 'otherBucket', 'file/abc') is None
+
+        db.deleteUploadSession('project', 'bucket', 'file/abc')
+        assert db.getUploadSession('project', 'bucket', 'file/abc') is None
+
+    def test_cloud_inventory(self, new_db):
+        db = new_db
+        assert db.getCloudObject('project', 'bucket', 'file/abc') is None
+        assert db.getCloudInventoryAge('project', 'bucket', 'file/') is None
+
+        db.setCloudObject('project', 'bucket', 'file/abc', 1000, 1234, 1)
+        cloudObject = db.getCloudObject('project', 'bucket', 'file/abc')
+        assert (cloudObject['object_size'], cloudObject['object_checksum'], cloudObject['generation']) == (1000, 1234, 1)
+        db.setCloudObject('project', 'bucket', 'file/abc', 2000, 5678, 2)
+        assert db.getCloudObject('project', 'bucket', 'file/abc')['generation'] == 2
+        assert db.getCloudObject('project', 'otherBucket', 'file/abc') is None
+
+        # A full refresh replaces the objects under the prefix only
+        db.setCloudObject('project', 'bucket', 'other/xyz', 10, 1, 1)
+        numObjects = db.replaceCloudInventory('project', 'bucket', 'file/', iter([('file/def', 3000, 9, 3), ('file/ghi', 4000, 10, 4)]))
+        assert numObjects == 2
+        assert db.getCloudObject('project', 'bucket', 'file/abc') is None
+        assert db.getCloudObject('project', 'bucket', 'file/def')['object_size'] == 3000
+        assert db.getCloudObject('project', 'bucket', 'other/xyz') is not None
+        assert 0 <= db.getCloudInventoryAge('project', 'bucket', 'file/') < 60
+
+        db.deleteCloudObject('project', 'bucket', 'file/def')
+        assert db.getCloudObject('project', 'bucket', 'file/def') is None
+
+    def test_records_batch(self, synthetic_catalog, synthetic_data_dir):
+        db = synthetic_catalog.catalogDb
+        album = str(synthetic_data_dir / 'album1')
+        paths = [os.path.join(album, 'IMG_0003.JPG'), '/no/such/file.JPG', os.path.join(album, 'IMG_0000.JPG')]
+        results = list(db.iterRecordsBatch(iter(paths), 'path'))
+        assert [key for key, record in results] == paths
+        assert results[1][1] is None
+        assert [record['file_name'] for key, record in results if record] == ['IMG_0003.JPG', 'IMG_0000.JPG']
+        assert all(record['directory'] == album + '/' for key, record in results if record)
+
+        # Every record of a checksum or filename, in key order
+        checksum = results[0][1]['checksum']
+        results = list(db.iterRecordsBatch([checksum, '0'*64], 'checksum'))
+        assert len(results) == 3
+        assert {record['directory'] for key, record in results[:2]} == {album + '/', str(synthetic_data_dir / 'album1_duplicate') + '/'}
+        assert results[2] == ('0'*64, None)
+        assert len(list(db.iterRecordsBatch(['IMG_0000.JPG', 'IMG_0001.JPG'], 'filename'))) == 3
+        assert [record for key, record in db.iterRecordsBatch(['IMG_0001.JPG'], 'filename', hostname='otherHost')] == [None]
+
+        # Pending writes are left for the caller to commit
+        db.cursor.execute("INSERT INTO host (name) VALUES ('otherHost')")
+        list(db.iterRecordsBatch([checksum], 'checksum'))
+        assert db.connection.in_transaction
+        db.rollback()
+        db.cursor.execute("SELECT COUNT(*) FROM host WHERE name = 'otherHost'")
+        assert db.cursor.fetchone()[0] == 0
+        list(db.iterRecordsBatch([checksum], 'checksum'))
+        assert not db.connection.in_transaction
+        with pytest.raises(ValueError):
+            list(db.iterRecordsBatch([checksum], 'directory'))
+
+    def test_duplicates(self, synthetic_catalog, synthetic_data_dir):
+        db = synthetic_catalog.catalogDb
+        album = str(synthetic_data_dir / 'album1') + '/'
+        duplicateAlbum = str(synthetic_data_dir / 'album1_duplicate') + '/'
+        groups = list(db.iterDuplicates())
+        assert sorted(checksum for checksum, records in groups) == sorted(db.getDuplicates())
+        assert [[(record['directory'], record['file_name']) for record in records] for checksum, records in groups] == \
+            [[(album, 'IMG_0000.JPG'), (duplicateAlbum, 'IMG_0000.JPG')], [(album, 'IMG_0003.JPG'), (duplicateAlbum, 'IMG_0003.JPG')]]
+        assert all(record['host_name'] and record['checksum'] == checksum for checksum, records in groups for record in records)
+        # No checksum has two files within one album
+        assert list(db.iterDuplicates(album)) == []
+        assert len(list(db.iterDuplicates(str(synthetic_data_dir) + '/*'))) == 2
+
+        fileSizes = [os.path.getsize(synthetic_data_dir / 'album1' / f'IMG_{i:04d}.JPG') for i in [0, 3]]
+        [(hostA, directoryA, hostB, directoryB, numFiles, numBytes)] = db.getDuplicateDirectoryPairs()
+        assert (directoryA, directoryB) == (album, duplicateAlbum)
+        assert (numFiles, numBytes) == (2, sum(fileSizes))
+        assert db.getDuplicateDirectoryPairs(album) == []
+
+        # Copies within one directory pair it with itself
+        shutil.copy(synthetic_data_dir / 'album1' / 'IMG_0001.JPG', synthetic_data_dir / 'album1' / 'IMG_0001 copy.JPG')
+        writeSyntheticRecord(synthetic_catalog, synthetic_data_dir / 'album1' / 'IMG_0001 copy.JPG')
+        [(checksum, records)] = list(db.iterDuplicates(album))
+        assert [record['file_name'] for record in records] == ['IMG_0001 copy.JPG', 'IMG_0001.JPG']
+        pairs = [(directoryA, directoryB, numFiles, numBytes) 
+                 for hostA, directoryA, hostB, directoryB, numFiles, numBytes in db.getDuplicateDirectoryPairs()]
+        assert pairs == [(album, duplicateAlbum, 2, sum(fileSizes)), 
+                         (album, album, 1, os.path.getsize(synthetic_data_dir / 'album1' / 'IMG_0001.JPG'))]
@@ -0,0 +1,90 @@
+import pytest
+import os
+import shutil
+import threading
+import contextlib
+from mediaCatalog import mediaCatalog, catalogServer
+from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog.catalogServer import CatalogServer, CatalogClient, CatalogServerError
+
+
+@pytest.fixture
+def catalog_server(synthetic_catalog, monkeypatch):
+    ''' Server for the synthetic catalog, with exiftool replaced by synthetic metadata '''
+    monkeypatch.setattr(catalogServer, 'exifToolSession', contextlib.nullcontext)
+    monkeypatch.setattr(mediaCatalog, 'getMimeTypes', lambda filePaths: ['image/jpeg']*len(filePaths))
+    monkeypatch.setattr(MediaCatalog, '_getMetadata', lambda self, files: [
+        {'File:FileName': os.path.basename(file), 'File:Directory': os.path.dirname(file),
+         'File:FileSize': os.path.getsize(file), 'File:FileModifyDate': '2024:01:01 12:00:00+00:00',
+         'File:MIMEType': 'image/jpeg'} for file in files])
+    synthetic_catalog.close()
+    server = CatalogServer(synthetic_catalog.catalogPath, readers=2)
+    server.open()
+    thread = threading.Thread(target=server.serveForever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.close()
+
+
+class TestCatalogServer:
+    def test_queries(self, catalog_server, synthetic_data_dir):
+        path = str(synthetic_data_dir / 'album1' / 'IMG_0000.JPG')
+        with CatalogClient(catalog_server.socketPath) as client:
+            assert client.ping() == 'pong'
+            [record] = client.query(path=path)['records']
+            assert record['file_name'] == 'IMG_0000.JPG'
+            records = client.query(checksum=record['checksum'])['records']
+            assert sorted(record['directory'] for record in records) == [str(synthetic_data_dir / 'album1') + '/', 
+                                                                          str(synthetic_data_dir / 'album1_duplicate') + '/']
+            assert client.query(path='/no/such/file.JPG')['records'] == []
+            assert client.exists(checksum=record['checksum'])
+            assert not client.exists(checksum='0'*64)
+            assert client.exists(path=path)
+            assert not client.exists(path='/no/such/file.JPG')
+            stats = client.stats()
+            assert stats['all']['files'] == 7
+            assert stats['unique']['files'] == 5
+
+            with pytest.raises(CatalogServerError) as e:
+                client.request('delete')
+            assert e.value.type == 'ValueError'
+            with pytest.raises(CatalogServerError):
+                client.exists()
+            # The connection still works after errors
+            assert client.ping() == 'pong'
+
+    def test_concurrent_readers(self, catalog_server):
+        errors = []
+        def query():
+            try:
+                with CatalogClient(os.path.dirname(catalog_server.socketPath)) as client:
+                    for i in range(20):
+                        assert client.stats()['all']['files'] == 7
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=query) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_catalog(self, catalog_server, synthetic_data_dir):
+        newDir = synthetic_data_dir / 'album2'
+        os.makedirs(newDir)
+        shutil.copy(synthetic_data_dir / 'album1' / 'IMG_0001.JPG', newDir / 'IMG_0001.JPG')
+        with open(newDir / 'IMG_0005.JPG', 'wb') as f:
+            f.write(os.urandom(1000))
+        with CatalogClient(catalog_server.socketPath) as client:
+            result = client.catalog([str(newDir)])
+            assert sorted(os.path.basename(path) for path in result['new']) == ['IMG_0001.JPG', 'IMG_0005.JPG']
+            assert result['failed'] == []
+            # Readers see the writer's commits
+            assert client.stats()['all']['files'] == 9
+            assert client.catalog([str(newDir / 'IMG_0005.JPG')])['skipped'] == 1
+
+    def test_socket_in_use(self, catalog_server):
+        with pytest.raises(RuntimeError):
+            CatalogServer(catalog_server.catalogPath, readers=1).open()
@@ -0,0 +1,52 @@
+import pytest
+import os
+import sys
+import subprocess
+from mediaCatalog.catalogSnapshot import writeSnapshot, CatalogSnapshot
+
+
+class TestCatalogSnapshot:
+    def test_snapshot(self, synthetic_catalog, tmp_path):
+        catalog = synthetic_catalog
+        snapshotPath = str(tmp_path / 'catalogSnapshot.bin')
+        numRecords = writeSnapshot(snapshotPath, catalog.catalogDb.iterRecords(all=True, orderBy='checksum'))
+        records = list(catalog.catalogDb.iterRecords(all=True))
+        assert numRecords == len(records)
+
+        with CatalogSnapshot(snapshotPath) as snapshot:
+            assert len(snapshot) == len(records)
+            for record in records:
+                path = os.path.join(record['directory'], record['file_name'])
+                matches = snapshot.lookupChecksum(record['checksum'])
+                assert path in [match.path for match in matches]
+                assert all(match.checksum == record['checksum'] for match in matches)
+                assert len(matches) == len([other for other in records if other['checksum'] == record['checksum']])
+                [match] = snapshot.lookupPath(path)
+                assert match.checksum == record['checksum']
+                assert match.fileSize == record['file_size']
+                assert match.hostName == record['host_name']
+                assert match.cloudObjectName == record['cloud_object_name']
+                assert snapshot.lookupPath(path, hostName='otherHost') == []
+            assert snapshot.lookupChecksum('0'*64) == []
+            assert snapshot.lookupChecksum('f'*64) == []
+            assert snapshot.lookupPath('/no/such/file.JPG') == []
+
+    def test_snapshot_imports(self, synthetic_catalog, tmp_path):
+        snapshotPath = str(tmp_path / 'catalogSnapshot.bin')
+        writeSnapshot(snapshotPath, synthetic_catalog.catalogDb.iterRecords(all=True, orderBy='checksum'))
+        # Lookups don't import SQLite or YAML
+        code = ('import sys; from mediaCatalog.catalogSnapshot import CatalogSnapshot; '
+                f'snapshot = CatalogSnapshot({snapshotPath!r}); assert len(snapshot); '
+                'assert not {"sqlite3", "yaml"} & set(sys.modules), sorted(sys.modules)')
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    def test_snapshot_errors(self, tmp_path):
+        with open(tmp_path / 'garbage.bin', 'wb') as f:
+            f.write(b'garbage!'*10)
+        with pytest.raises(ValueError):
+            CatalogSnapshot(str(tmp_path / 'garbage.bin'))
+        records = [{'checksum': 'bb'*32}, {'checksum': 'aa'*32}]
+        for record in records:
+            record.update(directory='/a', file_name='b', file_size=1, host_name='h', cloud_bucket=None, cloud_object_name=None)
+        with pytest.raises(ValueError):
+            writeSnapshot(str(tmp_path / 'unsorted.bin'), records)
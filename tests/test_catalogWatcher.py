@@ -0,0 +1,74 @@
+import pytest
+import os
+import sys
+import time
+import contextlib
+from mediaCatalog import mediaCatalog, catalogWatcher
+from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog.catalogWatcher import CatalogWatcher
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify requires Linux')
+class TestCatalogWatcher:
+    @pytest.fixture
+    def catalog(self, tmp_path, monkeypatch):
+        ''' Catalog with exiftool replaced by synthetic metadata '''
+        catalog = MediaCatalog(tmp_path / 'catalog', create=True)
+        monkeypatch.setattr(mediaCatalog, 'getMimeTypes', lambda filePaths: ['image/jpeg']*len(filePaths))
+        monkeypatch.setattr(catalogWatcher, 'exifToolSession', contextlib.nullcontext)
+        def getMetadata(files):
+            return [{'File:FileName': os.path.basename(file), 'File:Directory': os.path.dirname(file),
+                     'File:FileSize': os.path.getsize(file), 'File:FileModifyDate': '2024:01:01 12:00:00+00:00',
+                     'File:MIMEType': 'image/jpeg'} for file in files]
+        monkeypatch.setattr(catalog, '_getMetadata', getMetadata)
+        yield catalog
+        catalog.close()
+
+    def settle(self, watcher):
+        ''' Poll until the events have arrived and every pending file is cataloged '''
+        watcher.poll(0.1)
+        endTime = time.monotonic() + 5
+        while (watcher.pending or watcher.movedFrom) and time.monotonic() < endTime:
+            watcher.poll(0.05)
+
+    def paths(self, catalog):
+        return sorted(os.path.join(os.path.normpath(record['directory']), record['file_name']) for record in catalog.catalogDb.read(all=True))
+
+    def test_watch(self, catalog, tmp_path, monkeypatch):
+        root = tmp_path / 'watched'
+        os.makedirs(root)
+        with CatalogWatcher(catalog, [root], debounce=0.05, batchSize=2) as watcher:
+            # New files and directories, without the excluded Lightroom preview
+            for path in [root / 'a.JPG', root / 'album' / 'b.JPG', root / 'album' / 'c.JPG', root / 'Previews.lrtpreview']:
+                os.makedirs(path.parent, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(1000))
+            self.settle(watcher)
+            assert self.paths(catalog) == [str(root / 'a.JPG'), str(root / 'album' / 'b.JPG'), str(root / 'album' / 'c.JPG')]
+
+            # Renames are moved in the catalog without hashing the files again
+            checksum = catalog._checksum
+            hashed = []
+            def countingChecksum(path, mode, useCache=True):
+                hashed.append(path)
+                return checksum(path, mode, useCache)
+            monkeypatch.setattr(catalog, '_checksum', countingChecksum)
+            os.rename(root / 'a.JPG', root / 'renamed.JPG')
+            os.rename(root / 'album', root / 'album2024')
+            self.settle(watcher)
+            assert self.paths(catalog) == [str(root / 'album2024' / 'b.JPG'), str(root / 'album2024' / 'c.JPG'), str(root / 'renamed.JPG')]
+            assert hashed == []
+            record = catalog.catalogDb.read(filename='b.JPG')[0]
+            metadata, _ = catalog.metadataCatalog.read(record['checksum'], filename='b.JPG', directory=str(root / 'album2024'))
+            assert metadata['SourceFile'] == str(root / 'album2024' / 'b.JPG')
+
+            # The renamed directory is still watched under its new name
+            with open(root / 'album2024' / 'd.JPG', 'wb') as f:
+                f.write(os.urandom(1000))
+            self.settle(watcher)
+            assert str(root / 'album2024' / 'd.JPG') in self.paths(catalog)
+
+            # Files moved out of the watched tree are left in the catalog
+            os.rename(root / 'renamed.JPG', tmp_path / 'renamed.JPG')
+            self.settle(watcher)
+            assert len(self.paths(catalog)) == 4
@@ -0,0 +1,148 @@
+import pytest
+import os
+import shutil
+from mediaCatalog.localCloudStorage import LocalCloudStorage
+from mediaCatalog.cloudUploader import CloudUploader
+from mediaCatalog.cloudDownloader import CloudDownloader
+from mediaCatalog.cloudStorage import CloudStorageObjectMissingException
+
+class TestCloudDownload:
+    @pytest.fixture
+    def uploaded_catalog(self, synthetic_catalog, tmp_path):
+        catalog = synthetic_catalog
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket')
+        cloudStorage.createBucket('testBucket')
+        CloudUploader(catalog, cloudStorage).upload()
+        return catalog, cloudStorage
+
+    def test_download(self, uploaded_catalog, tmp_path):
+        catalog, cloudStorage = uploaded_catalog
+        record = catalog.catalogDb.read(all=True)[0]
+        downloadDir = tmp_path / 'download'
+        os.makedirs(downloadDir)
+
+        downloader = CloudDownloader(catalog, cloudStorage)
+        downloadPath = downloader.download(record['checksum'], downloadDir)
+        assert downloadPath == os.path.join(downloadDir, record['file_name'])
+        assert catalog.checksum(downloadPath) == record['checksum']
+
+        # Unknown checksum
+        with pytest.raises(KeyError):
+            downloader.download('0'*64, downloadDir)
+
+    def test_restore(self, uploaded_catalog, synthetic_data_dir, monkeypatch):
+        catalog, cloudStorage = uploaded_catalog
+        records = catalog.catalogDb.read(all=True)
+
+        # Nothing to restore
+        downloader = CloudDownloader(catalog, cloudStorage, workers=2)
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records, verifyChecksum=True)
+        assert not restoredFiles and not failedFiles
+        assert len(skippedFiles) == len(records)
+
+        # Remove everything - each checksum should only be downloaded once
+        shutil.rmtree(synthetic_data_dir)
+        downloads = []
+        downloadFileObject = cloudStorage.downloadFileObject
+        def countingDownload(objectName, fileObj):
+            downloads.append(objectName)
+            downloadFileObject(objectName, fileObj)
+        monkeypatch.setattr(cloudStorage, 'downloadFileObject', countingDownload)
+
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records)
+        assert len(restoredFiles) == len(records)
+        assert not skippedFiles and not failedFiles
+        assert sorted(downloads) == sorted(set(record['cloud_object_name'] for record in records))
+        for record in records:
+            path = os.path.join(record['directory'], record['file_name'])
+            assert catalog.checksum(path) == record['checksum']
+
+        # Duplicates are hardlinked
+        original = os.stat(synthetic_data_dir / 'album1' / 'IMG_0000.JPG')
+        duplicate = os.stat(synthetic_data_dir / 'album1_duplicate' / 'IMG_0000.JPG')
+        assert original.st_ino == duplicate.st_ino
+
+        # A missing duplicate is restored from the local copy instead of the cloud
+        os.remove(synthetic_data_dir / 'album1_duplicate' / 'IMG_0003.JPG')
+        downloads.clear()
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records)
+        assert restoredFiles == [os.path.join(synthetic_data_dir, 'album1_duplicate', 'IMG_0003.JPG')]
+        assert not downloads
+
+        # Changed files are only replaced with overwrite
+        changedPath = synthetic_data_dir / 'album1' / 'IMG_0001.JPG'
+        with open(changedPath, 'ab') as f:
+            f.write(b'changed')
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records)
+        assert failedFiles == [str(changedPath)]
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records, overwrite=True)
+        assert restoredFiles == [str(changedPath)]
+
+        # A local copy already verified by verifyChecksum is not hashed again
+        os.remove(synthetic_data_dir / 'album1_duplicate' / 'IMG_0003.JPG')
+        hashed = []
+        checksum = catalog.checksum
+        def countingChecksum(path):
+            hashed.append(str(path))
+            return checksum(path)
+        monkeypatch.setattr(catalog, 'checksum', countingChecksum)
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records, verifyChecksum=True)
+        assert restoredFiles == [os.path.join(synthetic_data_dir, 'album1_duplicate', 'IMG_0003.JPG')]
+        assert hashed.count(os.path.join(synthetic_data_dir, 'album1', 'IMG_0003.JPG')) == 1
+
+    def test_restore_failure(self, uploaded_catalog, synthetic_data_dir, monkeypatch):
+        catalog, cloudStorage = uploaded_catalog
+        records = catalog.catalogDb.read(all=True)
+        shutil.rmtree(synthetic_data_dir)
+
+        # A failed download is recorded and the remaining files are still restored
+        failedObjectName = records[1]['cloud_object_name']
+        downloadFileObject = cloudStorage.downloadFileObject
+        def failingDownload(objectName, fileObj):
+            if objectName == failedObjectName:
+                raise CloudStorageObjectMissingException(cloudStorage.bucketName, objectName)
+            downloadFileObject(objectName, fileObj)
+        monkeypatch.setattr(cloudStorage, 'downloadFileObject', failingDownload)
+
+        restoredFiles, skippedFiles, failedFiles = CloudDownloader(catalog, cloudStorage).restore(records)
+        failedPaths = [os.path.join(record['directory'], record['file_name']) for record in records if record['cloud_object_name'] == failedObjectName]
+        assert sorted(failedFiles) == sorted(failedPaths)
+        assert len(restoredFiles) == len(records) - len(failedPaths)
+        for path in failedPaths:
+            assert not os.path.exists(path)
+            assert not os.path.exists(path + CloudDownloader.PARTIAL_SUFFIX)
+
+    def test_restore_sliced(self, uploaded_catalog, synthetic_data_dir):
+        catalog, cloudStorage = uploaded_catalog
+        records = catalog.catalogDb.read(all=True)
+        shutil.rmtree(synthetic_data_dir)
+
+        cloudStorage.SLICED_DOWNLOAD_THRESHOLD = 250000
+        cloudStorage.SLICED_DOWNLOAD_MIN_SLICE_SIZE = 100000
+        restoredFiles, skippedFiles, failedFiles = CloudDownloader(catalog, cloudStorage).restore(records)
+        assert len(restoredFiles) == len(records)
+        for record in records:
+            path = os.path.join(record['directory'], record['file_name'])
+            assert catalog.checksum(path) == record['checksum']
+
+    def test_restore_destination(self, uploaded_catalog, synthetic_data_dir, tmp_path):
+        catalog, cloudStorage = uploaded_catalog
+        records = catalog.catalogDb.read(directory=str(synthetic_data_dir) + '/*')
+        destination = tmp_path / 'restore'
+
+        downloader = CloudDownloader(catalog, cloudStorage, copy=True)
+        restoredFiles, skippedFiles, failedFiles = downloader.restore(records, destination=destination, baseDirectory=str(synthetic_data_dir))
+        assert len(restoredFiles) == len(records)
+        for record in records:
+            path = os.path.join(record['directory'], record['file_name'])
+            restoredPath = os.path.join(destination, os.path.relpath(path, synthetic_data_dir))
+            assert catalog.checksum(restoredPath) == record['checksum']
+            assert os.stat(restoredPath).st_ino != os.stat(path).st_ino
+
+    def test_restore_dryrun(self, uploaded_catalog, synthetic_data_dir):
+        catalog, cloudStorage = uploaded_catalog
+        records = catalog.catalogDb.read(all=True)
+        shutil.rmtree(synthetic_data_dir)
+        restoredFiles, skippedFiles, failedFiles = CloudDownloader(catalog, cloudStorage).restore(records, dryRun=True)
+        assert not restoredFiles
+        assert not os.path.exists(synthetic_data_dir)
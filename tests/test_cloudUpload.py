@@ -3,7 +3,11 @@ import os
 import yaml
 from mediaCatalog.mediaCatalog import MediaCatalog
 from mediaCatalog.googleCloudStorage import GoogleCloudStorage
+from mediaCatalog.localCloudStorage import LocalCloudStorage
+from mediaCatalog.cloudStorage import CloudStorageTransientException
 from mediaCatalog.cloudUploader import CloudUploader
+from mediaCatalog.cloudVerifier import CloudVerifier
+from mediaCatalog.transferScheduler import TransferScheduler
 
 class TestCloudUpload:
     @pytest.fixture
@@ -14,6 +18,145 @@ class TestCloudUpload:
     def sample_data_dir(self):
         return os.path.join(os.path.dirname(__file__), '..', 'data/sample')
     
+    def test_upload_local(self, synthetic_catalog, tmp_path):
+        catalog = synthetic_catalog
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=256*1024)
+        cloudStorage.createBucket('testBucket')
+        uploader = CloudUploader(catalog, cloudStorage)
+        uploader.upload()
+
+        records = catalog.catalogDb.read(all=True)
+        for record in records:
+            sourcePath = os.path.join(record['directory'], record['file_name'])
+            assert record['cloud_name'] == cloudStorage.projectId
+            assert record['cloud_bucket'] == 'testBucket'
+            assert record['cloud_object_name'] == os.path.join(catalog.config['cloudObjectPrefix'], record['checksum'])
+            assert cloudStorage.validateFile(record['cloud_object_name'], sourcePath=sourcePath)
+            assert cloudStorage.getMimeType(record['cloud_object_name']) == 'image/jpeg'
+            assert catalog.catalogDb.getUploadSession(cloudStorage.projectId, 'testBucket', record['cloud_object_name']) is None
+        assert catalog.verify(cloudStorage=cloudStorage)
+
+        # Uploads are added to the cloud inventory, so verification needs no listing
+        assert catalog.catalogDb.getCloudObject(cloudStorage.projectId, 'testBucket', records[0]['cloud_object_name'])['object_size'] == records[0]['file_size']
+        listObjects = cloudStorage.listObjects
+        cloudStorage.listObjects = None
+        assert catalog.verify(cloudStorage=cloudStorage)
+        cloudStorage.listObjects = listObjects
+
+        # Delete an object behind the catalog's back - verification fails once the inventory is refreshed
+        objectName = records[-1]['cloud_object_name']
+        cloudStorage.deleteFile(objectName)
+        assert catalog.verify(cloudStorage=cloudStorage)
+        assert not catalog.verify(cloudStorage=cloudStorage, refreshInventory=True)
+        assert not catalog.verify(cloudStorage=cloudStorage)
+
+    def test_verify_orphans(self, synthetic_catalog, tmp_path, capsys):
+        catalog = synthetic_catalog
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=256*1024)
+        cloudStorage.createBucket('testBucket')
+        CloudUploader(catalog, cloudStorage).upload()
+        record = catalog.catalogDb.read(all=True)[0]
+        sourcePath = os.path.join(record['directory'], record['file_name'])
+
+        # Objects before, between and after the catalog's objects have no catalog record
+        prefix = catalog.config['cloudObjectPrefix']
+        orphans = [f'{prefix}/0000', f'{record["cloud_object_name"]}0', f'{prefix}/zzzz']
+        for objectName in orphans:
+            cloudStorage.uploadFile(sourcePath, objectName)
+        capsys.readouterr()
+        assert catalog.verify(cloudStorage=cloudStorage, refreshInventory=True)
+        output = capsys.readouterr().out
+        for objectName in orphans:
+            assert f'Cloud object not in catalog: {objectName} ' in output
+        assert f'Orphan cloud objects: {len(orphans)} ' in output
+
+        # Orphans aren't reported for a subset of the catalog
+        assert catalog.verify(path=record['directory'], cloudStorage=cloudStorage)
+        assert 'Cloud object not in catalog' not in capsys.readouterr().out
+
+        # Files that verified are stamped, and a time budget looks them up stalest first
+        assert all(record['last_verified_cloud'] for record in catalog.catalogDb.read(all=True))
+        catalog.catalogDb.setLastVerified([record['id']], 'cloud', '2024-01-01 00:00:00')
+        assert catalog.catalogDb.getUnverifiedFileCount('cloud', 30) == 1
+        assert catalog.verify(cloudStorage=cloudStorage, budget='1min')
+        assert catalog.catalogDb.getUnverifiedFileCount('cloud', 30) == 0
+        assert 'Cloud object not in catalog' not in capsys.readouterr().out
+
+    def test_verify_deep(self, synthetic_catalog, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=256*1024)
+        cloudStorage.createBucket('testBucket')
+        CloudUploader(catalog, cloudStorage).upload()
+        records = catalog.catalogDb.read(all=True)
+        uniqueBytes = catalog.catalogDb.getTotalFileSize(mode='unique')
+
+        # Duplicates share an object, which is read once, through the scheduler's limits
+        scheduler = TransferScheduler(maxWorkers=2)
+        assert catalog.verify(cloudStorage=cloudStorage, deep=True, scheduler=scheduler)
+        assert scheduler.bytesTransferred == uniqueBytes
+        assert all(record['last_verified_cloud'] for record in catalog.catalogDb.read(all=True))
+
+        # Replace an object with different data of the same size - its listed CRC32C is consistent, the SHA-256 isn't
+        record = records[0]
+        otherPath = tmp_path / 'other'
+        with open(otherPath, 'wb') as f:
+            f.write(os.urandom(record['file_size']))
+        cloudStorage.uploadFile(otherPath, record['cloud_object_name'])
+        assert not catalog.verify(cloudStorage=cloudStorage, deep=True)
+
+        # Sampled ranges are compared with the local file
+        monkeypatch.setattr(CloudVerifier, 'SAMPLE_SIZE', 1000)
+        verifier = CloudVerifier(catalog, cloudStorage, TransferScheduler())
+        results = verifier.verify(catalog.catalogDb.iterRecords(all=True, orderBy='cloud_object_name'), samples=3)
+        numShared = len([other for other in records if other['cloud_object_name'] == record['cloud_object_name']])
+        assert (results['found'], results['changed']) == (len(records) - numShared, numShared)
+        assert verifier.scheduler.bytesTransferred <= len(records)*3*1000
+
+        # Missing objects and a budget
+        cloudStorage.deleteFile(record['cloud_object_name'])
+        results = verifier.verify([record])
+        assert results['missing'] == 1
+        assert not catalog.verify(cloudStorage=cloudStorage, deep=True, samples=1, budget=1)
+
+    def test_merge_cloud_objects(self):
+        records = [{'cloud_object_name': name} for name in [None, 'b', 'b', 'c', 'e']]
+        cloudObjects = [{'object_name': name} for name in ['a', 'b', 'd', 'e', 'f']]
+        pairs = [(record and record['cloud_object_name'], cloudObject and cloudObject['object_name']) 
+                 for record, cloudObject in MediaCatalog._mergeCloudObjects(records, cloudObjects)]
+        assert pairs == [(None, None), (None, 'a'), ('b', 'b'), ('b', 'b'), ('c', None), (None, 'd'), ('e', 'e'), (None, 'f')]
+
+    def test_upload_resume(self, synthetic_catalog, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=128*1024)
+        cloudStorage.createBucket('testBucket')
+        cloudStorage.MAX_RETRIES = 0
+
+        # Fail every resumable upload after its first chunk
+        transfer = cloudStorage._transfer
+        def failingTransfer(src, dst, crcHelper=None, maxBytes=None):
+            if maxBytes is not None and src.tell() > 0:
+                raise CloudStorageTransientException(cloudStorage.bucketName, None, 'connection reset')
+            return transfer(src, dst, crcHelper, maxBytes)
+        monkeypatch.setattr(cloudStorage, '_transfer', failingTransfer)
+
+        # Uploads larger than a chunk fail, leaving their sessions in the catalog
+        uploader = CloudUploader(catalog, cloudStorage)
+        uploader.upload()
+        notInCloud = catalog.catalogDb.getFilesNotInCloud()
+        assert len(set(checksum for checksum, filename, directory, mimeType in notInCloud)) == 4
+        for checksum, filename, directory, mimeType in notInCloud:
+            objectName = os.path.join(catalog.config['cloudObjectPrefix'], checksum)
+            session = catalog.catalogDb.getUploadSession(cloudStorage.projectId, 'testBucket', objectName)
+            assert session['bytes_uploaded'] == 128*1024
+
+        # A second run resumes them
+        monkeypatch.setattr(cloudStorage, '_transfer', transfer)
+        uploader.upload()
+        assert not catalog.catalogDb.getFilesNotInCloud()
+        catalog.catalogDb.cursor.execute('SELECT COUNT(*) FROM upload_session')
+        assert catalog.catalogDb.cursor.fetchone()[0] == 0
+        assert catalog.verify(cloudStorage=cloudStorage)
+
     def test_upload(self, catalog_dir, sample_data_dir, tmp_path):
         catalog = MediaCatalog(catalog_dir, create=True)
         catalog.catalog(sample_data_dir)
@@ -56,7 +199,7 @@ class TestCloudUpload:
 
         # Delete the last file from the cloud - both should fail
         cloudStorage.deleteFile(objectName)
-        assert not catalog.verify(cloudStorage=cloudStorage)
+        assert not catalog.verify(cloudStorage=cloudStorage, refreshInventory=True)
         assert not catalog.verify(cloudStorage=cloudStorage, verifyChecksum=True)
 
         # Upload the last file with a bad checksum
@@ -66,11 +209,11 @@ class TestCloudUpload:
             f.write(data[::-1])
         cloudStorage.uploadFile(corruptFile, objectName, mimeType)
         # This will also fail because we always verify cloud checksums since we store them in the catalog
-        assert not catalog.verify(cloudStorage=cloudStorage)
+        assert not catalog.verify(cloudStorage=cloudStorage, refreshInventory=True)
         assert not catalog.verify(cloudStorage=cloudStorage, verifyChecksum=True)
 
         # Restore the last file
         cloudStorage.uploadFile(os.path.join(directory, filename), objectName, mimeType)
-        assert catalog.verify(cloudStorage=cloudStorage)
+        assert catalog.verify(cloudStorage=cloudStorage, refreshInventory=True)
         assert catalog.verify(cloudStorage=cloudStorage, verifyChecksum=True)
 
@@ -0,0 +1,111 @@
+import pytest
+import os
+import time
+import threading
+import concurrent.futures
+from mediaCatalog import diskLayout
+from mediaCatalog.diskLayout import DeviceLimiter, sortByLayout, getFirstExtent
+
+
+class TestDiskLayout:
+    @pytest.fixture
+    def files(self, tmp_path):
+        paths = []
+        for i in range(10):
+            path = str(tmp_path / f'file{9 - i}')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(10000))
+            paths.append(path)
+        return paths
+
+    def test_sort_by_layout(self, files, tmp_path):
+        assert sortByLayout(files) == sorted(files)
+
+        byInode = sortByLayout(files, 'inode')
+        assert [os.stat(path).st_ino for path in byInode] == sorted(os.stat(path).st_ino for path in files)
+
+        # Files without a FIEMAP extent fall back to the inode and sort after those with one
+        byExtent = sortByLayout(files, 'extent')
+        assert sorted(byExtent) == sorted(files)
+        extents = [getFirstExtent(path) for path in byExtent]
+        withExtents = [extent for extent in extents if extent is not None]
+        assert withExtents == sorted(withExtents)
+        assert extents[:len(withExtents)] == withExtents
+
+        # Missing files sort last
+        missing = str(tmp_path / 'missing')
+        assert sortByLayout(files + [missing], 'inode')[-1] == missing
+        assert getFirstExtent(missing) is None
+
+        with pytest.raises(ValueError):
+            sortByLayout(files, 'random')
+
+    def test_device_limiter(self, files, monkeypatch):
+        limiter = DeviceLimiter.fromConfig({'hashReadersRotational': 2, 'hashReadersSolidState': 6})
+        assert limiter.maxReaders == 6
+
+        # Every file is on the same spinning disk
+        monkeypatch.setattr(diskLayout, 'isRotational', lambda path: True)
+        readers = []
+        maxReaders = []
+        lock = threading.Lock()
+        def read(path):
+            with limiter.reading(path):
+                with lock:
+                    readers.append(path)
+                    maxReaders.append(len(readers))
+                time.sleep(0.01)
+                with lock:
+                    readers.remove(path)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=limiter.maxReaders) as executor:
+            list(executor.map(read, files))
+        assert max(maxReaders) <= 2
+
+    def test_checksum_files(self, synthetic_catalog, synthetic_data_dir):
+        catalog = synthetic_catalog
+        paths = sortByLayout([str(path) for path in (synthetic_data_dir / 'album1').iterdir()], 'extent')
+        checksums = catalog._checksumFiles(paths, DeviceLimiter.fromConfig(catalog.config))
+        assert checksums == {path: catalog.checksum(path) for path in paths}
+
+    def test_checksum_hardlinks(self, synthetic_catalog, synthetic_data_dir, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        albumDir = synthetic_data_dir / 'album1'
+        linkDir = tmp_path / 'byEvent'
+        os.makedirs(linkDir)
+        for i in [0, 1]:
+            os.link(albumDir / f'IMG_{i:04d}.JPG', linkDir / f'IMG_{i:04d}.JPG')
+        paths = sorted(str(path) for path in albumDir.iterdir()) + sorted(str(path) for path in linkDir.iterdir())
+
+        hashed = []
+        checksum = catalog._checksum
+        def countingChecksum(path, mode):
+            hashed.append(path)
+            return checksum(path, mode)
+        monkeypatch.setattr(catalog, '_checksum', countingChecksum)
+        limiter = DeviceLimiter()
+
+        # One read per inode within a run
+        checksums = catalog._checksumFiles(paths, limiter, {})
+        assert checksums == {path: checksum(path, catalog.CHECKSUM_MODE) for path in paths}
+        assert len(hashed) == 5
+
+        # The next run reuses the stored checksums of the hardlinked inodes
+        hashed.clear()
+        assert catalog._checksumFiles([str(path) for path in linkDir.iterdir()], limiter, {}) == {path: checksums[path] for path in paths[5:]}
+        assert hashed == []
+
+        # Changed files are hashed again
+        with open(linkDir / 'IMG_0000.JPG', 'r+b') as f:
+            f.write(b'changed')
+        assert catalog._checksumFiles([str(albumDir / 'IMG_0000.JPG')], limiter, {})[str(albumDir / 'IMG_0000.JPG')] != checksums[paths[0]]
+        assert hashed == [str(albumDir / 'IMG_0000.JPG')]
+
+    def test_report_reflinks(self, files, monkeypatch, capsys):
+        from mediaCatalog import mediaCatalog
+        from mediaCatalog.mediaCatalog import MediaCatalog
+        # The first four files share two extents pairwise, and the rest aren't shared
+        extents = {files[0]: 4096, files[1]: 4096, files[2]: 8192, files[3]: 8192}
+        monkeypatch.setattr(mediaCatalog, 'getSharedExtent', lambda path: extents.get(path))
+        candidates = MediaCatalog._reportReflinks(files)
+        assert candidates == [[files[0], files[1]], [files[2], files[3]]]
+        assert f'{files[1]} -> [REFLINK] Shares its data with {files[0]}' in capsys.readouterr().out
@@ -0,0 +1,67 @@
+import pytest
+import os
+from mediaCatalog import mediaCatalog
+from mediaCatalog.fileWalker import FileWalker
+
+
+class TestFileWalker:
+    @pytest.fixture
+    def tree(self, tmp_path):
+        ''' Photos with Lightroom previews, sidecars and system files next to them '''
+        root = tmp_path / 'photos'
+        files = {'2024/b/IMG_0002.JPG': os.urandom(1000),
+                 '2024/a/IMG_0001.CR2': os.urandom(1000),
+                 '2024/a/notes': b'Text without an extension',
+                 '2024/a/.DS_Store': b'\x00\x00\x00\x01Bud1',
+                 '2024/a/IMG_0001.xmp': b'<x:xmpmeta/>',
+                 '2024/a/backup': b'PK\x03\x04' + os.urandom(100),
+                 '2024/a/library': b'SQLite format 3\x00' + os.urandom(100),
+                 'Previews.lrdata/1/ABCD.lrprev': os.urandom(1000),
+                 'Catalog Previews.lrtpreview': os.urandom(1000),
+                 'private/IMG_0003.JPG': os.urandom(1000)}
+        for name, data in files.items():
+            os.makedirs((root / name).parent, exist_ok=True)
+            with open(root / name, 'wb') as f:
+                f.write(data)
+        return root
+
+    def test_walk(self, tree):
+        walker = FileWalker(exclude=[str(tree / 'private')])
+        walked = list(walker.walk(tree))
+        # Top down in sorted order, like the os.walk loop it replaces
+        assert [directory for directory, filePaths in walked] == [str(tree), str(tree / '2024'), str(tree / '2024/a'), str(tree / '2024/b')]
+        assert walked[2][1] == [str(tree / '2024/a/IMG_0001.CR2'), str(tree / '2024/a/notes')]
+        assert walked[3][1] == [str(tree / '2024/b/IMG_0002.JPG')]
+        assert walker.numExcluded == 4
+        assert walker.numPrefiltered == 3
+
+        # Include globs, without the prefilter
+        walker = FileWalker(include=['*.JPG', '*.xmp'], prefilter=False)
+        filePaths = [filePath for directory, filePaths in walker.walk(tree) for filePath in filePaths]
+        assert filePaths == [str(tree / '2024/a/IMG_0001.xmp'), str(tree / '2024/b/IMG_0002.JPG'), str(tree / 'private/IMG_0003.JPG')]
+        assert walker.numPrefiltered == 0
+
+        walker = FileWalker.fromConfig({'exclude': ['2024']})
+        assert [directory for directory, filePaths in walker.walk(tree)] == [str(tree), str(tree / 'private')]
+
+    def test_may_be_media(self, tree):
+        walker = FileWalker()
+        assert walker.mayBeMedia(str(tree / '2024/b/IMG_0002.JPG'))
+        assert walker.mayBeMedia(str(tree / '2024/a/notes'))
+        assert not walker.mayBeMedia(str(tree / '2024/a/IMG_0001.xmp'))
+        assert not walker.mayBeMedia(str(tree / '2024/a/library'))
+        # Files that can't be read are left to exiftool
+        assert walker.mayBeMedia(str(tree / 'missing'))
+
+    def test_catalog_prefilter(self, tree, tmp_path, monkeypatch):
+        catalog = mediaCatalog.MediaCatalog(tmp_path / 'catalog', create=True)
+        catalog.config['exclude'] = ['private']
+        sentToExiftool = []
+        def getMimeTypes(filePaths):
+            sentToExiftool.extend(filePaths)
+            return [None]*len(filePaths)
+        monkeypatch.setattr(mediaCatalog, 'getMimeTypes', getMimeTypes)
+        newFiles, updatedFiles, skippedFiles, failedFiles = catalog.catalog(tree)
+        assert sorted(sentToExiftool) == sorted([str(tree / '2024/a/IMG_0001.CR2'), str(tree / '2024/a/notes'), str(tree / '2024/b/IMG_0002.JPG')])
+        assert len(skippedFiles) == 3
+        catalog.close()
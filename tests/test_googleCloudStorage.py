@@ -1,13 +1,21 @@
 import pytest
 import os
 import yaml
+import base64
+import struct
 import datetime
+import requests
+import google_crc32c
+from google.api_core import exceptions as googleExceptions
+from google.resumable_media import DataCorruption
 from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog import googleCloudStorage
 from mediaCatalog.googleCloudStorage import GoogleCloudStorage
 from mediaCatalog.cloudStorage import (CloudStorage, 
                                     CloudStorageObjectMissingException, 
                                     CloudStorageObjectSizeMismatchException, 
-                                    CloudStorageObjectChecksumMismatchException)
+                                    CloudStorageObjectChecksumMismatchException,
+                                    CloudStorageTransientException)
 
 class TestGoogleCloudStorage:
     @pytest.fixture
@@ -149,3 +157,221 @@ class TestGoogleCloudStorage:
 
         # Clean up - delete bucket
         cloudStorage.deleteBucket(bucketName)
+
+
+class FakeResponse:
+    def __init__(self, status_code, persisted=None):
+        self.status_code = status_code
+        self.headers = {}
+        if status_code == 308 and persisted:
+            self.headers['Range'] = f'bytes=0-{persisted - 1}'
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'HTTP {self.status_code}')
+
+class FakeUploadServer:
+    ''' Stands in for storageClient._http, implementing the resumable upload 
+        protocol. Responses can be injected to simulate errors, and 
+        persistLimit makes the server persist only part of a chunk.
+    '''
+    SESSION_URI = 'https://storage.example/upload/session'
+
+    def __init__(self):
+        self.data = bytearray()
+        self.requests = []
+        self.injected = []
+        self.expired = False
+        self.persistLimit = None
+        self.crc32c = None
+
+    def put(self, url, data=None, headers=None, timeout=None):
+        contentRange = headers['Content-Range']
+        self.requests.append((contentRange, len(data) if data else 0))
+        if self.injected:
+            return FakeResponse(self.injected.pop(0), len(self.data))
+        if self.expired:
+            return FakeResponse(410)
+
+        byteRange, fileSize = contentRange[len('bytes '):].split('/')
+        if byteRange != '*':
+            start = int(byteRange.split('-')[0])
+            assert start <= len(self.data)
+            if self.persistLimit:
+                data = data[:self.persistLimit]
+            self.data[start:] = data
+        if len(self.data) == int(fileSize):
+            helper = google_crc32c.Checksum()
+            helper.update(bytes(self.data))
+            self.crc32c = base64.b64encode(struct.pack('>I', helper._crc)).decode()
+            return FakeResponse(200)
+        return FakeResponse(308, len(self.data))
+
+class FakeBlob:
+    def __init__(self, server):
+        self.server = server
+        self.name = 'file/resumable'
+        self.bucket = type('FakeBucket', (), {'name': 'testBucket'})()
+        self.crc32c = None
+        self.sessions = 0
+        self.deleted = False
+
+    def create_resumable_upload_session(self, content_type=None, size=None):
+        self.sessions += 1
+        self.server.data = bytearray()
+        self.server.expired = False
+        return self.server.SESSION_URI
+
+    def reload(self):
+        self.crc32c = self.server.crc32c
+
+    def delete(self):
+        self.deleted = True
+
+class FakeClient:
+    def __init__(self, project=None):
+        self._http = FakeUploadServer()
+        self.fakeBlob = FakeBlob(self._http)
+
+    def bucket(self, bucketName):
+        return type('FakeBucket', (), {'blob': lambda _, objectName: self.fakeBlob})()
+
+class TestGoogleCloudStorageResumable:
+    ''' Resumable upload protocol tests against a fake upload server, so no 
+        cloud credentials are needed
+    '''
+    CHUNK_SIZE = GoogleCloudStorage.UPLOAD_CHUNK_ALIGNMENT
+
+    @pytest.fixture
+    def cloud_storage(self, monkeypatch):
+        monkeypatch.setattr(googleCloudStorage.storage, 'Client', FakeClient)
+        cloudStorage = GoogleCloudStorage('testProject', 'testBucket', chunkSize=self.CHUNK_SIZE)
+        cloudStorage.INITIAL_RETRY_DELAY = 0.0
+        cloudStorage.MAX_RETRIES = 3
+        return cloudStorage
+
+    @pytest.fixture
+    def source_path(self, tmp_path):
+        sourcePath = tmp_path / 'resumable_source'
+        with open(sourcePath, 'wb') as f:
+            f.write(os.urandom(3*self.CHUNK_SIZE + 1000))
+        return sourcePath
+
+    def upload(self, cloudStorage, sourcePath, sessionUri=None):
+        progress = []
+        cloudStorage.uploadFile(sourcePath, 'file/resumable', sessionUri=sessionUri, 
+                                progressCallback=lambda uri, offset: progress.append((uri, offset)))
+        return progress
+
+    def test_resumable_upload(self, cloud_storage, source_path):
+        server = cloud_storage.storageClient._http
+        fileSize = os.stat(source_path).st_size
+        progress = self.upload(cloud_storage, source_path)
+
+        assert server.data == open(source_path, 'rb').read()
+        assert server.requests == [(f'bytes {i*self.CHUNK_SIZE}-{min((i+1)*self.CHUNK_SIZE, fileSize) - 1}/{fileSize}', 
+                                    min(self.CHUNK_SIZE, fileSize - i*self.CHUNK_SIZE)) for i in range(4)]
+        assert progress == [(server.SESSION_URI, i*self.CHUNK_SIZE) for i in range(4)]
+
+    def test_range_header(self, cloud_storage, source_path):
+        server = cloud_storage.storageClient._http
+        fileSize = os.stat(source_path).st_size
+
+        # 308 without a Range header - nothing persisted, the chunk is resent from 0
+        server.injected = [308]
+        self.upload(cloud_storage, source_path)
+        assert [r[0] for r in server.requests[:2]] == [f'bytes 0-{self.CHUNK_SIZE - 1}/{fileSize}'] * 2
+        assert server.data == open(source_path, 'rb').read()
+
+        # The server persists only part of each chunk - the offset moves back and the CRC must still match
+        server.requests = []
+        server.persistLimit = self.CHUNK_SIZE//2
+        progress = self.upload(cloud_storage, source_path)
+        assert server.data == open(source_path, 'rb').read()
+        assert progress[1] == (server.SESSION_URI, self.CHUNK_SIZE//2)
+        assert server.requests[1] == (f'bytes {self.CHUNK_SIZE//2}-{3*self.CHUNK_SIZE//2 - 1}/{fileSize}', self.CHUNK_SIZE)
+
+    def test_transient_error(self, cloud_storage, source_path):
+        server = cloud_storage.storageClient._http
+        fileSize = os.stat(source_path).st_size
+
+        # Fail the second chunk with a 503 - the offset is resynced with a status query
+        realPut = server.put
+        calls = []
+        def put(url, data=None, headers=None, timeout=None):
+            calls.append(headers['Content-Range'])
+            if len(calls) == 2:
+                return FakeResponse(503)
+            return realPut(url, data=data, headers=headers, timeout=timeout)
+        server.put = put
+        progress = self.upload(cloud_storage, source_path)
+        assert calls[1] == f'bytes {self.CHUNK_SIZE}-{2*self.CHUNK_SIZE - 1}/{fileSize}'
+        assert calls[2] == f'bytes */{fileSize}'
+        assert calls[3] == calls[1]
+        assert (server.SESSION_URI, self.CHUNK_SIZE) in progress
+        assert server.data == open(source_path, 'rb').read()
+
+        # Too many transient errors give up with a transient exception
+        server.put = realPut
+        server.injected = [503] * 10
+        with pytest.raises(CloudStorageTransientException):
+            self.upload(cloud_storage, source_path)
+
+    def test_resume_session(self, cloud_storage, source_path):
+        server = cloud_storage.storageClient._http
+        blob = cloud_storage.storageClient.fakeBlob
+        fileSize = os.stat(source_path).st_size
+
+        # Resume a session with the first chunk already persisted
+        server.data = bytearray(open(source_path, 'rb').read()[:self.CHUNK_SIZE])
+        progress = self.upload(cloud_storage, source_path, sessionUri=server.SESSION_URI)
+        assert blob.sessions == 0
+        assert server.requests[0] == (f'bytes */{fileSize}', 0)
+        assert server.requests[1][0].startswith(f'bytes {self.CHUNK_SIZE}-')
+        assert progress[0] == (server.SESSION_URI, 2*self.CHUNK_SIZE)
+        assert server.data == open(source_path, 'rb').read()
+
+        # An expired session is replaced by a new one
+        server.expired = True
+        progress = self.upload(cloud_storage, source_path, sessionUri=server.SESSION_URI)
+        assert blob.sessions == 1
+        assert progress[0] == (server.SESSION_URI, 0)
+        assert server.data == open(source_path, 'rb').read()
+
+        # A session that expires between chunks fails the upload with a transient exception
+        server.injected = [308, 410]
+        with pytest.raises(CloudStorageTransientException):
+            self.upload(cloud_storage, source_path)
+
+    def test_checksum_mismatch(self, cloud_storage, source_path):
+        server = cloud_storage.storageClient._http
+        blob = cloud_storage.storageClient.fakeBlob
+
+        # Corrupt the data persisted by the server
+        realPut = server.put
+        def put(url, data=None, headers=None, timeout=None):
+            if data:
+                data = b'corrupt' + data[7:]
+            return realPut(url, data=data, headers=headers, timeout=timeout)
+        server.put = put
+        with pytest.raises(CloudStorageObjectChecksumMismatchException):
+            self.upload(cloud_storage, source_path)
+        assert blob.deleted
+
+    def test_download_errors(self, cloud_storage):
+        blob = cloud_storage.storageClient.fakeBlob
+
+        # Client library errors are mapped so a restore records the file as failed
+        def notFound(fileObj, **kwargs):
+            raise googleExceptions.NotFound('No such object')
+        blob.download_to_file = notFound
+        with pytest.raises(CloudStorageObjectMissingException):
+            cloud_storage.downloadFileObject('file/resumable', None)
+        with pytest.raises(CloudStorageObjectMissingException):
+            cloud_storage._downloadRange('testBucket', 'file/resumable', None, 0, 10)
+
+        def dataCorruption(fileObj, **kwargs):
+            raise DataCorruption(None, 'Checksum mismatch')
+        blob.download_to_file = dataCorruption
+        with pytest.raises(CloudStorageObjectChecksumMismatchException):
+            cloud_storage.downloadFileObject('file/resumable', None)
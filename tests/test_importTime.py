@@ -0,0 +1,43 @@
+import os
+import sys
+import subprocess
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only loaded when exiftool, AcoustID, hash files or the cloud are actually used
+HEAVY_MODULES = ['exiftool', 'acoustid', 'jsonlines', 'requests', 'google.cloud.storage', 'google_crc32c']
+# Cumulative time to import mediaCatalog.mediaCatalog, in microseconds - about 50 ms now
+IMPORT_TIME_BUDGET = 300000
+
+
+def importTimes(args, runs=3):
+    ''' Run python -X importtime and return the fastest cumulative import time 
+        of each module over the runs, in microseconds
+    '''
+    env = dict(os.environ, PYTHONPATH=REPO_PATH)
+    times = {}
+    for i in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + args, env=env, cwd=REPO_PATH,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            selfTime, cumulativeTime, module = line[len('import time:'):].split('|')
+            module = module.strip()
+            times[module] = min(times.get(module, float('inf')), int(cumulativeTime))
+    return times
+
+
+class TestImportTime:
+    def test_import_time(self):
+        times = importTimes(['-c', 'import mediaCatalog.mediaCatalog'])
+        print(f"\nmediaCatalog.mediaCatalog imports in {times['mediaCatalog.mediaCatalog']/1000:.1f} ms")
+        assert not [module for module in HEAVY_MODULES if module in times]
+        assert times['mediaCatalog.mediaCatalog'] < IMPORT_TIME_BUDGET
+
+    def test_dispatcher_imports(self):
+        # Commands run in the dispatcher's interpreter, and don't load the heavy modules to start
+        for command in ['query', 'remove', 'stats']:
+            times = importTimes([os.path.join('scripts', 'mcat'), command, '--help'], runs=1)
+            assert 'mediaCatalog.mediaCatalog' in times
+            assert not [module for module in HEAVY_MODULES if module in times]
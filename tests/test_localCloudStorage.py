@@ -0,0 +1,216 @@
+import pytest
+import os
+import time
+from mediaCatalog.localCloudStorage import LocalCloudStorage
+from mediaCatalog.crc32cUtils import crc32cCombine
+from mediaCatalog.cloudStorage import (CloudStorage, 
+                                    createCloudStorage,
+                                    CloudStorageObjectMissingException, 
+                                    CloudStorageObjectSizeMismatchException, 
+                                    CloudStorageObjectChecksumMismatchException,
+                                    CloudStorageTransientException)
+
+class TestLocalCloudStorage:
+    @pytest.fixture
+    def cloud_storage(self, tmp_path):
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket')
+        cloudStorage.createBucket('testBucket')
+        return cloudStorage
+
+    @pytest.fixture
+    def source_path(self, tmp_path):
+        sourcePath = tmp_path / 'source.bin'
+        with open(sourcePath, 'wb') as f:
+            f.write(os.urandom(1000000))
+        return sourcePath
+
+    def test_init(self, tmp_path):
+        cloudStorage = createCloudStorage({'cloudStorageType': 'local', 'cloudProject': str(tmp_path), 'defaultCloudBucket': 'testBucket'})
+        assert isinstance(cloudStorage, LocalCloudStorage)
+        assert cloudStorage.projectId == str(tmp_path)
+        assert cloudStorage.bucketName == 'testBucket'
+
+        with pytest.raises(ValueError):
+            cloudStorage = LocalCloudStorage(tmp_path, None)
+
+        with pytest.raises(ValueError):
+            cloudStorage = LocalCloudStorage('', 'testBucket')
+
+        with pytest.raises(ValueError):
+            createCloudStorage({'cloudStorageType': 'INVALID', 'cloudProject': str(tmp_path), 'defaultCloudBucket': 'testBucket'})
+
+    def test_bucket_ops(self, cloud_storage):
+        cloudStorage = cloud_storage
+        assert 'testBucket' in cloudStorage.listBuckets()
+
+        cloudStorage.createBucket('otherBucket')
+        assert cloudStorage.listBuckets() == ['otherBucket', 'testBucket']
+        with pytest.raises(Exception):
+            cloudStorage.createBucket('otherBucket')
+
+        cloudStorage.deleteBucket('otherBucket')
+        assert 'otherBucket' not in cloudStorage.listBuckets()
+        with pytest.raises(Exception):
+            cloudStorage.deleteBucket('otherBucket')
+
+    def test_file_ops(self, cloud_storage, source_path, tmp_path):
+        cloudStorage = cloud_storage
+        objectName = 'file/0123abcd'
+        mimeType = 'image/jpeg'
+        downloadPath = tmp_path / 'cloud_download_test'
+        cloudChecksum = cloudStorage.computeChecksum(source_path)
+        fileSize = os.stat(source_path).st_size
+
+        assert not cloudStorage.listFiles()
+        with pytest.raises(CloudStorageObjectMissingException):
+            cloudStorage.validateFile(objectName)
+
+        cloudStorage.uploadFile(source_path, objectName, mimeType)
+        assert cloudStorage.fileExists(objectName)
+        assert cloudStorage.listFiles() == [objectName]
+        assert cloudStorage.listFiles(extended=True) == [(objectName, fileSize, cloudChecksum)]
+
+        with pytest.raises(CloudStorageObjectSizeMismatchException):
+            cloudStorage.validateFile(objectName, fileSize=-1)
+        with pytest.raises(CloudStorageObjectChecksumMismatchException):
+            cloudStorage.validateFile(objectName, checksum=-1)
+
+        assert cloudStorage.getMimeType(objectName) == mimeType
+        assert cloudStorage.getChecksum(objectName) == cloudChecksum
+        assert cloudStorage.getSize(objectName) == fileSize
+        assert cloudStorage.validateFile(objectName, fileSize=fileSize, checksum=cloudChecksum)
+        assert cloudStorage.validateFile(objectName, sourcePath=source_path)
+
+        cloudStorage.downloadFile(objectName, downloadPath)
+        assert cloudStorage.computeChecksum(downloadPath) == cloudChecksum
+
+        cloudStorage.deleteFile(objectName)
+        assert not cloudStorage.listFiles()
+        with pytest.raises(CloudStorageObjectMissingException):
+            cloudStorage.deleteFile(objectName)
+
+        # Object names may not escape the bucket
+        with pytest.raises(ValueError):
+            cloudStorage.uploadFile(source_path, '/absolute/name')
+        with pytest.raises(ValueError):
+            cloudStorage.uploadFile(source_path, 'file/../../escape')
+
+    def test_list_prefix_delimiter(self, cloud_storage, source_path):
+        cloudStorage = cloud_storage
+        for objectName in ['file/b', 'file/a', 'file/sub/c', 'catalog/catalog.db', 'top']:
+            cloudStorage.uploadFile(source_path, objectName)
+
+        assert cloudStorage.listFiles() == ['catalog/catalog.db', 'file/a', 'file/b', 'file/sub/c', 'top']
+        assert cloudStorage.listFiles(prefix='file/') == ['file/a', 'file/b', 'file/sub/c']
+        assert cloudStorage.listFiles(prefix='file/', delimiter='/') == ['file/a', 'file/b']
+        assert cloudStorage.listFiles(delimiter='/') == ['top']
+
+    def test_resumable_upload(self, tmp_path, source_path):
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=256*1024)
+        cloudStorage.createBucket('testBucket')
+        objectName = 'file/resumable'
+
+        # Interrupt the upload after the second chunk
+        progress = []
+        def interrupt(sessionUri, bytesUploaded):
+            progress.append((sessionUri, bytesUploaded))
+            if len(progress) == 3:
+                raise KeyboardInterrupt
+        with pytest.raises(KeyboardInterrupt):
+            cloudStorage.uploadFile(source_path, objectName, sessionUri=None, progressCallback=interrupt)
+        assert not cloudStorage.fileExists(objectName)
+        sessionUri, bytesUploaded = progress[-1]
+        assert bytesUploaded == 2*256*1024
+
+        # Resume the session
+        progress = []
+        cloudStorage.uploadFile(source_path, objectName, sessionUri=sessionUri, progressCallback=lambda *args: progress.append(args))
+        assert progress[0] == (sessionUri, 3*256*1024)
+        assert cloudStorage.validateFile(objectName, sourcePath=source_path)
+
+    def test_failure_injection(self, tmp_path, source_path):
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', seed=0)
+        cloudStorage.createBucket('testBucket')
+        cloudStorage.INITIAL_RETRY_DELAY = 0.001
+        cloudStorage.failureRate = 0.3
+
+        # Transient failures are retried
+        for i in range(10):
+            cloudStorage.uploadFile(source_path, f'file/{i}')
+        cloudStorage.failureRate = 0.0
+        assert len(cloudStorage.listFiles()) == 10
+
+        # Retries are eventually exhausted
+        cloudStorage.failureRate = 1.0
+        with pytest.raises(CloudStorageTransientException):
+            cloudStorage.uploadFile(source_path, 'file/fail')
+
+    def test_bandwidth(self, tmp_path, source_path):
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', bandwidth=10*1024*1024)
+        cloudStorage.createBucket('testBucket')
+        startTime = time.monotonic()
+        cloudStorage.uploadFile(source_path, 'file/throttled')
+        assert time.monotonic() - startTime >= 0.09
+
+    def test_crc32c_combine(self, cloud_storage, tmp_path):
+        for length1, length2 in [(0, 0), (0, 10), (10, 0), (1, 1), (1000, 12345), (65536, 3)]:
+            data1 = os.urandom(length1)
+            data2 = os.urandom(length2)
+            paths = []
+            for i, data in enumerate([data1, data2, data1 + data2]):
+                paths.append(tmp_path / f'crc{i}')
+                with open(paths[-1], 'wb') as f:
+                    f.write(data)
+            crc1, crc2, crcCombined = [cloud_storage.computeChecksum(path) for path in paths]
+            assert crc32cCombine(crc1, crc2, length2) == crcCombined
+
+    def test_sliced_download(self, cloud_storage, source_path, tmp_path, monkeypatch):
+        cloudStorage = cloud_storage
+        objectName = 'file/sliced'
+        downloadPath = tmp_path / 'sliced_download'
+        cloudStorage.uploadFile(source_path, objectName)
+
+        cloudStorage.SLICED_DOWNLOAD_THRESHOLD = 100000
+        cloudStorage.SLICED_DOWNLOAD_MIN_SLICE_SIZE = 300000
+        assert cloudStorage.getNumSlices(99999) == 1
+        assert cloudStorage.getNumSlices(1000000) == 4
+        cloudStorage.SLICED_DOWNLOAD_MAX_SLICES = 3
+        assert cloudStorage.getNumSlices(1000000) == 3
+
+        for numSlices in [None, 1, 7]:
+            cloudStorage.downloadFileSliced(objectName, downloadPath, numSlices=numSlices)
+            assert open(downloadPath, 'rb').read() == open(source_path, 'rb').read()
+
+        # Corrupt the data of a slice in transit - the combined checksum should not match
+        downloadRange = cloudStorage._downloadRange
+        def corruptRange(bucketName, objectName, fileObj, start, end):
+            if start == 0:
+                write = fileObj.write
+                fileObj.write = lambda data: write(b'corrupt' + bytes(data[7:]))
+            downloadRange(bucketName, objectName, fileObj, start, end)
+        monkeypatch.setattr(cloudStorage, '_downloadRange', corruptRange)
+        with pytest.raises(CloudStorageObjectChecksumMismatchException):
+            cloudStorage.downloadFileSliced(objectName, downloadPath, numSlices=4)
+        assert not os.path.exists(downloadPath)
+
+        # A missing object fails like the other backend methods
+        with pytest.raises(CloudStorageObjectMissingException):
+            downloadRange(cloudStorage.bucketName, 'file/missing', None, 0, 10)
+
+    def test_list_objects(self, cloud_storage, source_path):
+        cloudStorage = cloud_storage
+        for objectName in ['file/b', 'file/a', 'other/c']:
+            cloudStorage.uploadFile(source_path, objectName)
+        checksum = cloudStorage.computeChecksum(source_path)
+        fileSize = os.stat(source_path).st_size
+
+        objects = list(cloudStorage.listObjects(prefix='file/'))
+        assert [info[:3] for info in objects] == [('file/a', fileSize, checksum), ('file/b', fileSize, checksum)]
+        assert cloudStorage.getObjectInfo('file/a') == objects[0]
+
+        # Overwriting an object gives it a new generation
+        cloudStorage.uploadFile(source_path, 'file/a')
+        assert cloudStorage.getObjectInfo('file/a')[3] > objects[0][3]
+
+        with pytest.raises(CloudStorageObjectMissingException):
+            cloudStorage.getObjectInfo('file/missing')
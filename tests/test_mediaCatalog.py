@@ -2,7 +2,11 @@ import pytest
 import os
 import shutil
 import yaml
+import hashlib
+import datetime
 from mediaCatalog.mediaCatalog import MediaCatalog
+from mediaCatalog import mediaCatalog
+from mediaCatalog.utils import sha256sum, md5sum, getChecksumXattr
 
 class TestMediaCatalog:
     @pytest.fixture
@@ -112,6 +116,187 @@ class TestMediaCatalog:
         assert catalog.verify(local=True)
         assert catalog.verify(local=True, verifyChecksum=True)
 
+    def test_verify_local_parallel(self, synthetic_catalog, synthetic_data_dir):
+        catalog = synthetic_catalog
+        catalog.config['verifyWorkers'] = 3
+        assert catalog.verify(local=True, verifyChecksum=True)
+
+        # Remove a whole directory, truncate one file and overwrite another with same-size data
+        albumDir = synthetic_data_dir / 'album1'
+        shutil.rmtree(synthetic_data_dir / 'album1_duplicate')
+        with open(albumDir / 'IMG_0001.JPG', 'r+b') as f:
+            f.truncate(10)
+        with open(albumDir / 'IMG_0002.JPG', 'r+b') as f:
+            f.write(b'changed')
+        results = catalog._verifyLocal(None, 7, verifyChecksum=False)
+        assert (results['found'], results['missing'], results['changed']) == (4, 2, 1)
+        results = catalog._verifyLocal(None, 7, verifyChecksum=True)
+        assert (results['found'], results['missing'], results['changed']) == (3, 2, 2)
+        assert len(results['verifiedIds']) == 3
+        assert not catalog.verify(local=True)
+
+        # Only the files under path are verified
+        assert not catalog.verify(path=albumDir, local=True)
+        os.makedirs(synthetic_data_dir / 'album1_duplicate')
+        assert not catalog.verify(path=synthetic_data_dir / 'album1_duplicate', local=True)
+
+    def test_verify_rolling(self, synthetic_catalog, capsys):
+        catalog = synthetic_catalog
+        def lastVerified():
+            return {record['id']: record['last_verified_local'] for record in catalog.catalogDb.read(all=True)}
+        assert all(verified is None for verified in lastVerified().values())
+
+        # Each run verifies at least 500000 bytes, starting with the files that were never verified
+        assert catalog.verify(local=True, verifyChecksum=True, budget=500000)
+        firstRun = [fileId for fileId, verified in lastVerified().items() if verified]
+        assert 0 < len(firstRun) < 7
+        assert 'Local files not verified in 30 days: ' in capsys.readouterr().out
+
+        # The next run continues with the rest before re-verifying any file
+        catalog.catalogDb.setLastVerified(firstRun, 'local', '2024-01-01 00:00:00')
+        assert catalog.verify(local=True, verifyChecksum=True, budget='500K')
+        secondRun = [fileId for fileId, verified in lastVerified().items() if verified and verified != '2024-01-01 00:00:00']
+        assert secondRun and not set(firstRun) & set(secondRun)
+
+        # A full verification stamps every file
+        assert catalog.verify(local=True)
+        assert all(lastVerified().values())
+        assert catalog.catalogDb.getUnverifiedFileCount('local', 30) == 0
+        assert 'Local files not verified in 30 days: 0' in capsys.readouterr().out
+
+        # The auto budget is a cycle's share of the catalog, and time budgets are supported
+        catalog.config['verifyCycleDays'] = 1
+        assert catalog.verify(local=True, budget='auto')
+        assert catalog.verify(local=True, budget='1min')
+        with pytest.raises(ValueError):
+            catalog.verify(local=True, budget='soon')
+
+    def test_catalog_resume(self, catalog_dir, synthetic_data_dir, monkeypatch):
+        catalog = MediaCatalog(catalog_dir, create=True)
+        monkeypatch.setattr(mediaCatalog, 'getMimeTypes', lambda filePaths: ['image/jpeg']*len(filePaths))
+        metadataRead = []
+        def getMetadata(files, run):
+            metadataRead.extend(files)
+            return [{'File:FileName': os.path.basename(file), 'File:Directory': os.path.dirname(file),
+                     'File:FileSize': os.path.getsize(file), 'File:FileModifyDate': '2024:01:01 12:00:00+00:00',
+                     'File:MIMEType': 'image/jpeg', 'Run': run} for file in files]
+
+        # The run stops after writing the metadata of the first file in album1_duplicate
+        monkeypatch.setattr(catalog, '_getMetadata', lambda files: getMetadata(files, 1))
+        write = catalog.metadataCatalog.write
+        def interruptedWrite(md, updateMode=False):
+            if md['File:Directory'].endswith('album1_duplicate') and md['File:FileName'] == 'IMG_0003.JPG':
+                raise KeyboardInterrupt
+            return write(md, updateMode)
+        monkeypatch.setattr(catalog.metadataCatalog, 'write', interruptedWrite)
+        with pytest.raises(KeyboardInterrupt):
+            catalog.catalog(synthetic_data_dir)
+        catalog.catalogDb.rollback()
+        assert len(catalog.catalogDb.read(all=True)) == 5
+
+        # The resumed run skips album1 and rewrites the metadata of the interrupted batch
+        metadataRead.clear()
+        monkeypatch.setattr(catalog, '_getMetadata', lambda files: getMetadata(files, 2))
+        monkeypatch.setattr(catalog.metadataCatalog, 'write', write)
+        newFiles, updatedFiles, skippedFiles, failedFiles = catalog.catalog(synthetic_data_dir)
+        assert sorted(os.path.basename(file) for file in metadataRead) == ['IMG_0000.JPG', 'IMG_0003.JPG']
+        assert len(newFiles) == 2
+        assert len(catalog.catalogDb.read(all=True)) == 7
+        md, _ = catalog.metadataCatalog.read(catalog.checksum(synthetic_data_dir / 'album1_duplicate' / 'IMG_0000.JPG'),
+                                             filename='IMG_0000.JPG', directory=str(synthetic_data_dir / 'album1_duplicate'))
+        assert md['Run'] == 2
+        assert not os.path.exists(catalog.catalogJournalPath)
+
+        # Files already in the catalog are skipped without being read
+        metadataRead.clear()
+        newFiles, updatedFiles, skippedFiles, failedFiles = catalog.catalog(synthetic_data_dir)
+        assert metadataRead == []
+        assert len(skippedFiles) == 7
+        catalog.close()
+
+    def test_catalog_detect_moves(self, catalog_dir, synthetic_data_dir, monkeypatch):
+        catalog = MediaCatalog(catalog_dir, create=True)
+        monkeypatch.setattr(mediaCatalog, 'getMimeTypes', lambda filePaths: ['image/jpeg']*len(filePaths))
+        def getMetadata(files):
+            return [{'File:FileName': os.path.basename(file), 'File:Directory': os.path.dirname(file),
+                     'File:FileSize': os.path.getsize(file), 'File:MIMEType': 'image/jpeg',
+                     'File:FileModifyDate': datetime.datetime.fromtimestamp(os.path.getmtime(file), datetime.timezone.utc).strftime('%Y:%m:%d %H:%M:%S%z')}
+                    for file in files]
+        monkeypatch.setattr(catalog, '_getMetadata', getMetadata)
+        catalog.catalog(synthetic_data_dir)
+        checksums = {record['file_name']: record['checksum'] for record in catalog.catalogDb.read(directory=str(synthetic_data_dir / 'album1'))}
+
+        # Reorganize: a move keeping the name, a move with a rename, and a new file
+        albumDir = synthetic_data_dir / 'album1'
+        newAlbumDir = synthetic_data_dir / '2024' / 'album2'
+        os.makedirs(newAlbumDir)
+        os.rename(albumDir / 'IMG_0001.JPG', newAlbumDir / 'IMG_0001.JPG')
+        os.rename(albumDir / 'IMG_0002.JPG', newAlbumDir / 'renamed.JPG')
+        with open(newAlbumDir / 'new.JPG', 'wb') as f:
+            f.write(os.urandom(1000))
+
+        hashed = []
+        checksum = catalog._checksum
+        def countingChecksum(path, mode, useCache=True):
+            hashed.append(os.path.basename(path))
+            return checksum(path, mode, useCache)
+        monkeypatch.setattr(catalog, '_checksum', countingChecksum)
+        newFiles, updatedFiles, skippedFiles, failedFiles = catalog.catalog(synthetic_data_dir)
+        assert [os.path.basename(file) for file, checksum in newFiles] == ['new.JPG']
+        assert sorted(hashed) == ['new.JPG', 'renamed.JPG']
+
+        # The moved records keep their checksums and metadata, without duplicates
+        assert len(catalog.catalogDb.read(all=True)) == 8
+        with pytest.raises(KeyError):
+            catalog.catalogDb.read(filename='IMG_0002.JPG', directory=str(albumDir))
+        assert catalog.catalogDb.read(filename='IMG_0001.JPG', directory=str(newAlbumDir))[0]['checksum'] == checksums['IMG_0001.JPG']
+        record = catalog.catalogDb.read(filename='renamed.JPG', directory=str(newAlbumDir))[0]
+        assert record['checksum'] == checksums['IMG_0002.JPG']
+        metadata, _ = catalog.metadataCatalog.read(record['checksum'], filename='renamed.JPG', directory=str(newAlbumDir))
+        assert metadata['SourceFile'] == str(newAlbumDir / 'renamed.JPG')
+        assert len(catalog.metadataCatalog.read(record['checksum'], all=True)) == 1
+        catalog.close()
+
+    def test_ingest(self, synthetic_catalog, synthetic_data_dir, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        monkeypatch.setattr(mediaCatalog, 'getMimeTypes', lambda filePaths: ['image/jpeg']*len(filePaths))
+        monkeypatch.setattr(catalog, '_getMetadata', lambda files: [{'File:FileName': os.path.basename(file), 'File:Directory': os.path.dirname(file),
+                                                                     'File:FileSize': os.path.getsize(file), 'File:FileModifyDate': '2024:01:01 12:00:00+00:00',
+                                                                     'File:MIMEType': 'image/jpeg'} for file in files])
+        def checksum(path, mode, useCache=True):
+            raise AssertionError(f'{path} was read again')
+        monkeypatch.setattr(catalog, '_checksum', checksum)
+
+        # A card with an archived photo, two new ones, a copy of one of them, a sidecar and system files
+        cardDir = tmp_path / 'card' / 'DCIM' / '100CANON'
+        os.makedirs(cardDir)
+        shutil.copy2(synthetic_data_dir / 'album1' / 'IMG_0000.JPG', cardDir / 'IMG_1000.JPG')
+        for name in ['IMG_1001.JPG', 'IMG_1002.JPG']:
+            with open(cardDir / name, 'wb') as f:
+                f.write(os.urandom(5000))
+        shutil.copy2(cardDir / 'IMG_1002.JPG', cardDir / 'IMG_1003.JPG')
+        with open(cardDir / 'IMG_1001.xmp', 'w') as f:
+            f.write('<x:xmpmeta/>')
+        with open(cardDir / '.DS_Store', 'wb') as f:
+            f.write(b'\x00')
+
+        destinationDir = tmp_path / 'nas'
+        copiedFiles, duplicateFiles, skippedFiles, failedFiles = catalog.ingest(tmp_path / 'card', destinationDir)
+        newDir = destinationDir / 'DCIM' / '100CANON'
+        assert sorted(os.listdir(newDir)) == ['IMG_1001.JPG', 'IMG_1001.xmp', 'IMG_1002.JPG']
+        assert sorted(os.path.basename(source) for source, checksum in duplicateFiles) == ['IMG_1000.JPG', 'IMG_1003.JPG']
+        assert failedFiles == []
+        for name in ['IMG_1001.JPG', 'IMG_1002.JPG']:
+            record = catalog.catalogDb.read(filename=name, directory=str(newDir))[0]
+            assert record['checksum'] == sha256sum(newDir / name)
+            assert os.path.getmtime(newDir / name) == os.path.getmtime(cardDir / name)
+        assert len(catalog.catalogDb.read(all=True)) == 9
+
+        # Running it again copies nothing
+        copiedFiles, duplicateFiles, skippedFiles, failedFiles = catalog.ingest(tmp_path / 'card', destinationDir)
+        assert copiedFiles == []
+        assert len(skippedFiles) == 3
+
     def test_query(self, sample_catalog, sample_data_dir):
         catalog = sample_catalog
         filename = 'IMG_0731.JPG'
@@ -271,6 +456,58 @@ class TestMediaCatalog:
         assert len(checksum) == 64  # SHA256 checksum should be 64 characters long
         assert checksum == 'f2ca1bb6c7e907d06dafe4687e579fce76b37e4e93b7605022da52e6ccc26fd2'
 
+    def test_checksum_io_modes(self, new_catalog, tmp_path):
+        # Larger than the read size and not a multiple of the alignment
+        test_file = tmp_path / 'test.bin'
+        data = os.urandom(3*1024*1024 + 123)
+        with open(test_file, 'wb') as f:
+            f.write(data)
+        expected = hashlib.sha256(data).hexdigest()
+        for ioMode in ['buffered', 'fadvise', 'direct']:
+            new_catalog.config['hashIoMode'] = ioMode
+            assert new_catalog.checksum(test_file) == expected
+            assert sha256sum(test_file, chunkSize=1000000, ioMode=ioMode) == expected
+            assert md5sum(test_file, ioMode=ioMode) == hashlib.md5(data).hexdigest()
+        with pytest.raises(ValueError):
+            sha256sum(test_file, ioMode='mmap')
+
+    def test_checksum_xattr(self, synthetic_catalog, synthetic_data_dir, tmp_path, monkeypatch):
+        catalog = synthetic_catalog
+        catalog.config['checksumXattr'] = True
+        path = str(synthetic_data_dir / 'album1' / 'IMG_0000.JPG')
+        expected = sha256sum(path)
+
+        hashed = []
+        def countingSha256sum(filename, *args):
+            hashed.append(filename)
+            return sha256sum(filename, *args)
+        monkeypatch.setattr(mediaCatalog, 'sha256sum', countingSha256sum)
+
+        assert catalog.checksum(path) == expected
+        assert getChecksumXattr(path) == expected
+        assert catalog.checksum(path) == expected
+        assert len(hashed) == 1
+
+        # Copies that keep the attribute and times are trusted anywhere
+        copyPath = str(tmp_path / 'copy.JPG')
+        shutil.copy2(path, copyPath)
+        assert catalog.checksum(copyPath) == expected
+        assert len(hashed) == 1
+
+        # A changed file is hashed again
+        with open(copyPath, 'ab') as f:
+            f.write(b'more')
+        assert catalog.checksum(copyPath) != expected
+        assert len(hashed) == 2
+
+        # Checksum verification doesn't trust the attribute, so it finds silent corruption
+        stat = os.stat(path)
+        with open(path, 'r+b') as f:
+            f.write(b'rot')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert catalog.checksum(path) == expected
+        assert not catalog.verify(path=os.path.dirname(path), local=True, verifyChecksum=True)
+
     def test_invalid_checksum_mode(self, new_catalog):
         with pytest.raises(ValueError):
             new_catalog._checksum('test.txt', 'INVALID')
@@ -0,0 +1,121 @@
+import pytest
+import os
+import time
+import datetime
+import threading
+from mediaCatalog.localCloudStorage import LocalCloudStorage
+from mediaCatalog.cloudStorage import CloudStorageTransientException
+from mediaCatalog.transferScheduler import TransferScheduler, TransferWindow, TokenBucket, parseByteSize
+
+class TestTransferScheduler:
+    def test_parse_byte_size(self):
+        assert parseByteSize(None) is None
+        assert parseByteSize(0) is None
+        assert parseByteSize(1500) == 1500
+        assert parseByteSize('500K') == 500*1024
+        assert parseByteSize('2.5M') == 2.5*1024**2
+        assert parseByteSize('1GB') == 1024**3
+        with pytest.raises(ValueError):
+            parseByteSize('fast')
+
+    def test_transfer_window(self):
+        window = TransferWindow('09:00-17:00')
+        assert window.contains(datetime.datetime(2024, 1, 1, 12, 0))
+        assert not window.contains(datetime.datetime(2024, 1, 1, 17, 0))
+        assert window.secondsUntilOpen(datetime.datetime(2024, 1, 1, 8, 30)) == 30*60
+        assert window.secondsUntilOpen(datetime.datetime(2024, 1, 1, 18, 0)) == 15*3600
+
+        # Windows wrap around midnight
+        window = TransferWindow('22:00-07:00')
+        assert window.contains(datetime.datetime(2024, 1, 1, 23, 0))
+        assert window.contains(datetime.datetime(2024, 1, 1, 6, 59))
+        assert not window.contains(datetime.datetime(2024, 1, 1, 12, 0))
+        assert window.secondsUntilOpen(datetime.datetime(2024, 1, 1, 21, 0)) == 3600
+
+        scheduler = TransferScheduler(windows=['01:00-02:00', '22:00-07:00'])
+        assert scheduler.inWindow(datetime.datetime(2024, 1, 1, 23, 0))
+        assert not scheduler.inWindow(datetime.datetime(2024, 1, 1, 12, 0))
+        assert scheduler.secondsUntilWindow(datetime.datetime(2024, 1, 1, 12, 0)) == 10*3600
+
+        with pytest.raises(ValueError):
+            TransferWindow('22-07')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100000)
+        startTime = time.monotonic()
+        # The first second is the burst, then 100000 bytes take one second
+        for i in range(4):
+            bucket.consume(50000)
+        assert time.monotonic() - startTime >= 0.9
+
+    def test_run(self):
+        scheduler = TransferScheduler(maxWorkers=3)
+        mainThread = threading.get_ident()
+        calls = []
+        results = []
+        def function(i):
+            scheduler.callInMainThread(lambda: calls.append((i, threading.get_ident())))
+            if i == 3:
+                raise CloudStorageTransientException('testBucket', str(i))
+            return i*2
+        def onResult(task, result, exception):
+            # Calls queued by a task are run before its result is handled
+            assert task[0] in [call[0] for call in calls]
+            results.append((task[0], result, type(exception)))
+        scheduler.run([(i,) for i in range(6)], function, onResult)
+
+        assert sorted(results) == [(i, None if i == 3 else i*2, CloudStorageTransientException if i == 3 else type(None)) for i in range(6)]
+        assert all(threadId == mainThread for i, threadId in calls)
+        assert scheduler.errors == 1
+
+        # Without onResult, exceptions are raised
+        with pytest.raises(CloudStorageTransientException):
+            scheduler.run([(3,)], function)
+
+    def test_adapt(self):
+        scheduler = TransferScheduler(maxWorkers=4)
+        scheduler.adaptTime = 0.0
+        def adapt(bytesPerSecond, errors=0, saturated=True):
+            scheduler.bytesTransferred += bytesPerSecond*scheduler.ADAPT_INTERVAL
+            scheduler.errors += errors
+            scheduler._adapt(saturated, now=scheduler.adaptTime + scheduler.ADAPT_INTERVAL)
+            return scheduler.concurrency
+
+        # Additive increase while throughput improves
+        assert adapt(100) == 2
+        assert adapt(200) == 3
+        # No increase if nothing is waiting for a worker
+        assert adapt(300, saturated=False) == 3
+        assert adapt(300) == 4
+        assert adapt(400) == 4
+        # Multiplicative decrease on errors
+        assert adapt(400, errors=2) == 2
+        assert adapt(100, errors=1) == 1
+        assert adapt(100, errors=1) == 1
+        # Back off if the last increase made things worse
+        assert adapt(100) == 2
+        assert adapt(50) == 1
+
+        # Hold at the bandwidth cap
+        scheduler = TransferScheduler(bandwidthLimit=1000, maxWorkers=4)
+        scheduler.adaptTime = 0.0
+        assert adapt(500) == 2
+        assert adapt(950) == 2
+
+    def test_rate_limit(self, tmp_path):
+        sourcePath = tmp_path / 'source'
+        with open(sourcePath, 'wb') as f:
+            f.write(os.urandom(300000))
+        cloudStorage = LocalCloudStorage(tmp_path / 'cloud', 'testBucket', chunkSize=100000)
+        cloudStorage.createBucket('testBucket')
+        cloudStorage.TRANSFER_CHUNK_SIZE = 10000
+        scheduler = TransferScheduler(bandwidthLimit=200000)
+        cloudStorage.setRateLimiter(scheduler)
+
+        # 300000 bytes up and down at 200000 bytes/s after a one second burst
+        startTime = time.monotonic()
+        cloudStorage.uploadFile(sourcePath, 'file/limited')
+        with open(tmp_path / 'download', 'wb') as f:
+            cloudStorage.downloadFileObject('file/limited', f)
+        assert time.monotonic() - startTime >= 1.9
+        assert scheduler.bytesTransferred == 600000